@@ -3,17 +3,120 @@ from dotenv import load_dotenv
 import json
 import logging
 import sys
+from typing import List
 
 load_dotenv()
 
 class Settings:
     FEISHU_AUTH_JSON: str = os.getenv("FEISHU_AUTH_JSON", "{}")
+    # 认证信息文件 (与 FEISHU_AUTH_JSON 格式相同)。设置后优先使用，修改文件即热更新，无需重启
+    FEISHU_AUTH_FILE: str = os.getenv("FEISHU_AUTH_FILE", "")
+    FEISHU_AUTH_POLL_INTERVAL: float = float(os.getenv("FEISHU_AUTH_POLL_INTERVAL", "2"))
     DEFAULT_CHAT_ID: str = os.getenv("DEFAULT_CHAT_ID", "")
     API_MASTER_KEY: str = os.getenv("API_MASTER_KEY", "")
 
     DEFAULT_USER_AGENT: str = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     DEFAULT_REFERER: str = "https://www.feishu.cn/messenger/"
 
+    # --- 上游 HTTP 传输层配置 ---
+    # 飞书网关地址。压测时可指向 bench/gateway_sim.py 启动的本地模拟网关
+    FEISHU_BASE_URL: str = os.getenv("FEISHU_BASE_URL", "https://internal-api-lark-api.feishu.cn").rstrip("/")
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+    HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    HTTP_MAX_KEEPALIVE: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT: float = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+    HTTP_STREAM_READ_TIMEOUT: float = float(os.getenv("HTTP_STREAM_READ_TIMEOUT", "60"))
+
+    # --- Provider 复用池配置 ---
+    PROVIDER_POOL_SIZE: int = int(os.getenv("PROVIDER_POOL_SIZE", "32"))
+    PROVIDER_IDLE_TTL: float = float(os.getenv("PROVIDER_IDLE_TTL", "600"))
+
+    # --- 实时消息订阅扇出配置 ---
+    WS_QUEUE_SIZE: int = int(os.getenv("WS_QUEUE_SIZE", "256"))
+    WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")  # drop (丢最旧) | drop_newest | disconnect
+    WS_BATCH_MAX: int = int(os.getenv("WS_BATCH_MAX", "100"))  # 批量模式 (batch=true) 下每帧最多包含的消息数
+    WS_BATCH_WINDOW_MS: float = float(os.getenv("WS_BATCH_WINDOW_MS", "5"))  # 批量模式下收到第一条消息后最多再等待的毫秒数
+    WS_SEND_TIMEOUT: float = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # 单帧发送超时，超时按慢消费者断开
+
+    # --- 实时流去重与断线补齐 ---
+    STREAM_DEDUP_CAPACITY: int = int(os.getenv("STREAM_DEDUP_CAPACITY", "4096"))  # 每个会话记住的最近 message_id 数量
+    STREAM_CATCH_UP_COUNT: int = int(os.getenv("STREAM_CATCH_UP_COUNT", "50"))  # 建立订阅时用于初始化去重状态的历史条数
+    STREAM_BACKFILL_MAX: int = int(os.getenv("STREAM_BACKFILL_MAX", "1000"))  # 重连后每个会话最多补齐的消息数
+    STREAM_BACKFILL_LOOKBACK_MS: int = int(os.getenv("STREAM_BACKFILL_LOOKBACK_MS", "300000"))  # 补齐时从最后一条已投递消息再往前回看的毫秒数 (覆盖乱序到达的消息)
+
+    # --- 断线续传 (WebSocket since 令牌) ---
+    REPLAY_BUFFER_SIZE: int = int(os.getenv("REPLAY_BUFFER_SIZE", "500"))  # 每个会话保留的最近实时消息数
+    REPLAY_BUFFER_CHATS: int = int(os.getenv("REPLAY_BUFFER_CHATS", "1024"))
+    REPLAY_HISTORY_MAX: int = int(os.getenv("REPLAY_HISTORY_MAX", "1000"))  # 回退到历史消息时最多重放的条数
+
+    # --- 多 worker / 多节点部署 (留空为单进程直连上游) ---
+    # memory:// 为进程内总线，redis://host:6379/0 时各 worker / 容器通过 Redis 共享上游长轮询
+    CLUSTER_BUS_URL: str = os.getenv("CLUSTER_BUS_URL", "")
+    CLUSTER_LEASE_TTL: float = float(os.getenv("CLUSTER_LEASE_TTL", "10"))  # 上游租约有效期，持有节点失联后最迟这么久被接管
+    CLUSTER_INTEREST_INTERVAL: float = float(os.getenv("CLUSTER_INTEREST_INTERVAL", "1"))  # 同步各节点订阅会话的间隔
+
+    # --- 上游限流、退避与熔断配置 (速率单位: 请求/秒，按 cookie + command id 计) ---
+    UPSTREAM_HISTORY_RATE: float = float(os.getenv("UPSTREAM_HISTORY_RATE", "5"))
+    UPSTREAM_HISTORY_BURST: float = float(os.getenv("UPSTREAM_HISTORY_BURST", "10"))
+    UPSTREAM_STREAM_RATE: float = float(os.getenv("UPSTREAM_STREAM_RATE", "2"))
+    UPSTREAM_STREAM_BURST: float = float(os.getenv("UPSTREAM_STREAM_BURST", "4"))
+    UPSTREAM_HISTORY_RETRIES: int = int(os.getenv("UPSTREAM_HISTORY_RETRIES", "2"))
+    UPSTREAM_BACKOFF_BASE: float = float(os.getenv("UPSTREAM_BACKOFF_BASE", "1"))
+    UPSTREAM_BACKOFF_MAX: float = float(os.getenv("UPSTREAM_BACKOFF_MAX", "60"))
+    CIRCUIT_BREAKER_THRESHOLD: int = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "3"))
+    CIRCUIT_BREAKER_COOLDOWN: float = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", "300"))
+    UPSTREAM_LIMIT_IDLE_TTL: float = float(os.getenv("UPSTREAM_LIMIT_IDLE_TTL", "600"))  # 按 cookie 的令牌桶与熔断器空闲多久后清理
+
+    # --- 本地消息存储配置 ---
+    MESSAGE_STORE_ENABLED: bool = os.getenv("MESSAGE_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+    MESSAGE_STORE_PATH: str = os.getenv("MESSAGE_STORE_PATH", "data/messages.db")
+    # 最新一页在多少秒内视为新鲜 (无实时流覆盖时)，超过后 cursor="0" 会重新向上游确认
+    MESSAGE_STORE_HEAD_TTL: float = float(os.getenv("MESSAGE_STORE_HEAD_TTL", "2"))
+    MESSAGE_STORE_LIVE_GRACE: float = float(os.getenv("MESSAGE_STORE_LIVE_GRACE", "1"))
+    # 有实时流覆盖的会话最多多少秒也要重新同步一次最新一页 (实时流断线补齐不完整时兜底)
+    MESSAGE_STORE_LIVE_MAX_AGE: float = float(os.getenv("MESSAGE_STORE_LIVE_MAX_AGE", "300"))
+
+    # --- 历史分页内存缓存配置 (HISTORY_CACHE_SIZE=0 关闭缓存) ---
+    HISTORY_CACHE_SIZE: int = int(os.getenv("HISTORY_CACHE_SIZE", "1024"))
+    HISTORY_CACHE_HEAD_TTL: float = float(os.getenv("HISTORY_CACHE_HEAD_TTL", "3"))
+    HISTORY_CACHE_PAGE_TTL: float = float(os.getenv("HISTORY_CACHE_PAGE_TTL", "3600"))
+
+    # --- 分页导出配置 ---
+    EXPORT_PAGE_SIZE: int = int(os.getenv("EXPORT_PAGE_SIZE", "200"))
+    EXPORT_MAX_MESSAGES: int = int(os.getenv("EXPORT_MAX_MESSAGES", "50000"))
+    EXPORT_CONCURRENCY: int = int(os.getenv("EXPORT_CONCURRENCY", "8"))
+
+    # --- 后台导出任务配置 ---
+    EXPORT_JOBS_DIR: str = os.getenv("EXPORT_JOBS_DIR", "data/export_jobs")
+    EXPORT_JOB_WORKERS: int = int(os.getenv("EXPORT_JOB_WORKERS", "4"))
+    EXPORT_JOB_PER_CREDENTIAL: int = int(os.getenv("EXPORT_JOB_PER_CREDENTIAL", "2"))
+    EXPORT_JOB_TTL: float = float(os.getenv("EXPORT_JOB_TTL", str(7 * 24 * 3600)))  # 已结束任务 (含结果文件) 的保留秒数
+
+    # --- OpenAI 兼容接口 (/v1/chat/completions) ---
+    COMPLETION_MAX_CONCURRENCY: int = int(os.getenv("COMPLETION_MAX_CONCURRENCY", "32"))  # 同时处理的请求数 (含进行中的流式响应)
+    COMPLETION_QUEUE_TIMEOUT: float = float(os.getenv("COMPLETION_QUEUE_TIMEOUT", "5"))  # 等待并发名额的最长秒数，超时返回 429
+    COMPLETION_QUOTA_RPM: float = float(os.getenv("COMPLETION_QUOTA_RPM", "60"))  # 每个 API 密钥每分钟请求数，0 为不限
+    COMPLETION_QUOTA_BURST: float = float(os.getenv("COMPLETION_QUOTA_BURST", "10"))
+    COMPLETION_HISTORY_COUNT: int = int(os.getenv("COMPLETION_HISTORY_COUNT", "50"))  # 非流式响应默认包含的历史消息数
+    COMPLETION_STREAM_TIMEOUT: float = float(os.getenv("COMPLETION_STREAM_TIMEOUT", "300"))  # 流式响应的最长持续秒数
+    COMPLETION_KEEPALIVE: float = float(os.getenv("COMPLETION_KEEPALIVE", "15"))  # 流式响应空闲时发送保活注释的间隔
+
+    # --- Webhook 推送配置 (按 N 条或 T 毫秒批量 POST，先到为准) ---
+    WEBHOOKS_DIR: str = os.getenv("WEBHOOKS_DIR", "data/webhooks")
+    WEBHOOK_BATCH_SIZE: int = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+    WEBHOOK_FLUSH_MS: int = int(os.getenv("WEBHOOK_FLUSH_MS", "500"))
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # 每个目标的内存队列，满了溢出到磁盘
+    WEBHOOK_SPILL_MAX_BYTES: int = int(os.getenv("WEBHOOK_SPILL_MAX_BYTES", str(64 * 1024 * 1024)))
+    WEBHOOK_TIMEOUT: float = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))
+    WEBHOOK_BACKOFF_BASE: float = float(os.getenv("WEBHOOK_BACKOFF_BASE", "1"))
+    WEBHOOK_BACKOFF_MAX: float = float(os.getenv("WEBHOOK_BACKOFF_MAX", "60"))
+    WEBHOOK_RESCAN_INTERVAL: float = float(os.getenv("WEBHOOK_RESCAN_INTERVAL", "5"))
+    # 允许投递的主机 (逗号分隔，可以是内网主机)。为空时允许任意公网主机，拒绝解析到内网、回环、链路本地等地址的目标
+    WEBHOOK_ALLOWED_HOSTS: List[str] = [host.strip() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
     _auth_data = {}
     try:
         if FEISHU_AUTH_JSON and FEISHU_AUTH_JSON.strip():
@@ -21,13 +124,6 @@ class Settings:
     except json.JSONDecodeError:
         logging.critical("致命错误: .env 文件中的 FEISHU_AUTH_JSON 不是有效的 JSON 格式。")
         sys.exit(1)
-
-    FEISHU_COOKIE: str = _auth_data.get("cookie", "")
-    COMMAND_ID_HISTORY: str = _auth_data.get("cmd_history", "")
-    COMMAND_ID_STREAM: str = _auth_data.get("cmd_stream", "")
-    FEISHU_WEB_VERSION: str = _auth_data.get("web_version", "")
-    CSRF_TOKEN: str = _auth_data.get("csrf_token", "")
-    USER_AGENT: str = _auth_data.get("user_agent", "")
-    REFERER: str = _auth_data.get("referer", "")
+    # 具体字段由 feishu_provider.credential_manager 解析与校验，并支持运行时热更新
 
 settings = Settings()
@@ -0,0 +1,208 @@
+# core/bus.py - 跨进程 / 跨节点的发布订阅总线、租约与订阅兴趣登记
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Set, Tuple
+
+
+class MessageBus:
+    """
+    总线接口:
+      - publish / subscribe: 按频道广播字节消息，所有节点的订阅者都会收到
+      - acquire_lease / release_lease: 带过期时间的互斥租约，持有者需在过期前续约
+      - set_interest / get_interest: 各节点登记自己关心的 topic，租约持有者据此汇总
+    """
+
+    async def publish(self, channel: str, data: bytes):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> "AsyncIterator[AsyncIterator[bytes]]":
+        """异步上下文管理器，进入后返回消息迭代器；进入时订阅已生效，之后发布的消息不会漏掉。"""
+        raise NotImplementedError
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """租约空闲或已由 owner 持有时获得/续约并返回 True。"""
+        raise NotImplementedError
+
+    async def release_lease(self, name: str, owner: str):
+        raise NotImplementedError
+
+    async def set_interest(self, name: str, member: str, topics: Iterable[str], ttl: float):
+        raise NotImplementedError
+
+    async def remove_interest(self, name: str, member: str):
+        raise NotImplementedError
+
+    async def get_interest(self, name: str) -> Set[str]:
+        """返回所有未过期成员登记的 topic 并集。"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InProcessBus(MessageBus):
+    """单进程实现，适合单 worker 部署与本地调试。每个订阅者一个有界队列，满了丢弃最旧的消息。"""
+
+    def __init__(self, queue_size: int = 1024):
+        self._queue_size = queue_size
+        self._channels: Dict[str, Set[asyncio.Queue]] = {}
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._interest: Dict[str, Dict[str, Tuple[List[str], float]]] = {}
+
+    async def publish(self, channel: str, data: bytes):
+        for queue in list(self._channels.get(channel, ())):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        self._channels.setdefault(channel, set()).add(queue)
+
+        async def messages():
+            while True:
+                yield await queue.get()
+
+        try:
+            yield messages()
+        finally:
+            members = self._channels.get(channel)
+            if members is not None:
+                members.discard(queue)
+                if not members:
+                    del self._channels[channel]
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.monotonic()
+        holder = self._leases.get(name)
+        if holder is not None and holder[0] != owner and holder[1] > now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        holder = self._leases.get(name)
+        if holder is not None and holder[0] == owner:
+            del self._leases[name]
+
+    async def set_interest(self, name: str, member: str, topics: Iterable[str], ttl: float):
+        self._interest.setdefault(name, {})[member] = (list(topics), time.monotonic() + ttl)
+
+    async def remove_interest(self, name: str, member: str):
+        members = self._interest.get(name)
+        if members is not None:
+            members.pop(member, None)
+            if not members:
+                del self._interest[name]
+
+    async def get_interest(self, name: str) -> Set[str]:
+        now = time.monotonic()
+        members = self._interest.get(name, {})
+        for member in [member for member, (_, expires_at) in members.items() if expires_at <= now]:
+            del members[member]
+        return {topic for topics, _ in members.values() for topic in topics}
+
+
+# 只有持有者才能续约或释放，避免过期后被其他节点接管的租约被误删
+_RENEW_OR_ACQUIRE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBus(MessageBus):
+    """基于 Redis 的实现 (PUB/SUB + SET NX PX 租约)，供多 worker / 多容器共享。需要安装 redis。"""
+
+    def __init__(self, url: str, prefix: str = "feishu"):
+        # 只在配置了 Redis 总线时才导入 (约 30ms)，单进程部署的启动不受影响
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("CLUSTER_BUS_URL 使用了 redis://，但未安装 redis 包 (pip install redis)。")
+        self._redis = aioredis.from_url(url)
+        self._prefix = prefix
+        self._renew_or_acquire = self._redis.register_script(_RENEW_OR_ACQUIRE)
+        self._release = self._redis.register_script(_RELEASE)
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self._prefix}:{kind}:{name}"
+
+    async def publish(self, channel: str, data: bytes):
+        await self._redis.publish(self._key("channel", channel), data)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self._key("channel", channel))
+
+        async def messages():
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+
+        try:
+            yield messages()
+        finally:
+            await pubsub.aclose()
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        result = await self._renew_or_acquire(keys=[self._key("lease", name)], args=[owner, int(ttl * 1000)])
+        return bool(result)
+
+    async def release_lease(self, name: str, owner: str):
+        await self._release(keys=[self._key("lease", name)], args=[owner])
+
+    async def set_interest(self, name: str, member: str, topics: Iterable[str], ttl: float):
+        key = self._key("interest", name)
+        value = json.dumps({"topics": list(topics), "expires_at": time.time() + ttl})
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, member, value)
+            # 所有成员都消失后整个哈希随之过期
+            pipe.pexpire(key, int(ttl * 2000))
+            await pipe.execute()
+
+    async def remove_interest(self, name: str, member: str):
+        await self._redis.hdel(self._key("interest", name), member)
+
+    async def get_interest(self, name: str) -> Set[str]:
+        key = self._key("interest", name)
+        now = time.time()
+        topics: Set[str] = set()
+        expired = []
+        for member, value in (await self._redis.hgetall(key)).items():
+            entry = json.loads(value)
+            if entry["expires_at"] <= now:
+                expired.append(member)
+            else:
+                topics.update(entry["topics"])
+        if expired:
+            await self._redis.hdel(key, *expired)
+        return topics
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_bus(url: str) -> MessageBus:
+    """memory:// 为进程内总线，redis://、rediss:// 为 Redis 总线。"""
+    if url.startswith("memory://"):
+        return InProcessBus()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        logging.info("集群总线: Redis")
+        return RedisBus(url)
+    raise ValueError(f"不支持的 CLUSTER_BUS_URL: {url}")
@@ -0,0 +1,167 @@
+# core/cluster.py - 多 worker / 多节点部署: 上游长轮询的租约归属与消息广播
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Optional, Set
+
+from core.bus import MessageBus
+
+# 广播帧: 1 字节类型 + 来源节点 ID + "\n" + 负载
+_KIND_MESSAGE = b"m"
+_KIND_END = b"e"
+
+
+class UpstreamEndedError(Exception):
+    """持有租约的节点上游已结束 (例如 认证失败或熔断)，订阅随之关闭。"""
+
+
+class _TopicUnion:
+    """本节点的实时 topic 视图与其他节点登记的 topic 的并集。本节点新增的 topic 立即生效，其他节点的按同步间隔生效。"""
+
+    def __init__(self, local_topics):
+        self.local = local_topics
+        self.remote: Set[Hashable] = set()
+
+    def __contains__(self, topic) -> bool:
+        return topic in self.local or topic in self.remote
+
+    def __iter__(self):
+        return iter(self.remote.union(self.local))
+
+    def __len__(self) -> int:
+        return len(self.remote.union(self.local))
+
+
+class ClusterRelay:
+    """
+    每个上游键在整个集群中只有一个持有租约的节点运行上游，
+    其余节点只通过总线接收广播；租约过期未续约时由仍有订阅者的节点接管。
+
+    source() 返回的工厂与 SubscriptionHub.subscribe 的 source_factory 签名一致，
+    因此本地的 topic 路由、慢消费者策略等都不受影响。
+    """
+
+    def __init__(self, bus: MessageBus, lease_ttl: float, interest_interval: float):
+        self.bus = bus
+        self.node_id = uuid.uuid4().hex
+        self._lease_ttl = lease_ttl
+        self._interval = interest_interval
+        self._owned: Dict[Hashable, asyncio.Task] = {}
+
+    def source(
+        self,
+        key: str,
+        upstream_factory: Callable[[Any], AsyncIterator[Any]],
+        encode: Callable[[Any], bytes],
+        decode: Callable[[bytes], Any],
+        on_remote: Optional[Callable[[Any], None]] = None,
+    ) -> Callable[[Dict[Hashable, Any]], AsyncIterator[Any]]:
+        """
+        upstream_factory 接收集群内所有节点 topic 并集的实时视图 (只在本节点持有租约时调用)。
+        on_remote 在收到其他节点转发的消息时调用，用于维护本节点的重放缓冲等状态。
+        """
+        async def source(local_topics):
+            async with self.bus.subscribe(key) as inbox:
+                owner = asyncio.create_task(self._maintain(key, local_topics, upstream_factory, encode))
+                try:
+                    async for data in inbox:
+                        kind, origin = data[:1], data[1:33].decode("ascii")
+                        payload = data[34:]
+                        if kind == _KIND_END:
+                            raise UpstreamEndedError(payload.decode("utf-8", "replace"))
+                        item = decode(payload)
+                        if on_remote is not None and origin != self.node_id:
+                            on_remote(item)
+                        yield item
+                finally:
+                    owner.cancel()
+                    try:
+                        await owner
+                    except (asyncio.CancelledError, Exception):
+                        pass
+        return source
+
+    def _frame(self, kind: bytes, payload: bytes) -> bytes:
+        return b"".join((kind, self.node_id.encode("ascii"), b"\n", payload))
+
+    async def _maintain(self, key: str, local_topics, upstream_factory, encode):
+        """登记本节点的 topic、争取并续约租约；持有租约期间运行上游并广播。"""
+        shared_topics = _TopicUnion(local_topics)
+        upstream: Optional[asyncio.Task] = None
+        announced = None
+        announced_at = renewed_at = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                try:
+                    current = frozenset(local_topics)
+                    if current != announced or now - announced_at >= self._lease_ttl / 3:
+                        await self.bus.set_interest(key, self.node_id, current, self._lease_ttl)
+                        announced, announced_at = current, now
+
+                    if upstream is None or now - renewed_at >= self._lease_ttl / 3:
+                        leader = await self.bus.acquire_lease(key, self.node_id, self._lease_ttl)
+                        if leader:
+                            renewed_at = now
+                        if leader and upstream is None:
+                            logging.info(f"本节点获得上游租约: {key}")
+                            shared_topics.remote = await self.bus.get_interest(key)
+                            upstream = asyncio.create_task(self._run_upstream(key, shared_topics, upstream_factory, encode))
+                            self._owned[key] = upstream
+                        elif not leader and upstream is not None:
+                            logging.warning(f"上游租约已被其他节点接管，停止本节点上游: {key}")
+                            await self._stop_upstream(key, upstream)
+                            upstream = None
+
+                    if upstream is not None:
+                        if upstream.done():
+                            # 上游已结束并广播了结束帧，不再续约，交由订阅关闭流程处理
+                            await self.bus.release_lease(key, self.node_id)
+                            self._owned.pop(key, None)
+                            upstream = None
+                            return
+                        # 其他节点的订阅变化由持有者按间隔汇总，上游看到的始终是同一个视图对象
+                        shared_topics.remote = await self.bus.get_interest(key)
+                except Exception as e:
+                    logging.warning(f"集群总线操作失败 ({key}): {e}")
+                    if upstream is not None and now - renewed_at >= self._lease_ttl:
+                        # 无法续约时租约可能已被接管，停止上游以免同一会话出现两个长轮询
+                        logging.error(f"上游租约续约超时，停止本节点上游: {key}")
+                        await self._stop_upstream(key, upstream)
+                        upstream = None
+                await asyncio.sleep(self._interval)
+        finally:
+            if upstream is not None:
+                await self._stop_upstream(key, upstream)
+                try:
+                    await self.bus.release_lease(key, self.node_id)
+                except Exception as e:
+                    logging.warning(f"释放上游租约失败 ({key}): {e}")
+            try:
+                await self.bus.remove_interest(key, self.node_id)
+            except Exception as e:
+                logging.warning(f"注销订阅登记失败 ({key}): {e}")
+
+    async def _run_upstream(self, key: str, shared_topics, upstream_factory, encode):
+        reason = "上游已结束"
+        try:
+            async for item in upstream_factory(shared_topics):
+                await self.bus.publish(key, self._frame(_KIND_MESSAGE, encode(item)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"集群上游 {key} 异常结束: {e}")
+            reason = str(e)
+        await self.bus.publish(key, self._frame(_KIND_END, reason.encode("utf-8")))
+
+    async def _stop_upstream(self, key: str, upstream: asyncio.Task):
+        self._owned.pop(key, None)
+        upstream.cancel()
+        try:
+            await upstream
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"node_id": self.node_id, "owned_upstreams": len(self._owned)}
@@ -0,0 +1,178 @@
+# core/completions.py - OpenAI 兼容的 chat completions: 请求解析、响应/SSE 编码、并发与配额限制
+"""
+model 指定要读取的会话: "feishu/<chat_id>"，或 "feishu" 表示默认会话 (DEFAULT_CHAT_ID)；其他 model 视为无效请求。
+非流式响应由最近的历史消息拼成一条 assistant 消息；流式响应把实时消息逐条作为 delta 推送，
+直到达到 max_messages 条或 timeout 秒。本网关只读，不会向飞书发送任何内容，
+因此 messages 必须省略或为空数组，带有消息的请求视为无效 (而不是悄悄忽略)。
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Hashable, Optional, Sequence
+
+import feishu_im_pb2
+
+from core.formatting import format_message_line
+from core.rate_limit import TokenBucket
+from core.serialization import dumps
+
+MODEL_PREFIX = "feishu"
+SSE_MEDIA_TYPE = "text/event-stream"
+_SSE_DONE = b"data: [DONE]\n\n"
+_SSE_KEEPALIVE = b": keep-alive\n\n"
+
+
+class CompletionLimitError(Exception):
+    """超出并发上限或配额。retry_after 为建议的重试等待秒数。"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CompletionRequest:
+    """从 OpenAI 请求体中取出本网关用到的字段。max_messages / timeout 为扩展字段。请求不符合约定时抛出 ValueError。"""
+
+    def __init__(self, body: Dict[str, Any], default_chat_id: str, history_count: int, stream_timeout: float):
+        model = body.get("model") or MODEL_PREFIX
+        if not isinstance(model, str):
+            raise ValueError("model 必须是字符串。")
+        if model == MODEL_PREFIX:
+            chat_id = default_chat_id
+        elif model.startswith(MODEL_PREFIX + "/"):
+            chat_id = model[len(MODEL_PREFIX) + 1:]
+        else:
+            raise ValueError(f"不支持的 model: {model}。model 应为 feishu/<chat_id>，或 feishu 表示默认会话。")
+        messages = body.get("messages")
+        if messages is not None and not isinstance(messages, list):
+            raise ValueError("messages 必须是数组。")
+        if messages:
+            raise ValueError("本接口只读取飞书会话，不会发送消息: messages 必须省略或为空数组。")
+        if not chat_id:
+            raise ValueError("未指定会话: model 应为 feishu/<chat_id>，或在 .env 中配置 DEFAULT_CHAT_ID。")
+        self.model = model
+        self.chat_id = chat_id
+        self.stream = bool(body.get("stream", False))
+        max_messages = body.get("max_messages")
+        if max_messages is not None and (not isinstance(max_messages, int) or max_messages <= 0):
+            raise ValueError("max_messages 必须是正整数。")
+        # 非流式默认取最近 history_count 条；流式默认不限条数，只受 timeout 约束
+        self.max_messages: Optional[int] = max_messages if max_messages is not None else (None if self.stream else history_count)
+        timeout = body.get("timeout", stream_timeout)
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise ValueError("timeout 必须是正数 (秒)。")
+        self.timeout = min(float(timeout), stream_timeout)
+        self.id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+
+
+def build_completion(request: CompletionRequest, messages: Sequence[feishu_im_pb2.Message]) -> Dict[str, Any]:
+    """按时间正序的消息拼成非流式响应。"""
+    content = "\n".join(line for line in map(format_message_line, messages) if line is not None)
+    return {
+        "id": request.id,
+        "object": "chat.completion",
+        "created": request.created,
+        "model": request.model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+async def stream_completion(
+    request: CompletionRequest,
+    messages: AsyncIterator[feishu_im_pb2.Message],
+    keepalive: float,
+) -> AsyncIterator[bytes]:
+    """
+    把实时消息逐条编码为 SSE chunk 并立即产出，不做缓冲。
+    chunk 的公共前后缀只编码一次，每条消息只需编码内容字符串；空闲时定期发送注释行保活。
+    """
+    head = dumps({"id": request.id, "object": "chat.completion.chunk", "created": request.created, "model": request.model})
+    prefix = b"data: " + head[:-1] + b',"choices":[{"index":0,"delta":'
+    suffix = b',"finish_reason":null}]}\n\n'
+    finish = prefix + b'{},"finish_reason":"stop"}]}\n\n'
+
+    yield prefix + b'{"role":"assistant","content":""}' + suffix
+    deadline = time.monotonic() + request.timeout
+    sent = 0
+    iterator = messages.__aiter__()
+    while request.max_messages is None or sent < request.max_messages:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            msg = await asyncio.wait_for(iterator.__anext__(), min(keepalive, remaining))
+        except asyncio.TimeoutError:
+            yield _SSE_KEEPALIVE
+            continue
+        except StopAsyncIteration:
+            break
+        line = format_message_line(msg)
+        if line is None:
+            continue
+        sent += 1
+        yield prefix + b'{"content":' + dumps(line + "\n") + b"}" + suffix
+    yield finish
+    yield _SSE_DONE
+
+
+def encode_stream_error(message: str) -> bytes:
+    """流式响应开始后出错时的最后一个事件 (响应头已发出，无法再改状态码)。"""
+    return b"data: " + dumps({"error": {"message": message, "type": "upstream_error"}}) + b"\n\n" + _SSE_DONE
+
+
+class CompletionLimiter:
+    """
+    全局并发上限 (等待 queue_timeout 秒仍拿不到名额则拒绝) 与按 API 密钥的请求配额 (每分钟 rpm 次，可突发 burst 次)。
+    配额桶按最近使用保留最多 max_keys 个。
+    """
+
+    def __init__(self, max_concurrency: int, queue_timeout: float, rpm: float, burst: float, max_keys: int = 10000):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_concurrency = max_concurrency
+        self._queue_timeout = queue_timeout
+        self._rate = rpm / 60
+        self._burst = burst
+        self._max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.active = 0
+        self.rejected = 0
+
+    def check_quota(self, key: Hashable):
+        if self._rate <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self._rate, self._burst)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        wait = bucket.try_acquire()
+        if wait > 0:
+            self.rejected += 1
+            raise CompletionLimitError("已超出该 API 密钥的请求配额。", wait)
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise CompletionLimitError(f"并发请求已达上限 ({self._max_concurrency})。", self._queue_timeout)
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "rejected": self.rejected, "quota_keys": len(self._buckets)}
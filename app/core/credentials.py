@@ -0,0 +1,143 @@
+# core/credentials.py - 服务端托管认证信息的热更新: 认证文件监视、管理接口写入与版本化原子切换
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class CredentialManager:
+    """
+    持有当前生效的一组托管认证信息及其递增版本号。来源为 FEISHU_AUTH_JSON (启动时)、
+    认证文件 (轮询 mtime，变化即重新加载) 或管理接口写入。
+
+    新数据只在切换时由 build 解析、校验一次，通过后整体替换 current 并递增 version；
+    校验失败时保留旧版本继续使用。使用方在每次请求前比较 version 即可感知切换，无需加锁。
+    """
+
+    def __init__(self, build: Callable[[Dict[str, Any]], Any], path: str = "", poll_interval: float = 2.0):
+        self._build = build
+        self._path = path
+        self._interval = poll_interval
+        self._file_state: Optional[Tuple[int, int, int]] = None
+        self._updated = asyncio.Event()
+        self._watcher: Optional[asyncio.Task] = None
+        self.data: Dict[str, Any] = {}
+        self.current: Any = None
+        self.version = 0
+        self.source = ""
+        self.updated_at = 0.0
+        self.failures = 0
+
+    def load(self, fallback: Dict[str, Any]):
+        """启动时加载: 认证文件存在且有效时优先使用，否则使用 FEISHU_AUTH_JSON。"""
+        if self._path and os.path.isfile(self._path):
+            try:
+                self._apply(self._read_file(), "file")
+                return
+            except (OSError, ValueError) as e:
+                logging.error(f"认证文件 {self._path} 无效 ({e})，改用 FEISHU_AUTH_JSON。")
+        if fallback:
+            try:
+                self._apply(fallback, "env")
+            except ValueError as e:
+                logging.warning(f"FEISHU_AUTH_JSON 中的认证信息不完整: {e}")
+
+    def update(self, data: Dict[str, Any], source: str = "api") -> int:
+        """
+        校验并切换到新的认证信息，返回生效的版本号；校验失败抛出 ValueError。
+        配置了认证文件时同时写回文件，使其他 worker 与重启后的进程使用同一份认证信息。
+        """
+        version = self._apply(data, source)
+        if self._path:
+            try:
+                self._write_file(data)
+            except OSError as e:
+                logging.error(f"写回认证文件 {self._path} 失败，新认证信息只在当前进程生效: {e}")
+        return version
+
+    def _apply(self, data: Dict[str, Any], source: str) -> int:
+        if not isinstance(data, dict):
+            raise ValueError("认证信息必须是 JSON 对象。")
+        if data == self.data and self.current is not None:
+            return self.version
+        credentials = self._build(data)
+        self.data = dict(data)
+        self.current = credentials
+        self.version += 1
+        self.source = source
+        self.updated_at = time.time()
+        # 唤醒等待新认证信息的长轮询，并为下一次切换换上新的事件
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+        logging.info(f"托管认证信息已切换到版本 {self.version} (来源: {source})。")
+        return self.version
+
+    async def wait_for_update(self, version: int):
+        """等待 version 之后的新版本生效 (例如 认证失效后等待管理员更新 Cookie)。"""
+        while self.version == version:
+            await self._updated.wait()
+
+    # --- 认证文件 ---
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _read_file(self) -> Dict[str, Any]:
+        self._file_state = self._stat()
+        with open(self._path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"不是有效的 JSON: {e}")
+
+    def _write_file(self, data: Dict[str, Any]):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self._path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 原子替换，其他进程不会读到写了一半的文件
+        os.replace(tmp_path, self._path)
+        self._file_state = self._stat()
+
+    def reload(self):
+        """文件有变化时重新加载。无效内容只记录错误，不影响当前版本。"""
+        state = self._stat()
+        if state is None or state == self._file_state:
+            return
+        try:
+            self._apply(self._read_file(), "file")
+        except (OSError, ValueError) as e:
+            self.failures += 1
+            logging.error(f"重新加载认证文件 {self._path} 失败，继续使用版本 {self.version}: {e}")
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            self.reload()
+
+    def start(self):
+        if self._path and (self._watcher is None or self._watcher.done()):
+            self._watcher = asyncio.create_task(self._watch_loop())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "valid": self.current is not None,
+            "source": self.source,
+            "updated_at": self.updated_at,
+            "reload_failures": self.failures,
+        }
@@ -0,0 +1,115 @@
+# core/dedup.py - 实时消息去重 (有界的已见 ID 索引) 与断线补齐
+from collections import deque
+from contextlib import aclosing
+from typing import Deque, Dict, Iterable, List, Set, Tuple
+
+import feishu_im_pb2
+
+from core.export_engine import FetchPage, iter_history_pages
+
+
+class SeenIndex:
+    """有界的 message_id 集合: 环形缓冲记录加入顺序，超过容量时淘汰最早加入的 ID。"""
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._order: Deque[str] = deque()
+        self._ids: Set[str] = set()
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, message_id: str):
+        if message_id in self._ids:
+            return
+        if len(self._order) >= self._capacity:
+            self._ids.discard(self._order.popleft())
+        self._order.append(message_id)
+        self._ids.add(message_id)
+
+
+class ChatDedup:
+    """
+    单个会话的去重状态。floor 以前的消息已被追赶时的历史覆盖，直接丢弃；
+    floor 之后按 message_id 判断，同一毫秒内的多条消息与乱序到达的消息都不会丢失。
+    """
+    __slots__ = ("seen", "floor", "last_time")
+
+    def __init__(self, capacity: int):
+        self.seen = SeenIndex(capacity)
+        self.floor = 0
+        self.last_time = 0
+
+    def is_new(self, message_id: str, create_time: int) -> bool:
+        return create_time >= self.floor and message_id not in self.seen
+
+    def record(self, message_id: str, create_time: int):
+        self.seen.add(message_id)
+        if create_time > self.last_time:
+            self.last_time = create_time
+
+
+class StreamDeduplicator:
+    """
+    一个实时流 (一次长轮询生命周期) 内所有会话的去重状态。状态在长轮询的断线重连之间保留，
+    重连后通过 backfill 从历史消息中补齐断线期间漏掉的消息。
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._chats: Dict[str, ChatDedup] = {}
+
+    def chat(self, chat_id: str) -> ChatDedup:
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = ChatDedup(self._capacity)
+        return state
+
+    def is_new(self, chat_id: str, message_id: str, create_time: int) -> bool:
+        state = self._chats.get(chat_id)
+        return state is None or state.is_new(message_id, create_time)
+
+    def record(self, msg: feishu_im_pb2.Message):
+        self.chat(msg.chat_id).record(msg.message_id, msg.create_time)
+
+    def retain(self, chat_ids: Iterable[str]):
+        """丢弃已经没有订阅者的会话状态。"""
+        keep = set(chat_ids)
+        for chat_id in [chat_id for chat_id in self._chats if chat_id not in keep]:
+            del self._chats[chat_id]
+
+    async def seed(self, fetch_page: FetchPage, chat_id: str, count: int):
+        """用最新一页历史消息的键初始化会话状态 (不投递)，实时流随后重复推送这些消息时会被过滤。"""
+        page = await fetch_page(chat_id, count, "0")
+        keys = page.message_keys()
+        state = self.chat(chat_id)
+        for key in keys:
+            state.record(key.message_id, key.create_time)
+        if keys and page.has_more:
+            state.floor = min(key.create_time for key in keys)
+
+    async def backfill(
+        self, fetch_page: FetchPage, chat_id: str, max_messages: int, lookback_ms: int,
+    ) -> Tuple[List[feishu_im_pb2.Message], bool]:
+        """
+        从最新消息向过去翻页，直到最后一条已投递消息之前 lookback_ms 毫秒 (不早于 floor)，
+        返回其间尚未见过的消息 (按时间正序) 与是否完整覆盖了这段时间 (扫描条数未达到 max_messages)。
+        回看窗口覆盖乱序到达、时间早于 last_time 却还没投递的消息；窗口内已投递的消息由 seen 过滤，
+        因此 seen 的容量应能容纳一个窗口内的消息。不修改状态，由调用方在投递时 record。
+        """
+        state = self._chats.get(chat_id)
+        if state is None or not state.last_time:
+            return [], True
+        start_time = max(state.floor, state.last_time - lookback_ms)
+        missed: List[feishu_im_pb2.Message] = []
+        scanned = 0
+        pages = iter_history_pages(fetch_page, chat_id, max_messages, start_time=start_time)
+        async with aclosing(pages):
+            async for page in pages:
+                scanned += len(page)
+                missed.extend(msg for msg in page if state.is_new(msg.message_id, msg.create_time))
+        missed.reverse()
+        return missed, scanned < max_messages
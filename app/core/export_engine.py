@@ -0,0 +1,155 @@
+# core/export_engine.py - 分页导出引擎: 跟随 next_cursor 翻页、预取下一页、跨会话并发
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import feishu_im_pb2
+
+from config import settings
+from core.formatting import format_message_line
+from core.serialization import encode_ndjson
+
+EXPORT_FORMAT_NDJSON = "ndjson"
+EXPORT_FORMAT_TEXT = "text"
+EXPORT_ORDER_ASC = "asc"
+EXPORT_ORDER_DESC = "desc"
+
+FetchPage = Callable[[str, int, str], Awaitable[feishu_im_pb2.GetMessagesResponse]]
+
+_export_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def export_slot() -> asyncio.Semaphore:
+    """进程级信号量，限制同时导出的会话数量 (所有导出请求共享)。"""
+    global _export_semaphore
+    if _export_semaphore is None:
+        _export_semaphore = asyncio.Semaphore(settings.EXPORT_CONCURRENCY)
+    return _export_semaphore
+
+
+async def iter_history_checkpoints(
+    fetch_page: FetchPage,
+    chat_id: str,
+    max_messages: int,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    page_size: Optional[int] = None,
+    cursor: str = "0",
+) -> AsyncGenerator[Tuple[List[feishu_im_pb2.Message], Optional[str]], None]:
+    """
+    从 cursor 开始向过去翻页，每页产出 (落在 [start_time, end_time] 内的消息, 续传游标)。
+    续传游标为 None 表示导出已完成。调用方处理当前页时，下一页已经在后台请求。
+    达到 max_messages 或越过 start_time 时停止。
+    """
+    page_size = page_size or settings.EXPORT_PAGE_SIZE
+    remaining = max_messages
+    next_task: Optional[asyncio.Task] = asyncio.create_task(fetch_page(chat_id, min(page_size, remaining), cursor))
+    try:
+        while next_task is not None:
+            page = await next_task
+            next_task = None
+            items = page.items
+            reached_start = bool(start_time is not None and items and items[-1].create_time < start_time)
+
+            selected = [
+                msg for msg in items
+                if (start_time is None or msg.create_time >= start_time)
+                and (end_time is None or msg.create_time <= end_time)
+            ][:remaining]
+            remaining -= len(selected)
+
+            resume_cursor: Optional[str] = None
+            if page.has_more and items and remaining > 0 and not reached_start:
+                resume_cursor = page.next_cursor
+                next_task = asyncio.create_task(fetch_page(chat_id, min(page_size, remaining), resume_cursor))
+            yield selected, resume_cursor
+    finally:
+        if next_task is not None:
+            next_task.cancel()
+
+
+async def iter_history_pages(
+    fetch_page: FetchPage,
+    chat_id: str,
+    max_messages: int,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    page_size: Optional[int] = None,
+) -> AsyncGenerator[List[feishu_im_pb2.Message], None]:
+    """从最新消息开始逐页产出 (每页内为新到旧) 落在时间范围内的消息，跳过空页。"""
+    async with aclosing(iter_history_checkpoints(fetch_page, chat_id, max_messages, start_time, end_time, page_size)) as checkpoints:
+        async for selected, _ in checkpoints:
+            if selected:
+                yield selected
+
+
+async def collect_chat_messages(
+    fetch_page: FetchPage,
+    chat_id: str,
+    max_messages: int,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+) -> List[feishu_im_pb2.Message]:
+    """导出单个会话，返回按时间正序排列的消息。"""
+    async with export_slot():
+        messages: List[feishu_im_pb2.Message] = []
+        async for page in iter_history_pages(fetch_page, chat_id, max_messages, start_time, end_time):
+            messages.extend(page)
+        messages.reverse()
+        logging.info(f"会话 {chat_id} 导出完成，共 {len(messages)} 条消息。")
+        return messages
+
+
+async def export_chats(
+    fetch_page: FetchPage,
+    chat_ids: Sequence[str],
+    max_messages: int,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+) -> Dict[str, Union[List[feishu_im_pb2.Message], Exception]]:
+    """并发导出多个会话，总耗时接近最慢的那个会话。单个会话失败不影响其他会话。"""
+    chat_ids = list(dict.fromkeys(chat_ids))
+    results = await asyncio.gather(
+        *(collect_chat_messages(fetch_page, chat_id, max_messages, start_time, end_time) for chat_id in chat_ids),
+        return_exceptions=True,
+    )
+    return dict(zip(chat_ids, results))
+
+
+def encode_export_page(messages: Sequence[feishu_im_pb2.Message], export_format: str) -> bytes:
+    """把一页消息编码为 NDJSON (每行一个消息对象) 或分析文本 ("时间 - 发送者: 内容") 的 UTF-8 字节。"""
+    if export_format == EXPORT_FORMAT_NDJSON:
+        return encode_ndjson(messages)
+    return "".join(line + "\n" for line in map(format_message_line, messages) if line is not None).encode("utf-8")
+
+
+async def stream_export(
+    fetch_page: FetchPage,
+    chat_id: str,
+    export_format: str,
+    max_messages: int,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    order: Optional[str] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    导出流。order 为 desc (从新到旧，ndjson 默认) 时边翻页边输出，服务端内存占用与导出总量无关；
+    为 asc (从旧到新，text 默认，与分析文本一致) 时上游只能从新到旧翻页，
+    因此先把每页编码好暂存，翻完所有页后再倒序输出。
+    """
+    if order is None:
+        order = EXPORT_ORDER_ASC if export_format == EXPORT_FORMAT_TEXT else EXPORT_ORDER_DESC
+    chunks: List[bytes] = []
+    async with export_slot():
+        async with aclosing(iter_history_pages(fetch_page, chat_id, max_messages, start_time, end_time)) as pages:
+            async for page in pages:
+                if order == EXPORT_ORDER_DESC:
+                    chunk = encode_export_page(page, export_format)
+                    if chunk:
+                        yield chunk
+                else:
+                    chunks.append(encode_export_page(page[::-1], export_format))
+    for chunk in reversed(chunks):
+        if chunk:
+            yield chunk
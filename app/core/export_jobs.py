@@ -0,0 +1,308 @@
+# core/export_jobs.py - 后台导出任务队列 (可断点续传)
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import deque
+from contextlib import aclosing
+from typing import Any, AsyncContextManager, Callable, Deque, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from core.export_engine import FetchPage, EXPORT_FORMAT_NDJSON, encode_export_page, export_slot, iter_history_checkpoints
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+RESULT_EXTENSIONS = {EXPORT_FORMAT_NDJSON: "ndjson"}
+
+# 不通过状态接口对外暴露的字段
+_PRIVATE_FIELDS = ("credentials",)
+_FINISHED = (JOB_COMPLETED, JOB_FAILED)
+
+
+class ExportJobManager:
+    """
+    导出任务持久化在 jobs_dir/<job_id>/ 下: job.json 保存参数与断点 (cursor、已导出条数、结果文件长度)，
+    result.* 保存已导出的内容。每完成一页都会先追加结果、再原子地写入断点，
+    进程重启后未完成的任务会从最后一个 next_cursor 继续。
+    任务结束 (完成或失败) 时从 job.json 中删除认证信息；结束超过 job_ttl 秒的任务连同结果文件一并清理。
+    """
+
+    def __init__(
+        self,
+        jobs_dir: str,
+        workers: int,
+        per_credential_limit: int,
+        open_fetcher: Callable[[Dict[str, Any]], AsyncContextManager[FetchPage]],
+        credential_key: Callable[[Dict[str, Any]], str],
+        job_ttl: float,
+    ):
+        self._jobs_dir = jobs_dir
+        self._workers = workers
+        self._per_credential_limit = per_credential_limit
+        self._open_fetcher = open_fetcher
+        self._credential_key = credential_key
+        self._job_ttl = job_ttl
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # 每个凭证正在执行的任务数，以及因凭证名额已满而暂缓的任务 (按凭证分组，先进先出)
+        self._running: Dict[str, int] = {}
+        self._deferred: Dict[str, Deque[str]] = {}
+
+    # --- 持久化 ---
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self._jobs_dir, job_id)
+
+    def _meta_path(self, job_id: str) -> str:
+        return os.path.join(self._job_dir(job_id), "job.json")
+
+    def result_path(self, job: Dict[str, Any]) -> str:
+        extension = RESULT_EXTENSIONS.get(job["format"], "txt")
+        return os.path.join(self._job_dir(job["job_id"]), f"result.{extension}")
+
+    def _save(self, job: Dict[str, Any]):
+        job["updated_at"] = time.time()
+        path = self._meta_path(job["job_id"])
+        tmp_path = path + ".tmp"
+        # job.json 中包含认证信息，仅允许属主读写
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _finish(self, job: Dict[str, Any]):
+        """任务已结束，不再需要认证信息，避免 Cookie 长期留在磁盘上。"""
+        job.pop("credentials", None)
+        self._save(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not job_id or os.path.basename(job_id) != job_id:
+            return None
+        return self._load(job_id)
+
+    @staticmethod
+    def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+        view = {key: value for key, value in job.items() if key not in _PRIVATE_FIELDS}
+        view["progress"] = round(min(1.0, job["exported"] / job["max_messages"]), 4) if job["status"] != JOB_COMPLETED else 1.0
+        return view
+
+    # --- 任务调度 ---
+
+    async def create(
+        self,
+        credentials: Dict[str, Any],
+        chat_id: str,
+        export_format: str,
+        max_messages: int,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "status": JOB_PENDING,
+            "chat_id": chat_id,
+            "format": export_format,
+            "max_messages": max_messages,
+            "start_time": start_time,
+            "end_time": end_time,
+            "cursor": "0",
+            "exported": 0,
+            "result_bytes": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "credentials": credentials,
+        }
+        os.makedirs(self._job_dir(job_id), exist_ok=True)
+        await asyncio.to_thread(self._save, job)
+        await self._queue.put(job_id)
+        logging.info(f"已创建导出任务 {job_id}, Chat ID: {chat_id}")
+        return job
+
+    def start(self):
+        os.makedirs(self._jobs_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        # 恢复上次进程退出时尚未完成的任务
+        resumed = 0
+        for job_id in sorted(os.listdir(self._jobs_dir)):
+            job = self._load(job_id)
+            if job is not None and job["status"] in (JOB_PENDING, JOB_RUNNING):
+                self._queue.put_nowait(job_id)
+                resumed += 1
+        if resumed:
+            logging.info(f"恢复了 {resumed} 个未完成的导出任务。")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def sweep(self) -> int:
+        """删除结束时间早于 job_ttl 的任务目录，返回删除的任务数。"""
+        removed = 0
+        deadline = time.time() - self._job_ttl
+        for job_id in os.listdir(self._jobs_dir):
+            job = self._load(job_id)
+            if job is None or job["status"] not in _FINISHED or job["updated_at"] > deadline:
+                continue
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+            removed += 1
+        if removed:
+            logging.info(f"已清理 {removed} 个过期的导出任务。")
+        return removed
+
+    async def _sweep_loop(self):
+        interval = max(1.0, min(3600.0, self._job_ttl / 2))
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logging.error(f"清理过期导出任务时发生错误: {e}")
+            await asyncio.sleep(interval)
+
+    def _claim(self, job_id: str) -> Optional[int]:
+        """
+        多个 worker 进程共享 jobs_dir 时，启动恢复会把同一任务放进每个进程的队列。
+        用任务目录下的文件锁保证同一时刻只有一个进程执行；进程退出时锁自动释放。
+        """
+        fd = os.open(os.path.join(self._job_dir(job_id), "lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        if fcntl is None:
+            return fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _try_acquire(self, key: str) -> bool:
+        if self._running.get(key, 0) >= self._per_credential_limit:
+            return False
+        self._running[key] = self._running.get(key, 0) + 1
+        return True
+
+    def _release(self, key: str):
+        self._running[key] -= 1
+        if not self._running[key]:
+            del self._running[key]
+        # 名额空出后放回一个暂缓的同凭证任务
+        deferred = self._deferred.get(key)
+        if deferred:
+            self._queue.put_nowait(deferred.popleft())
+            if not deferred:
+                del self._deferred[key]
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            lock_fd = None
+            slot_key = None
+            try:
+                lock_fd = self._claim(job_id)
+                if lock_fd is None:
+                    logging.info(f"导出任务 {job_id} 正由其他进程执行，跳过。")
+                    continue
+                # 取得锁之后再读取，拿到其他进程留下的最新断点
+                job = self._load(job_id)
+                if job is None or job["status"] in _FINISHED:
+                    continue
+                if "credentials" not in job:
+                    job["status"] = JOB_FAILED
+                    job["error"] = "任务缺少认证信息，无法继续"
+                    await asyncio.to_thread(self._finish, job)
+                    continue
+                key = self._credential_key(job["credentials"])
+                if not self._try_acquire(key):
+                    # 该凭证的名额已满: 不占用 worker 等待，释放文件锁 (见 finally) 后暂缓，
+                    # 同凭证的任务结束时再放回队列，其他凭证的任务照常执行
+                    self._deferred.setdefault(key, deque()).append(job_id)
+                    continue
+                slot_key = key
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"导出任务 {job_id} 调度异常: {e}")
+            finally:
+                if lock_fd is not None:
+                    os.close(lock_fd)
+                if slot_key is not None:
+                    self._release(slot_key)
+                self._queue.task_done()
+
+    async def _run(self, job: Dict[str, Any]):
+        job["status"] = JOB_RUNNING
+        await asyncio.to_thread(self._save, job)
+        logging.info(f"开始执行导出任务 {job['job_id']} (已导出 {job['exported']} 条, cursor={job['cursor']})")
+        try:
+            remaining = job["max_messages"] - job["exported"]
+            if job["cursor"] is None or remaining <= 0:
+                # 上次已写完最后一页但未来得及标记完成
+                job["status"] = JOB_COMPLETED
+                await asyncio.to_thread(self._finish, job)
+                return
+            result_file = await asyncio.to_thread(self._open_result, job)
+            try:
+                async with self._open_fetcher(job["credentials"]) as fetch_page, export_slot():
+                    checkpoints = iter_history_checkpoints(
+                        fetch_page, job["chat_id"], remaining,
+                        job["start_time"], job["end_time"], cursor=job["cursor"],
+                    )
+                    async with aclosing(checkpoints):
+                        async for messages, resume_cursor in checkpoints:
+                            chunk = encode_export_page(messages, job["format"])
+                            job["exported"] += len(messages)
+                            job["cursor"] = resume_cursor
+                            await asyncio.to_thread(self._checkpoint, job, result_file, chunk)
+            finally:
+                result_file.close()
+            job["status"] = JOB_COMPLETED
+            logging.info(f"导出任务 {job['job_id']} 完成，共 {job['exported']} 条消息。")
+        except asyncio.CancelledError:
+            # 进程退出: 保持 running 状态，下次启动时从断点继续
+            raise
+        except Exception as e:
+            logging.error(f"导出任务 {job['job_id']} 失败: {e}")
+            job["status"] = JOB_FAILED
+            job["error"] = str(e)
+        await asyncio.to_thread(self._finish, job)
+
+    def _open_result(self, job: Dict[str, Any]):
+        path = self.result_path(job)
+        result_file = open(path, "ab")
+        # 丢弃上次崩溃时写了一半、尚未记录进断点的内容
+        result_file.truncate(job["result_bytes"])
+        result_file.seek(job["result_bytes"])
+        return result_file
+
+    def _checkpoint(self, job: Dict[str, Any], result_file, chunk: bytes):
+        if chunk:
+            result_file.write(chunk)
+            result_file.flush()
+            os.fsync(result_file.fileno())
+        job["result_bytes"] = result_file.tell()
+        self._save(job)
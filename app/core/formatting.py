@@ -0,0 +1,29 @@
+# core/formatting.py - 消息格式化 (分析文本)
+from datetime import datetime
+from typing import Optional, Sequence
+
+import feishu_im_pb2
+
+
+def format_timestamp(ts: int) -> str:
+    return datetime.fromtimestamp(ts / 1000).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_message_line(msg: feishu_im_pb2.Message) -> Optional[str]:
+    """分析文本中的一行: "时间 - 发送者: 内容"。没有文本内容的消息返回 None。"""
+    content_text = msg.text_content.text.strip() if msg.HasField("text_content") else ""
+    if not content_text:
+        return None
+    sender_name = msg.sender.name or "未知用户"
+    return f"{format_timestamp(msg.create_time)} - {sender_name}: {content_text}"
+
+
+def build_analysis_result(messages: Sequence[feishu_im_pb2.Message]) -> dict:
+    """把按时间正序排列的消息组装成导出分析接口的响应体。"""
+    if not messages:
+        return {"analysis_text": "没有找到任何消息。", "start_info": "无", "end_info": "无", "message_count": 0}
+    formatted_lines = [line for line in map(format_message_line, messages) if line is not None]
+    start_msg, end_msg = messages[0], messages[-1]
+    start_info = f"从 {format_timestamp(start_msg.create_time)} ({start_msg.sender.name}) 的消息开始"
+    end_info = f"到 {format_timestamp(end_msg.create_time)} ({end_msg.sender.name}) 的消息结束"
+    return {"analysis_text": "\n".join(formatted_lines), "start_info": start_info, "end_info": end_info, "message_count": len(formatted_lines)}
@@ -0,0 +1,83 @@
+# core/http_client.py - 异步 HTTP 传输层
+import logging
+import ssl
+from functools import lru_cache
+from typing import Dict, Optional
+
+import httpx
+
+from config import settings
+
+
+def build_limits() -> httpx.Limits:
+    """连接池限制。每个客户端只访问飞书网关一个主机，因此这里的上限即为单主机连接上限。"""
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def build_timeout(read_timeout: Optional[float] = None) -> httpx.Timeout:
+    """显式区分连接超时与读取超时，长轮询请求可以单独传入更长的读取超时。"""
+    read = settings.HTTP_READ_TIMEOUT if read_timeout is None else read_timeout
+    return httpx.Timeout(connect=settings.HTTP_CONNECT_TIMEOUT, read=read, write=read, pool=settings.HTTP_CONNECT_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def shared_ssl_context() -> ssl.SSLContext:
+    """
+    进程内共用的 TLS 上下文，首次创建客户端时才加载 CA 证书。
+    httpx 默认为每个客户端各加载一次证书 (约 15ms)，而每组认证信息都有自己的客户端。
+    """
+    return httpx.create_ssl_context()
+
+
+@lru_cache(maxsize=None)
+def _http2_available() -> bool:
+    if not settings.HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logging.warning("警告: 未安装 h2 依赖 (pip install 'httpx[http2]')，上游连接将降级为 HTTP/1.1。")
+        return False
+    return True
+
+
+def prepare_transport():
+    """
+    预先完成首次创建客户端的一次性开销: 加载 CA 证书，导入 httpcore / h2 (httpx 在创建传输层时才导入它们)。
+    由启动事件放到线程池中执行，不推迟服务就绪。
+    """
+    shared_ssl_context()
+    if _http2_available():
+        import httpcore._async.http2  # noqa: F401
+    else:
+        import httpcore  # noqa: F401
+
+
+def create_async_client(headers: Dict[str, str]) -> httpx.AsyncClient:
+    """创建支持 HTTP/2 与 keep-alive 的异步客户端。未安装 h2 时自动降级为 HTTP/1.1。"""
+    return httpx.AsyncClient(
+        headers=headers,
+        http2=_http2_available(),
+        verify=shared_ssl_context(),
+        limits=build_limits(),
+        timeout=build_timeout(),
+    )
+
+
+def create_webhook_client() -> httpx.AsyncClient:
+    """Webhook 推送共用的客户端: 目标主机各不相同，按总连接数限制并复用 keep-alive 连接。"""
+    return httpx.AsyncClient(
+        verify=shared_ssl_context(),
+        limits=httpx.Limits(
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.WEBHOOK_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+        # 投递前只检查了目标地址本身，跟随重定向会绕过内网地址检查
+        follow_redirects=False,
+    )
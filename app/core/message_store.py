@@ -0,0 +1,476 @@
+# core/message_store.py - 本地消息存储 (SQLite WAL)、历史消息增量同步与全文检索
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import feishu_im_pb2
+
+LOCAL_CURSOR_PREFIX = "local:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    create_time INTEGER NOT NULL,
+    sender_id TEXT NOT NULL DEFAULT '',
+    sender_name TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL DEFAULT '',
+    raw BLOB NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_time ON messages (chat_id, create_time DESC, message_id DESC);
+CREATE TABLE IF NOT EXISTS sync_state (
+    chat_id TEXT PRIMARY KEY,
+    head_time INTEGER NOT NULL,
+    tail_time INTEGER NOT NULL,
+    tail_cursor TEXT NOT NULL,
+    has_more INTEGER NOT NULL,
+    head_synced_at REAL NOT NULL
+);
+"""
+
+# 全文索引: trigram 分词不依赖空格切词，中文按任意 3 个连续字符建索引，适合中英文混排的聊天内容。
+# 外部内容表只保存倒排索引本身，正文仍在 messages 中；由触发器随 messages 的写入增量维护，
+# 因此历史同步和实时流写入的消息都会自动进入索引。
+# 注意: messages 没有 INTEGER PRIMARY KEY，VACUUM 可能改变 rowid，执行 VACUUM 后需要重建索引 (rebuild)。
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages
+WHEN old.content IS NOT new.content BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+"""
+# trigram 索引只能匹配至少 3 个字符的词。中文最常见的两字词由第二个索引覆盖:
+# 把正文中每段连续的中日韩字符切成重叠的二元组 (部署完成 → 部署 署完 完成)，以空格分隔写入无内容 (contentless) 的
+# FTS5 表，unicode61 分词器把每个二元组当作一个词。切分由连接上注册的 cjk_bigrams() 在触发器中完成，
+# 因此用其他工具直接写 messages 表时需要先注册同名函数。
+_BIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_bigram USING fts5(
+    bigrams, content='', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS messages_bigram_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_bigram (rowid, bigrams) VALUES (new.rowid, cjk_bigrams(new.content));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_bigram_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_bigram (messages_bigram, rowid, bigrams) VALUES ('delete', old.rowid, cjk_bigrams(old.content));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_bigram_update AFTER UPDATE OF content ON messages
+WHEN old.content IS NOT new.content BEGIN
+    INSERT INTO messages_bigram (messages_bigram, rowid, bigrams) VALUES ('delete', old.rowid, cjk_bigrams(old.content));
+    INSERT INTO messages_bigram (rowid, bigrams) VALUES (new.rowid, cjk_bigrams(new.content));
+END;
+"""
+_TRIGRAM_MIN_LENGTH = 3
+# 假名、中日韩统一表意文字 (含扩展 A 与兼容表意文字)、谚文音节
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_CJK_RUN = re.compile(f"[{_CJK_CHARS}]{{2,}}")
+_CJK_BIGRAM = re.compile(f"[{_CJK_CHARS}]{{2}}")
+
+
+class _SyncState:
+    """
+    每个会话在本地保存一个从最新消息向过去连续覆盖的区间 [tail_time, head_time]，
+    tail_cursor 是继续向过去翻页所需的上游游标。
+    """
+    __slots__ = ("head_time", "tail_time", "tail_cursor", "has_more", "head_synced_at")
+
+    def __init__(self, head_time: int, tail_time: int, tail_cursor: str, has_more: bool, head_synced_at: float):
+        self.head_time = head_time
+        self.tail_time = tail_time
+        self.tail_cursor = tail_cursor
+        self.has_more = has_more
+        self.head_synced_at = head_synced_at
+
+
+def encode_local_cursor(msg: feishu_im_pb2.Message) -> str:
+    return f"{LOCAL_CURSOR_PREFIX}{msg.create_time}:{msg.message_id}"
+
+
+def decode_local_cursor(cursor: str) -> Tuple[int, str]:
+    create_time, _, message_id = cursor[len(LOCAL_CURSOR_PREFIX):].partition(":")
+    return int(create_time), message_id
+
+
+def cjk_bigrams(text: Optional[str]) -> str:
+    """正文中每段连续中日韩字符的重叠二元组，以空格分隔。"""
+    if not text:
+        return ""
+    return " ".join(run[i:i + 2] for run in _CJK_RUN.findall(text) for i in range(len(run) - 1))
+
+
+def _fts_phrase(term: str) -> str:
+    """把用户输入的词作为 FTS5 短语，避免其中的 AND / OR / * / 引号 等被当作查询语法。"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class MessageStore:
+    """
+    以 (chat_id, message_id) 为主键存储消息，并按 create_time 建立索引。
+    所有 SQLite 操作都在一个专用线程中串行执行，不阻塞事件循环。
+    """
+
+    def __init__(self, path: str, head_ttl: float, live_grace: float, live_max_age: float):
+        self._path = path
+        self._head_ttl = head_ttl
+        self._live_grace = live_grace
+        self._live_max_age = live_max_age
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="message-store")
+        self._conn: Optional[sqlite3.Connection] = None
+        # 当前 SQLite 是否支持 FTS5 trigram 索引 (3.34+) 与二元组索引 (FTS5)，打开连接时确定
+        self._fts = False
+        self._bigram = False
+        # chat_id -> (实时流开始覆盖该会话的时间, 引用计数)
+        self._live: Dict[str, Tuple[float, int]] = {}
+        # 每个会话同一时刻只有一个请求同步区间 (刷新头部、补齐尾部)；没有请求持有时自动释放
+        self._sync_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    # --- 线程内执行的同步操作 ---
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            conn.create_function("cjk_bigrams", 1, cjk_bigrams, deterministic=True)
+            self._fts = self._init_fts(conn)
+            self._bigram = self._init_bigram(conn)
+            self._conn = conn
+            logging.info(f"本地消息存储已打开: {self._path}")
+        return self._conn
+
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is not None
+        try:
+            conn.executescript(_FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logging.warning(f"当前 SQLite 不支持 FTS5 trigram 全文索引 ({e})，消息搜索将退回到逐行匹配。")
+            return False
+        if not existed:
+            # 旧版本创建的数据库: 为已有消息一次性建立索引
+            with conn:
+                conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            logging.info("已为本地消息建立全文索引。")
+        return True
+
+    def _init_bigram(self, conn: sqlite3.Connection) -> bool:
+        existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_bigram'").fetchone() is not None
+        try:
+            conn.executescript(_BIGRAM_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logging.warning(f"当前 SQLite 不支持 FTS5 ({e})，两字中文词的搜索将退回到逐行匹配。")
+            return False
+        if not existed:
+            # 无内容表不能 rebuild，由正文重新切分写入
+            with conn:
+                conn.execute("INSERT INTO messages_bigram (rowid, bigrams) SELECT rowid, cjk_bigrams(content) FROM messages")
+        return True
+
+    def _upsert_sync(self, messages: Iterable[feishu_im_pb2.Message]):
+        rows = []
+        for msg in messages:
+            sender_id = msg.sender.sender_id if msg.HasField("sender") else ""
+            sender_name = msg.sender.name if msg.HasField("sender") else ""
+            content = msg.text_content.text if msg.HasField("text_content") else ""
+            rows.append((msg.chat_id, msg.message_id, msg.create_time, sender_id, sender_name, content, msg.SerializeToString()))
+        if not rows:
+            return
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (chat_id, message_id, create_time, sender_id, sender_name, content, raw) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, message_id) DO UPDATE SET "
+                "create_time = excluded.create_time, sender_id = excluded.sender_id, "
+                "sender_name = excluded.sender_name, content = excluded.content, raw = excluded.raw",
+                rows,
+            )
+
+    def _load_state_sync(self, chat_id: str) -> Optional[_SyncState]:
+        row = self._connection().execute(
+            "SELECT head_time, tail_time, tail_cursor, has_more, head_synced_at FROM sync_state WHERE chat_id = ?",
+            (chat_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return _SyncState(row[0], row[1], row[2], bool(row[3]), row[4])
+
+    def _save_state_sync(self, chat_id: str, state: _SyncState):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (chat_id, head_time, tail_time, tail_cursor, has_more, head_synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, state.head_time, state.tail_time, state.tail_cursor, int(state.has_more), state.head_synced_at),
+            )
+
+    def _merge_head_page_sync(self, chat_id: str, page: feishu_im_pb2.GetMessagesResponse) -> _SyncState:
+        """合并一页最新消息 (cursor="0")。与已有区间相连则向前延伸，否则以这一页重新开始区间。"""
+        self._upsert_sync(page.items)
+        state = self._load_state_sync(chat_id)
+        now = time.time()
+        if page.items:
+            newest, oldest = page.items[0].create_time, page.items[-1].create_time
+            if state is not None and state.head_time >= oldest:
+                state.head_time = max(state.head_time, newest)
+            else:
+                state = _SyncState(newest, oldest, page.next_cursor, page.has_more, now)
+        elif state is None:
+            state = _SyncState(0, 0, page.next_cursor, page.has_more, now)
+        state.head_synced_at = now
+        self._save_state_sync(chat_id, state)
+        return state
+
+    def _extend_tail_sync(self, chat_id: str, page: feishu_im_pb2.GetMessagesResponse) -> _SyncState:
+        """只修改尾部字段: 重新读取状态，不覆盖实时流在此期间推进的 head_time。"""
+        self._upsert_sync(page.items)
+        state = self._load_state_sync(chat_id)
+        if page.items:
+            state.tail_time = page.items[-1].create_time
+            state.tail_cursor = page.next_cursor
+            state.has_more = page.has_more
+        else:
+            state.has_more = False
+        self._save_state_sync(chat_id, state)
+        return state
+
+    def _select_sync(self, chat_id: str, state: _SyncState, before: Optional[Tuple[int, str]], limit: int) -> List[bytes]:
+        sql = "SELECT raw FROM messages WHERE chat_id = ? AND create_time >= ? AND create_time <= ?"
+        params: list = [chat_id, state.tail_time, state.head_time]
+        if before is not None:
+            sql += " AND (create_time < ? OR (create_time = ? AND message_id < ?))"
+            params += [before[0], before[0], before[1]]
+        sql += " ORDER BY create_time DESC, message_id DESC LIMIT ?"
+        params.append(limit)
+        return [row[0] for row in self._connection().execute(sql, params)]
+
+    def _build_search_sql(
+        self, terms: List[str], chat_id: Optional[str], sender_id: Optional[str],
+        start_time: Optional[int], end_time: Optional[int], limit: int, offset: int,
+    ) -> Tuple[str, list]:
+        """
+        3 个字符以上的词查 trigram 索引，两字中日韩词查二元组索引，其余的词 (单字、两个字母等) 退回到 LIKE 过滤。
+        有索引词时由 FTS 表驱动查询，LIKE 只过滤索引命中的行。
+        """
+        trigram: List[str] = []
+        bigram: List[str] = []
+        scan: List[str] = []
+        for term in terms:
+            if self._fts and len(term) >= _TRIGRAM_MIN_LENGTH:
+                trigram.append(term)
+            elif self._bigram and _CJK_BIGRAM.fullmatch(term):
+                bigram.append(term)
+            else:
+                scan.append(term)
+
+        tables: List[Tuple[str, List[str]]] = [(table, words) for table, words in (("messages_fts", trigram), ("messages_bigram", bigram)) if words]
+        conditions: List[str] = []
+        params: list = []
+        if tables:
+            sql = f"SELECT m.raw FROM {tables[0][0]} JOIN messages AS m ON m.rowid = {tables[0][0]}.rowid"
+            for table, _ in tables[1:]:
+                sql += f" JOIN {table} ON {table}.rowid = m.rowid"
+            for table, words in tables:
+                conditions.append(f"{table} MATCH ?")
+                params.append(" ".join(map(_fts_phrase, words)))
+        else:
+            sql = "SELECT m.raw FROM messages AS m"
+        for term in scan:
+            conditions.append("m.content LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(term))
+        if chat_id:
+            conditions.append("m.chat_id = ?")
+            params.append(chat_id)
+        if sender_id:
+            conditions.append("m.sender_id = ?")
+            params.append(sender_id)
+        if start_time is not None:
+            conditions.append("m.create_time >= ?")
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append("m.create_time <= ?")
+            params.append(end_time)
+        sql += " WHERE " + " AND ".join(conditions)
+        # 有索引词时按 BM25 相关度排序 (值越小越相关)，相关度相同或无索引词时按时间从新到旧
+        order = " + ".join(f"bm25({table})" for table, _ in tables) + ", " if tables else ""
+        sql += f" ORDER BY {order}m.create_time DESC, m.message_id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        return sql, params
+
+    def _search_sync(
+        self, terms: List[str], chat_id: Optional[str], sender_id: Optional[str],
+        start_time: Optional[int], end_time: Optional[int], limit: int, offset: int,
+    ) -> List[bytes]:
+        conn = self._connection()
+        sql, params = self._build_search_sql(terms, chat_id, sender_id, start_time, end_time, limit, offset)
+        return [row[0] for row in conn.execute(sql, params)]
+
+    def _add_live_sync(self, messages: List[feishu_im_pb2.Message], live_since: Dict[str, float]):
+        self._upsert_sync(messages)
+        for msg in messages:
+            since = live_since.get(msg.chat_id)
+            if since is None:
+                continue
+            state = self._load_state_sync(msg.chat_id)
+            # 只有当实时流在区间头部同步之前就已覆盖该会话时，区间才能保持连续
+            if state is not None and since <= state.head_synced_at and msg.create_time > state.head_time:
+                state.head_time = msg.create_time
+                self._save_state_sync(msg.chat_id, state)
+
+    # --- 异步接口 ---
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def upsert(self, messages: Iterable[feishu_im_pb2.Message]):
+        await self._run(self._upsert_sync, list(messages))
+
+    def submit_live_messages(self, messages: List[feishu_im_pb2.Message]):
+        """实时流写入: 提交到存储线程后立即返回，不阻塞消息分发。"""
+        live_since = {chat_id: since + self._live_grace for chat_id, (since, _) in self._live.items()}
+        future = self._executor.submit(self._add_live_sync, messages, live_since)
+        future.add_done_callback(_log_future_error)
+
+    def mark_live(self, chat_id: str):
+        since, refs = self._live.get(chat_id, (time.time(), 0))
+        self._live[chat_id] = (since, refs + 1)
+
+    def mark_idle(self, chat_id: str):
+        since, refs = self._live.get(chat_id, (0.0, 0))
+        if refs <= 1:
+            self._live.pop(chat_id, None)
+        else:
+            self._live[chat_id] = (since, refs - 1)
+
+    def _head_is_fresh(self, chat_id: str, state: Optional[_SyncState]) -> bool:
+        """
+        头部在 head_ttl 内同步过，或实时流在同步之前就已覆盖该会话 (此后的消息由实时流写入)。
+        实时流也可能漏消息 (上游断线且补齐不完整)，因此订阅中的会话最多 live_max_age 秒也要重新同步一次。
+        """
+        if state is None:
+            return False
+        age = time.time() - state.head_synced_at
+        if age < self._head_ttl:
+            return True
+        live = self._live.get(chat_id)
+        return live is not None and live[0] + self._live_grace <= state.head_synced_at and age < self._live_max_age
+
+    def _sync_lock(self, chat_id: str) -> asyncio.Lock:
+        lock = self._sync_locks.get(chat_id)
+        if lock is None:
+            lock = self._sync_locks[chat_id] = asyncio.Lock()
+        return lock
+
+    async def get_history(self, provider, chat_id: str, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+        """
+        优先从本地区间返回历史消息，只在本地不足时用 tail_cursor 向上游拉取缺失的尾部。
+        本地返回的分页使用 local: 前缀的游标；其他非 "0" 游标会直接透传给上游。
+        同一会话的并发请求依次同步区间，后到的请求直接使用前一个请求的同步结果。
+        """
+        if not chat_id:
+            raise ValueError("Chat ID 不能为空。")
+
+        before: Optional[Tuple[int, str]] = None
+        if cursor.startswith(LOCAL_CURSOR_PREFIX):
+            before = decode_local_cursor(cursor)
+        elif cursor != "0":
+            page = await provider.get_history_messages(chat_id, count, cursor)
+            await self.upsert(page.items)
+            return page
+
+        async with self._sync_lock(chat_id):
+            if cursor == "0":
+                state = await self._run(self._load_state_sync, chat_id)
+                if not self._head_is_fresh(chat_id, state):
+                    # 绕过分页缓存: 缓存中的第一页可能比本地区间还旧，刷新必须直接请求上游
+                    page = (await provider.fetch_history_page(chat_id, count, "0")).parse()
+                    await self._run(self._merge_head_page_sync, chat_id, page)
+
+            state = await self._run(self._load_state_sync, chat_id)
+            response = feishu_im_pb2.GetMessagesResponse()
+            if state is None:
+                return response
+
+            # 多取一条用来判断本地是否还有更早的消息
+            rows = await self._run(self._select_sync, chat_id, state, before, count + 1)
+            while len(rows) < count and state.has_more:
+                missing = count - len(rows)
+                logging.info(f"本地消息不足，向上游补齐 {missing} 条, Chat ID: {chat_id}")
+                page = await provider.get_history_messages(chat_id, missing, state.tail_cursor)
+                state = await self._run(self._extend_tail_sync, chat_id, page)
+                rows = await self._run(self._select_sync, chat_id, state, before, count + 1)
+
+        for raw in rows[:count]:
+            response.items.add().MergeFromString(raw)
+        response.has_more = len(rows) > count or state.has_more
+        if response.items and response.has_more:
+            response.next_cursor = encode_local_cursor(response.items[-1])
+        return response
+
+    async def search(
+        self, query: str, chat_id: Optional[str] = None, sender_id: Optional[str] = None,
+        start_time: Optional[int] = None, end_time: Optional[int] = None,
+        count: int = 20, cursor: str = "0",
+    ) -> feishu_im_pb2.GetMessagesResponse:
+        """
+        在本地已存储的消息中搜索正文，空白分隔的多个词需全部命中。
+        只覆盖已经通过历史同步或实时流写入本地的消息，不会向上游发起请求。
+        分页游标是结果偏移量 (字符串形式)，与历史消息接口一样通过 next_cursor 返回。
+        """
+        terms = query.split()
+        if not terms:
+            raise ValueError("搜索关键词不能为空。")
+        try:
+            offset = int(cursor)
+        except ValueError:
+            raise ValueError(f"无效的搜索分页游标: {cursor}")
+        if offset < 0:
+            raise ValueError(f"无效的搜索分页游标: {cursor}")
+
+        # 多取一条用来判断是否还有下一页
+        rows = await self._run(self._search_sync, terms, chat_id, sender_id, start_time, end_time, count + 1, offset)
+        response = feishu_im_pb2.GetMessagesResponse()
+        for raw in rows[:count]:
+            response.items.add().MergeFromString(raw)
+        response.has_more = len(rows) > count
+        if response.has_more:
+            response.next_cursor = str(offset + count)
+        return response
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(_close)
+        self._executor.shutdown(wait=False)
+
+
+def _log_future_error(future):
+    error = future.exception()
+    if error is not None:
+        logging.error(f"写入本地消息存储失败: {error}")
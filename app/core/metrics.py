@@ -0,0 +1,76 @@
+# core/metrics.py - Prometheus 指标: 上游延迟、解码/编码/发送耗时与运行计数
+from typing import Callable, Dict, Iterable
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# 进程内热路径 (解码、编码、发送) 通常在微秒到毫秒级，默认桶对它们过粗
+_FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+GATEWAY_LATENCY = Histogram(
+    "feishu_gateway_request_seconds",
+    "飞书网关请求耗时 (含长轮询等待)",
+    ["command"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60),
+)
+PROTOBUF_DECODE_LATENCY = Histogram(
+    "feishu_protobuf_decode_seconds",
+    "protobuf 解码耗时。stage=envelope 为 Frame 与 BizResponse 两层，history/stream 为业务负载",
+    ["stage"],
+    buckets=_FAST_BUCKETS,
+)
+SERIALIZE_LATENCY = Histogram(
+    "feishu_serialize_seconds",
+    "protobuf 直接编码为 JSON 字节的耗时。kind=message 为单条消息，page/ndjson/array 为整页或整批",
+    ["kind"],
+    buckets=_FAST_BUCKETS,
+)
+WEBHOOK_DELIVERY_LATENCY = Histogram(
+    "feishu_webhook_delivery_seconds",
+    "向 Webhook 目标 POST 一批消息的耗时 (单次尝试)",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+WEBSOCKET_SEND_LATENCY = Histogram(
+    "feishu_websocket_send_seconds",
+    "向 WebSocket 客户端发送一帧 (单条消息或批量模式下的一批消息) 的耗时",
+    buckets=_FAST_BUCKETS,
+)
+WEBSOCKET_BATCH_SIZE = Histogram(
+    "feishu_websocket_batch_messages",
+    "WebSocket 批量模式下每帧包含的消息数",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+MESSAGES_STREAMED = Counter("feishu_messages_streamed_total", "实时流分发给订阅者的消息数")
+STREAM_RECONNECTS = Counter("feishu_stream_reconnects_total", "实时长轮询因错误而重连的次数", ["reason"])
+STREAM_DUPLICATES = Counter("feishu_stream_duplicates_total", "实时流中被去重丢弃的重复消息数")
+STREAM_BACKFILLED = Counter("feishu_stream_backfilled_total", "长轮询重连后从历史消息补齐的消息数")
+STREAM_REPLAYED = Counter("feishu_stream_replayed_total", "客户端携带续传令牌重连时重放的消息数", ["source"])
+WEBHOOK_MESSAGES = Counter("feishu_webhook_messages_total", "Webhook 推送的消息数。result=delivered/spilled/dropped", ["result"])
+BIZ_ERRORS = Counter("feishu_biz_errors_total", "BizResponse 非零状态码次数", ["command", "code"])
+ACTIVE_WEBSOCKETS = Gauge("feishu_active_websocket_subscriptions", "当前活跃的 WebSocket 订阅数")
+
+
+class StatsCollector(Collector):
+    """把各组件 stats() 返回的数值字典导出为 Gauge，抓取时才读取，热路径上没有额外开销。"""
+
+    def __init__(self, sources: Dict[str, Callable[[], Dict[str, float]]]):
+        self._sources = sources
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        for component, stats in self._sources.items():
+            for name, value in stats().items():
+                if isinstance(value, (int, float)):
+                    yield GaugeMetricFamily(f"feishu_{component}_{name}", f"{component} 运行统计: {name}", value=value)
+
+
+def register_stats(sources: Dict[str, Callable[[], Dict[str, float]]]):
+    REGISTRY.register(StatsCollector(sources))
+
+
+def render_metrics() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
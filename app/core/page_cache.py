@@ -0,0 +1,105 @@
+# core/page_cache.py - 历史消息分页的内存 LRU/TTL 缓存与请求合并
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class PageCache:
+    """
+    有界 LRU 缓存，每个条目带过期时间。最新一页 (cursor="0") 会随新消息变化，只缓存很短时间；
+    更早的分页内容不可变，可以缓存较长时间。相同键的并发未命中只会触发一次上游调用 (single-flight)。
+
+    缓存的值 (例如 HistoryPage 及其解析出的 GetMessagesResponse) 是所有调用方共享的同一个对象，不做复制:
+    调用方必须只读，需要修改时先 CopyFrom 到新对象。
+    """
+
+    def __init__(self, max_entries: int, head_ttl: float, page_ttl: float):
+        self._max_entries = max_entries
+        self._head_ttl = head_ttl
+        self._page_ttl = page_ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_entries > 0
+
+    def _get(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: Hashable, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], is_head: bool) -> Any:
+        if not self.enabled:
+            return await loader()
+
+        while True:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            # 用 wait 而不是 shield: 只有等待者自己被取消时才抛出 CancelledError，
+            # inflight 被取消 (领头的调用方断开) 不会传递给等待者
+            await asyncio.wait((inflight,))
+            if not inflight.cancelled():
+                return inflight.result()
+            # 领头的调用被取消，重新检查: 第一个醒来的等待者成为新的领头者重新加载，其余的合并到它上面
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # 标记异常已被读取，没有其他等待者时避免 "exception was never retrieved" 警告
+                future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._put(key, value, self._head_ttl if is_head else self._page_ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_entries": self._max_entries,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
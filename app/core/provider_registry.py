@@ -0,0 +1,147 @@
+# core/provider_registry.py - 按认证信息复用 Provider 的进程级注册表
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+
+class _Entry:
+    __slots__ = ("provider", "refs", "last_used")
+
+    def __init__(self, provider: Any):
+        self.provider = provider
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+
+class ProviderRegistry:
+    """
+    以认证信息哈希为键缓存 Provider，使同一组认证信息复用同一个连接池。
+    采用 LRU + 空闲 TTL 淘汰；正在被使用 (refs > 0) 的 Provider 不会被关闭，
+    被淘汰时会延迟到最后一个使用者释放后再关闭。
+    """
+
+    def __init__(self, factory: Callable[[Any], Any], max_size: int, idle_ttl: float):
+        self._factory = factory
+        self._max_size = max(1, max_size)
+        self._idle_ttl = idle_ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._retired: Dict[int, _Entry] = {}
+        self._lock = asyncio.Lock()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def acquire(self, key: str, credentials: Any) -> Any:
+        to_close = []
+        async with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                entry = _Entry(self._factory(credentials))
+                self._entries[key] = entry
+                to_close = self._evict_overflow()
+            entry.refs += 1
+            entry.last_used = time.monotonic()
+        await self._close_all(to_close)
+        return entry.provider
+
+    async def release(self, key: str, provider: Any):
+        close_now = False
+        async with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.provider is provider:
+                entry.refs -= 1
+                entry.last_used = time.monotonic()
+            else:
+                # 已被淘汰的 Provider，由最后一个使用者负责关闭
+                entry = self._retired.get(id(provider))
+                if entry is not None:
+                    entry.refs -= 1
+                    close_now = entry.refs <= 0
+                    if close_now:
+                        del self._retired[id(provider)]
+        if close_now:
+            await self._close_all([provider])
+
+    @asynccontextmanager
+    async def lease(self, key: str, credentials: Any) -> AsyncIterator[Any]:
+        provider = await self.acquire(key, credentials)
+        try:
+            yield provider
+        finally:
+            await self.release(key, provider)
+
+    def _evict_overflow(self) -> list:
+        """在持有锁的情况下淘汰最久未使用的条目，返回需要立即关闭的 Provider。"""
+        to_close = []
+        for key in list(self._entries.keys()):
+            if len(self._entries) <= self._max_size:
+                break
+            entry = self._entries.pop(key)
+            self.evictions += 1
+            if entry.refs > 0:
+                self._retired[id(entry.provider)] = entry
+            else:
+                to_close.append(entry.provider)
+        return to_close
+
+    async def sweep(self):
+        """关闭空闲时间超过 TTL 的 Provider。"""
+        now = time.monotonic()
+        to_close = []
+        async with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.refs <= 0 and now - entry.last_used > self._idle_ttl:
+                    del self._entries[key]
+                    self.evictions += 1
+                    to_close.append(entry.provider)
+        if to_close:
+            logging.info(f"已关闭 {len(to_close)} 个空闲的 Provider 连接池。")
+        await self._close_all(to_close)
+
+    async def _sweep_loop(self):
+        interval = max(1.0, min(60.0, self._idle_ttl / 2))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.error(f"清理空闲 Provider 时发生错误: {e}")
+
+    def start(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        async with self._lock:
+            providers = [entry.provider for entry in self._entries.values()]
+            providers += [entry.provider for entry in self._retired.values()]
+            self._entries.clear()
+            self._retired.clear()
+        await self._close_all(providers)
+
+    async def _close_all(self, providers):
+        for provider in providers:
+            try:
+                await provider.aclose()
+            except Exception as e:
+                logging.warning(f"关闭 Provider 连接池失败: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "in_use": sum(1 for entry in self._entries.values() if entry.refs > 0),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
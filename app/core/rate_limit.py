@@ -0,0 +1,219 @@
+# core/rate_limit.py - 上游限流 (令牌桶)、指数退避与熔断
+import asyncio
+import random
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from config import settings
+
+AUTH_FAILURE_CODES = (401, 403)
+RETRYABLE_HTTP_STATUS = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """认证连续失败后熔断器打开，在冷却期内拒绝继续请求上游。"""
+
+
+class TokenBucket:
+    """
+    令牌桶: 以 rate 个/秒的速度补充，最多积累 burst 个。
+    令牌不足时按先来后到预约未来的令牌并等待，因此等待者之间也是公平的。
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self.waiting = 0
+        self.throttled = 0
+        self.total_delay = 0.0
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_acquire(self) -> float:
+        """不等待: 有令牌时取走一个并返回 0，否则不预约，返回还需等待的秒数。"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        self.throttled += 1
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        delay = self._reserve()
+        if delay <= 0:
+            return
+        self.throttled += 1
+        self.total_delay += delay
+        self.waiting += 1
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+
+    def is_idle(self, now: float, idle_ttl: float) -> bool:
+        """超过 idle_ttl 未使用、没有等待者且令牌已补满: 与新建的桶等价，可以丢弃。"""
+        idle = now - self._updated
+        return self.waiting == 0 and idle > idle_ttl and self._tokens + idle * self.rate >= self.burst
+
+
+class Backoff:
+    """带抖动的指数退避: 第 n 次等待在 [d/2, d] 之间随机，d = min(maximum, base * 2^n)。"""
+
+    def __init__(self, base: float, maximum: float):
+        self.base = base
+        self.maximum = maximum
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        ceiling = min(self.maximum, self.base * (2 ** self.attempt))
+        self.attempt += 1
+        return random.uniform(ceiling / 2, ceiling)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class CircuitBreaker:
+    """连续 threshold 次认证失败 (401/403) 后打开；冷却 cooldown 秒后允许重新尝试，再次失败会立即重新打开。"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_used = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.threshold and time.monotonic() - self.opened_at < self.cooldown
+
+    def check(self):
+        self.last_used = time.monotonic()
+        if self.is_open:
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(f"认证连续失败 {self.failures} 次，熔断中 (约 {remaining:.0f} 秒后重试)。请更新认证信息。")
+
+    def record_auth_failure(self):
+        self.last_used = time.monotonic()
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        self.last_used = time.monotonic()
+        self.failures = 0
+
+    def is_idle(self, now: float, idle_ttl: float) -> bool:
+        """超过 idle_ttl 未使用且未处于熔断中。"""
+        return not self.is_open and now - self.last_used > idle_ttl
+
+
+class UpstreamGuard:
+    """
+    进程级的上游请求守卫: 按 (cookie, command id) 限流，按 cookie 熔断。
+    所有 Provider 共享同一个实例，因此同一个 cookie 的所有请求共享配额。
+    空闲超过 idle_ttl 的令牌桶与熔断器在请求路径上顺带清理，cookie 不断轮换时也不会无限增长。
+    """
+
+    def __init__(self, idle_ttl: float):
+        self._buckets: Dict[Tuple[Hashable, str], TokenBucket] = {}
+        self._breakers: Dict[Hashable, CircuitBreaker] = {}
+        self._idle_ttl = idle_ttl
+        self._sweep_interval = max(1.0, min(60.0, idle_ttl / 2))
+        self._next_sweep = time.monotonic() + self._sweep_interval
+        self.evictions = 0
+
+    def _bucket(self, cookie_key: Hashable, command_id: str, kind: str) -> TokenBucket:
+        key = (cookie_key, command_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if kind == "stream":
+                bucket = TokenBucket(settings.UPSTREAM_STREAM_RATE, settings.UPSTREAM_STREAM_BURST)
+            else:
+                bucket = TokenBucket(settings.UPSTREAM_HISTORY_RATE, settings.UPSTREAM_HISTORY_BURST)
+            self._buckets[key] = bucket
+        return bucket
+
+    def breaker(self, cookie_key: Hashable) -> CircuitBreaker:
+        breaker = self._breakers.get(cookie_key)
+        if breaker is None:
+            breaker = self._breakers[cookie_key] = CircuitBreaker(
+                settings.CIRCUIT_BREAKER_THRESHOLD, settings.CIRCUIT_BREAKER_COOLDOWN
+            )
+        return breaker
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """丢弃空闲的令牌桶与熔断器 (见各自的 is_idle)，之后再次使用时按初始状态重新创建。返回丢弃的数量。"""
+        now = time.monotonic() if now is None else now
+        idle_buckets = [key for key, bucket in self._buckets.items() if bucket.is_idle(now, self._idle_ttl)]
+        for key in idle_buckets:
+            del self._buckets[key]
+        idle_breakers = [key for key, breaker in self._breakers.items() if breaker.is_idle(now, self._idle_ttl)]
+        for key in idle_breakers:
+            del self._breakers[key]
+        evicted = len(idle_buckets) + len(idle_breakers)
+        self.evictions += evicted
+        return evicted
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self._sweep_interval
+            self.sweep(now)
+
+    async def acquire(self, cookie_key: Hashable, command_id: str, kind: str):
+        self._maybe_sweep()
+        self.breaker(cookie_key).check()
+        await self._bucket(cookie_key, command_id, kind).acquire()
+
+    def record_status(self, cookie_key: Hashable, code: int):
+        """
+        记录一次请求的最终结果: 失败时为 HTTP 状态码或 BizResponse.code，成功时为 0。
+        每个请求只记录一次，否则 HTTP 200 会把紧随其后的业务层 401 计数清零。
+        """
+        breaker = self.breaker(cookie_key)
+        if code in AUTH_FAILURE_CODES:
+            breaker.record_auth_failure()
+        elif code == 0:
+            breaker.record_success()
+
+    def stats(self) -> Dict[str, float]:
+        buckets = self._buckets.values()
+        return {
+            "buckets": len(self._buckets),
+            "breakers": len(self._breakers),
+            "evictions": self.evictions,
+            "queue_depth": sum(bucket.waiting for bucket in buckets),
+            "throttled_requests": sum(bucket.throttled for bucket in buckets),
+            "throttle_delay_seconds": round(sum(bucket.total_delay for bucket in buckets), 3),
+            "open_circuits": sum(1 for breaker in self._breakers.values() if breaker.is_open),
+        }
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """解析 Retry-After 头 (仅支持秒数形式)，无法解析时返回 None。"""
+    value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def new_backoff() -> Backoff:
+    return Backoff(settings.UPSTREAM_BACKOFF_BASE, settings.UPSTREAM_BACKOFF_MAX)
+
+
+upstream_guard = UpstreamGuard(settings.UPSTREAM_LIMIT_IDLE_TTL)
@@ -0,0 +1,120 @@
+# core/replay.py - 实时消息重放缓冲区与断线续传令牌
+from collections import OrderedDict, deque
+from typing import Deque, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import feishu_im_pb2
+
+from core.dedup import StreamDeduplicator
+
+
+def parse_resume_token(token: str) -> Tuple[int, str]:
+    """
+    续传令牌格式为 "<create_time>[:<message_id>]"，即客户端最后收到的一条消息。
+    只给时间戳时按时间续传；带上 message_id 时同一毫秒内的其他消息也不会丢失或重复。
+    """
+    create_time, _, message_id = token.strip().partition(":")
+    try:
+        return int(create_time), message_id
+    except ValueError:
+        raise ValueError(f"无效的续传令牌: {token}")
+
+
+def messages_after(messages: Sequence[feishu_im_pb2.Message], since_time: int, since_id: str) -> List[feishu_im_pb2.Message]:
+    """
+    messages 按时间正序 (同一毫秒内按投递顺序)。返回令牌之后的消息: 晚于 since_time 的全部消息，
+    以及同一毫秒内排在 since_id 之后的消息。令牌不带 message_id 时视为该毫秒已全部收到；
+    since_id 不在其中时无法定位，该毫秒的消息全部保留 (宁可重复也不遗漏)。
+    """
+    skipped = set()
+    if since_id:
+        same_ms = [msg.message_id for msg in messages if msg.create_time == since_time]
+        if since_id in same_ms:
+            skipped = set(same_ms[:same_ms.index(since_id) + 1])
+    return [
+        msg for msg in messages
+        if msg.create_time > since_time
+        or (msg.create_time == since_time and since_id and msg.message_id not in skipped)
+    ]
+
+
+class _ChatBuffer:
+    """complete_after 之后的实时消息都按到达顺序保存在 entries 中 (直到被容量淘汰)。"""
+    __slots__ = ("entries", "complete_after")
+
+    def __init__(self, capacity: int, complete_after: int):
+        self.entries: Deque[feishu_im_pb2.Message] = deque(maxlen=capacity)
+        self.complete_after = complete_after
+
+
+class ReplayBuffer:
+    """
+    按 (上游键, chat_id) 保存最近的实时消息。客户端带着续传令牌重连时，
+    令牌落在缓冲覆盖范围内就直接重放，否则由调用方回退到历史消息。
+    """
+
+    def __init__(self, per_chat_capacity: int, max_chats: int):
+        self._capacity = per_chat_capacity
+        self._max_chats = max_chats
+        self._chats: "OrderedDict[Tuple[Hashable, str], _ChatBuffer]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._capacity > 0 and self._max_chats > 0
+
+    def reset(self, key: Hashable, chat_id: str, complete_after: int):
+        """从 complete_after 开始重新记录该会话 (之前的内容不再保证连续)。"""
+        if not self.enabled:
+            return
+        self._chats[(key, chat_id)] = _ChatBuffer(self._capacity, complete_after)
+        self._chats.move_to_end((key, chat_id))
+        while len(self._chats) > self._max_chats:
+            self._chats.popitem(last=False)
+
+    def append(self, key: Hashable, msg: feishu_im_pb2.Message):
+        buffer = self._chats.get((key, msg.chat_id))
+        if buffer is None:
+            return
+        if len(buffer.entries) == buffer.entries.maxlen:
+            # 最早的一条即将被淘汰，覆盖范围随之后移
+            buffer.complete_after = max(buffer.complete_after, buffer.entries[0].create_time)
+        buffer.entries.append(msg)
+
+    def restore(self, key: Hashable, chat_ids: Iterable[str], dedup: StreamDeduplicator) -> List[str]:
+        """
+        上游重新建立时，用缓冲区中的消息初始化去重状态，返回可以从缓冲区末尾继续 (只需补齐间隙) 的会话。
+        """
+        restored = []
+        for chat_id in chat_ids:
+            buffer = self._chats.get((key, chat_id))
+            if buffer is None:
+                continue
+            state = dedup.chat(chat_id)
+            state.floor = buffer.complete_after
+            state.last_time = buffer.complete_after
+            for msg in buffer.entries:
+                state.record(msg.message_id, msg.create_time)
+            restored.append(chat_id)
+        return restored
+
+    def replay(self, key: Hashable, chat_id: str, since_time: int, since_id: str) -> Optional[List[feishu_im_pb2.Message]]:
+        """返回令牌之后的消息 (按到达顺序)；令牌早于缓冲覆盖范围时返回 None。"""
+        buffer = self._chats.get((key, chat_id))
+        if buffer is None or since_time < buffer.complete_after:
+            return None
+        self._chats.move_to_end((key, chat_id))
+        entries = list(buffer.entries)
+        if since_id:
+            for index, msg in enumerate(entries):
+                if msg.message_id == since_id:
+                    return entries[index + 1:]
+        return messages_after(entries, since_time, since_id)
+
+    def recent(self, key: Hashable, chat_id: str) -> List[feishu_im_pb2.Message]:
+        buffer = self._chats.get((key, chat_id))
+        return list(buffer.entries) if buffer is not None else []
+
+    def stats(self):
+        return {
+            "chats": len(self._chats),
+            "messages": sum(len(buffer.entries) for buffer in self._chats.values()),
+        }
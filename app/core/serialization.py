@@ -0,0 +1,120 @@
+# core/serialization.py - 从 protobuf 直接生成 JSON 字节，跳过中间字典
+import json
+import logging
+from typing import Iterable, Optional
+
+import feishu_im_pb2
+
+from core.metrics import SERIALIZE_LATENCY
+
+try:
+    import orjson
+
+    def _encode_str(value: str) -> bytes:
+        return orjson.dumps(value)
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+except ImportError:
+    orjson = None
+    logging.warning("未安装 orjson，消息序列化将使用标准库 json (速度较慢)。")
+
+    def _encode_str(value: str) -> bytes:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def dumps(value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+JSON_MEDIA_TYPE = "application/json"
+PROTOBUF_MEDIA_TYPE = "application/x-protobuf"
+_PROTOBUF_MEDIA_TYPES = (PROTOBUF_MEDIA_TYPE, "application/protobuf", "application/vnd.google.protobuf")
+
+# 预先拼好的键片段，字段顺序即 API 返回的消息字典顺序: message_id, chat_id, sender, create_time, content
+_MESSAGE_ID = b'{"message_id":'
+_CHAT_ID = b',"chat_id":'
+_SENDER_ID = b',"sender":{"id":'
+_SENDER_NAME = b',"name":'
+_SENDER_AVATAR = b',"avatar_url":'
+_NO_SENDER = b',"sender":{}'
+_CREATE_TIME = b',"create_time":'
+_CONTENT = b',"content":'
+_END = b"}"
+_PAGE_HAS_MORE = (b'{"has_more":false,"next_cursor":', b'{"has_more":true,"next_cursor":')
+_PAGE_MESSAGES = b',"messages":['
+_PAGE_END = b"]}"
+
+
+def _encode_message(msg: feishu_im_pb2.Message) -> bytes:
+    if msg.HasField("sender"):
+        sender = msg.sender
+        sender_part = b"".join((
+            _SENDER_ID, _encode_str(sender.sender_id),
+            _SENDER_NAME, _encode_str(sender.name),
+            _SENDER_AVATAR, _encode_str(sender.avatar_url), _END,
+        ))
+    else:
+        sender_part = _NO_SENDER
+    # 未设置的 text_content 读出来就是空字符串，不需要 HasField
+    return b"".join((
+        _MESSAGE_ID, _encode_str(msg.message_id),
+        _CHAT_ID, _encode_str(msg.chat_id),
+        sender_part,
+        _CREATE_TIME, str(msg.create_time).encode("ascii"),
+        _CONTENT, _encode_str(msg.text_content.text), _END,
+    ))
+
+
+# 耗时按调用 (单条或整页) 记录，而不是按页内每条消息记录，避免指标本身成为热点
+@SERIALIZE_LATENCY.labels("message").time()
+def encode_message(msg: feishu_im_pb2.Message) -> bytes:
+    """把单条消息编码为 API 消息字典 (message_id/chat_id/sender/create_time/content) 的 JSON 字节。"""
+    return _encode_message(msg)
+
+
+@SERIALIZE_LATENCY.labels("page").time()
+def encode_history_page(response_pb: feishu_im_pb2.GetMessagesResponse) -> bytes:
+    """历史消息接口的响应体: {"has_more", "next_cursor", "messages"}。"""
+    return b"".join((
+        _PAGE_HAS_MORE[response_pb.has_more], _encode_str(str(response_pb.next_cursor)),
+        _PAGE_MESSAGES, b",".join(map(_encode_message, response_pb.items)), _PAGE_END,
+    ))
+
+
+@SERIALIZE_LATENCY.labels("ndjson").time()
+def encode_ndjson(messages: Iterable[feishu_im_pb2.Message]) -> bytes:
+    """每行一条消息的 NDJSON。"""
+    return b"".join(_encode_message(msg) + b"\n" for msg in messages)
+
+
+@SERIALIZE_LATENCY.labels("array").time()
+def encode_message_array(messages: Iterable[feishu_im_pb2.Message]) -> bytes:
+    """JSON 数组形式的一批消息。"""
+    return b"".join((b"[", b",".join(map(_encode_message, messages)), b"]"))
+
+
+def encode_stream_batch(messages: Iterable[feishu_im_pb2.Message]) -> bytes:
+    """protobuf 形式的一批消息: 与上游实时流相同的 StreamResponse。"""
+    response = feishu_im_pb2.StreamResponse()
+    response.new_messages.extend(messages)
+    return response.SerializeToString()
+
+
+def wants_protobuf(accept: Optional[str]) -> bool:
+    """Accept 头中列出了 protobuf 类型 (且 q 不为 0) 时返回 True，客户端将直接收到 feishu_im.proto 定义的二进制。"""
+    if not accept:
+        return False
+    for media_range in accept.split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        if media_type.lower() not in _PROTOBUF_MEDIA_TYPES:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    if float(value) == 0:
+                        break
+                except ValueError:
+                    pass
+        else:
+            return True
+    return False
@@ -0,0 +1,194 @@
+# core/subscription_hub.py - 上游实时消息流的共享订阅、按 topic 路由与扇出
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterable, Optional, Set
+
+SLOW_CONSUMER_DROP = "drop"  # 丢弃最旧的积压消息
+SLOW_CONSUMER_DROP_NEWEST = "drop_newest"  # 保留积压，丢弃新到的消息
+SLOW_CONSUMER_DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (SLOW_CONSUMER_DROP, SLOW_CONSUMER_DROP_NEWEST, SLOW_CONSUMER_DISCONNECT)
+
+_END = object()
+
+
+class SlowConsumerError(Exception):
+    """订阅者消费过慢，队列溢出后被主动断开。"""
+
+
+class Subscription:
+    """单个本地订阅者，持有一个有界队列，由 Hub 非阻塞地写入。"""
+
+    def __init__(self, maxsize: int, policy: str):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._ended = False
+
+    def offer(self, item: Any):
+        if self._closed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == SLOW_CONSUMER_DISCONNECT:
+                self.close(SlowConsumerError(f"订阅队列已满 ({self.queue.maxsize})，断开慢消费者。"))
+                return
+            if self.policy == SLOW_CONSUMER_DROP_NEWEST:
+                self.dropped += 1
+                return
+            # 丢弃最旧的一条，为新消息腾出位置
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.queue.put_nowait(item)
+
+    def close(self, error: Optional[BaseException] = None):
+        """结束订阅。error 会在消费者下一次读取时抛出。"""
+        if self._closed:
+            return
+        self._closed = True
+        self._error = error
+        # 清空积压，保证结束标记一定能放入队列并被立即读到
+        if error is not None:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(_END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._ended:
+            item = await self.queue.get()
+            if item is not _END:
+                return item
+            self._ended = True
+        if self._error is not None:
+            raise self._error
+        raise StopAsyncIteration
+
+    def drain(self, limit: int) -> list:
+        """不等待，取出最多 limit 条已积压的消息。读到结束标记时停止，由下一次 __anext__ 结束迭代。"""
+        items = []
+        while len(items) < limit and not self._ended and not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is _END:
+                self._ended = True
+                break
+            items.append(item)
+        return items
+
+
+class _Channel:
+    def __init__(self, key: Hashable):
+        self.key = key
+        # topic -> 订阅了该 topic 的订阅者；其键集合即为当前需要上游放行的 topic
+        self.topics: Dict[Hashable, Set[Subscription]] = {}
+        self.subscribers: Set[Subscription] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, subscription: Subscription, topics: Iterable[Hashable]):
+        self.subscribers.add(subscription)
+        for topic in topics:
+            self.topics.setdefault(topic, set()).add(subscription)
+
+    def remove(self, subscription: Subscription, topics: Iterable[Hashable]):
+        self.subscribers.discard(subscription)
+        for topic in topics:
+            members = self.topics.get(topic)
+            if members is None:
+                continue
+            members.discard(subscription)
+            if not members:
+                del self.topics[topic]
+
+
+class SubscriptionHub:
+    """
+    为每个上游键 (例如 一组认证信息) 只维持一个上游消息流，按 route(item) 得到的
+    topic (例如 chat_id) 把消息扇出给订阅了该 topic 的本地订阅者。订阅者按引用计数
+    管理，最后一个订阅者离开时关闭上游。
+    """
+
+    def __init__(self, queue_size: int, slow_consumer_policy: str = SLOW_CONSUMER_DROP):
+        self._queue_size = queue_size
+        self._policy = slow_consumer_policy
+        self._channels: Dict[Hashable, _Channel] = {}
+
+    @asynccontextmanager
+    async def subscribe(
+        self,
+        key: Hashable,
+        topics: Iterable[Hashable],
+        source_factory: Callable[[Dict[Hashable, Set[Subscription]]], AsyncIterator[Any]],
+        route: Callable[[Any], Hashable],
+        policy: Optional[str] = None,
+    ) -> AsyncIterator[Subscription]:
+        """
+        source_factory 接收当前活跃 topic 的实时视图 (只读)，返回上游异步迭代器。
+        同一 key 下的所有订阅共享一个上游。policy 可为单个订阅者覆盖默认的慢消费者策略。
+        """
+        topics = list(dict.fromkeys(topics))
+        subscription = Subscription(self._queue_size, policy or self._policy)
+        channel = self._channels.get(key)
+        created = channel is None
+        if created:
+            channel = _Channel(key)
+            self._channels[key] = channel
+        # 先登记 topic 再启动上游，使上游启动时即可看到初始 topic 集合
+        channel.add(subscription, topics)
+        if created:
+            channel.task = asyncio.create_task(self._pump(channel, source_factory, route))
+            logging.info(f"已创建上游订阅: {key}")
+        logging.info(f"订阅者加入: {key} topics={topics} (当前 {len(channel.subscribers)} 个)")
+        try:
+            yield subscription
+        finally:
+            channel.remove(subscription, topics)
+            subscription.close()
+            if not channel.subscribers:
+                await self._teardown(channel)
+
+    async def _teardown(self, channel: _Channel):
+        if self._channels.get(channel.key) is channel:
+            del self._channels[channel.key]
+        task = channel.task
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        logging.info(f"已关闭上游订阅: {channel.key}")
+
+    async def _pump(self, channel: _Channel, source_factory, route: Callable[[Any], Hashable]):
+        error: Optional[BaseException] = None
+        try:
+            async for item in source_factory(channel.topics):
+                members = channel.topics.get(route(item))
+                if not members:
+                    continue
+                for subscription in list(members):
+                    subscription.offer(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"上游订阅 {channel.key} 异常结束: {e}")
+            error = e
+        # 上游自然结束或出错: 通知所有订阅者，并让后续订阅重新建立上游
+        if self._channels.get(channel.key) is channel:
+            del self._channels[channel.key]
+        for subscription in list(channel.subscribers):
+            subscription.close(error)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "channels": len(self._channels),
+            "topics": sum(len(channel.topics) for channel in self._channels.values()),
+            "subscribers": sum(len(channel.subscribers) for channel in self._channels.values()),
+        }
@@ -0,0 +1,496 @@
+# core/webhooks.py - 实时消息的 Webhook 推送: 按目标排队、批量投递、重试与磁盘溢出
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+import uuid
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import feishu_im_pb2
+
+from core.metrics import WEBHOOK_DELIVERY_LATENCY, WEBHOOK_MESSAGES
+from core.rate_limit import Backoff, RETRYABLE_HTTP_STATUS, retry_after_seconds
+from core.serialization import JSON_MEDIA_TYPE, encode_message_array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 不通过接口对外暴露的字段；目标被删除或停用时从磁盘上清除
+_PRIVATE_FIELDS = ("credentials", "secret")
+
+_LENGTH = struct.Struct(">I")
+
+SubscribeChat = Callable[[Dict[str, Any], str], AsyncContextManager[AsyncIterator[feishu_im_pb2.Message]]]
+
+
+class WebhookURLError(ValueError):
+    """Webhook 地址不允许投递 (非 http/https、主机不在白名单内或解析到内网地址)。"""
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    # is_global 已排除私有、回环、链路本地、保留与运营商级 NAT 地址段
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_webhook_url(url: str, allowed_hosts: Sequence[str]) -> None:
+    """
+    防止把服务端当作跳板访问内网 (SSRF)。配置了 allowed_hosts 时只允许其中的主机 (可以是内网地址)；
+    否则主机解析出的所有地址都必须是公网地址。注册时和每次投递前都会检查，避免 DNS 记录事后被改到内网。
+    解析失败时抛出 OSError (可能只是暂时的，由调用方决定是否重试)。
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").rstrip(".").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise WebhookURLError(f"无效的 Webhook 地址: {url}")
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise WebhookURLError(f"Webhook 主机 {host} 不在 WEBHOOK_ALLOWED_HOSTS 中")
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise WebhookURLError(f"无效的 Webhook 地址: {url}")
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for info in infos:
+        if not _is_public_address(info[4][0]):
+            raise WebhookURLError(f"Webhook 主机 {host} 解析到非公网地址 {info[4][0]}")
+
+
+class _SpillFile:
+    """
+    目标消费过慢、内存队列已满时，后续消息按 4 字节长度前缀 + Message 二进制追加到磁盘，
+    投递端从已确认的偏移处顺序读回。偏移单独持久化，进程重启后从断点继续 (至少一次投递)。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self._path = os.path.join(directory, "spill.bin")
+        self._offset_path = os.path.join(directory, "spill.offset")
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        try:
+            with open(self._offset_path, encoding="ascii") as f:
+                self.offset = min(int(f.read() or 0), self.size)
+        except (FileNotFoundError, ValueError):
+            self.offset = 0
+
+    @property
+    def pending(self) -> bool:
+        return self.offset < self.size
+
+    def append(self, messages: List[feishu_im_pb2.Message]) -> int:
+        """追加消息，超过容量上限的部分被丢弃。返回实际写入的条数。"""
+        with self._lock:
+            records = []
+            size = self.size
+            for msg in messages:
+                data = msg.SerializeToString()
+                if size + _LENGTH.size + len(data) > self._max_bytes:
+                    break
+                records.append(_LENGTH.pack(len(data)) + data)
+                size += _LENGTH.size + len(data)
+            if records:
+                with open(self._path, "ab") as f:
+                    f.write(b"".join(records))
+                self.size = size
+            return len(records)
+
+    def read(self, limit: int) -> Tuple[List[feishu_im_pb2.Message], int]:
+        """从当前偏移读取最多 limit 条，返回消息与读完后的偏移 (确认投递后再 commit)。"""
+        with self._lock:
+            messages = []
+            with open(self._path, "rb") as f:
+                f.seek(self.offset)
+                position = self.offset
+                while len(messages) < limit and position < self.size:
+                    (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+                    messages.append(feishu_im_pb2.Message.FromString(f.read(length)))
+                    position += _LENGTH.size + length
+            return messages, position
+
+    def commit(self, offset: int):
+        with self._lock:
+            self.offset = offset
+            if self.offset >= self.size:
+                # 全部读完: 截断文件，回到内存队列模式
+                with open(self._path, "wb"):
+                    pass
+                self.offset = self.size = 0
+            with open(self._offset_path, "w", encoding="ascii") as f:
+                f.write(str(self.offset))
+
+
+class _TargetRunner:
+    """单个 Webhook 目标: 订阅会话实时流写入有界队列 (满了溢出到磁盘)，另一协程按批投递。"""
+
+    def __init__(self, manager: "WebhookManager", target: Dict[str, Any], lock_fd: int):
+        self.target = target
+        self.lock_fd = lock_fd
+        self._manager = manager
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=manager.queue_size)
+        self._spill = _SpillFile(manager.target_dir(target["target_id"]), manager.spill_max_bytes)
+        self._batch_size = target.get("batch_size") or manager.batch_size
+        self._flush_interval = (target.get("flush_ms") or manager.flush_ms) / 1000
+        self.stats: Dict[str, Any] = {"delivered": 0, "spilled": 0, "dropped": 0, "failed_attempts": 0, "last_error": None}
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # 任一协程异常退出都会取消另一个，由 WebhookManager 的巡检重启；目标被停用时正常结束，不再重启
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self._consume())
+                group.create_task(self._deliver())
+        except* WebhookURLError as group:
+            reason = str(group.exceptions[0])
+            logging.error(f"Webhook {self.target['target_id']} 已停用: {reason}")
+            await asyncio.to_thread(self._manager.disable, self.target["target_id"], reason)
+
+    async def _consume(self):
+        backoff = self._manager.new_backoff()
+        target = self.target
+        while True:
+            try:
+                async with self._manager.subscribe(target["credentials"], target["chat_id"]) as subscription:
+                    async for msg in subscription:
+                        backoff.reset()
+                        await self._enqueue(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Webhook {target['target_id']} 的实时订阅中断: {e}")
+            delay = backoff.next_delay()
+            await asyncio.sleep(delay)
+
+    async def _enqueue(self, msg: feishu_im_pb2.Message):
+        # 一旦开始溢出，后续消息都写入磁盘直到读空，保证投递顺序
+        if not self._spill.pending:
+            try:
+                self._queue.put_nowait(msg)
+                return
+            except asyncio.QueueFull:
+                pass
+        written = await asyncio.to_thread(self._spill.append, [msg])
+        if written:
+            self.stats["spilled"] += 1
+            WEBHOOK_MESSAGES.labels("spilled").inc()
+        else:
+            self.stats["dropped"] += 1
+            WEBHOOK_MESSAGES.labels("dropped").inc()
+            logging.error(f"Webhook {self.target['target_id']} 的溢出文件已满，丢弃消息 {msg.message_id}")
+
+    async def _next_batch(self) -> Tuple[List[feishu_im_pb2.Message], Optional[int]]:
+        """凑满 batch_size 条或自第一条起等待 flush_ms，二者先到为准。队列空且磁盘有积压时直接读磁盘。"""
+        if self._queue.empty() and self._spill.pending:
+            return await asyncio.to_thread(self._spill.read, self._batch_size)
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self._batch_size or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch, None
+
+    async def _deliver(self):
+        while True:
+            batch, spill_offset = await self._next_batch()
+            if batch:
+                await self._post_with_retry(batch)
+            if spill_offset is not None:
+                await asyncio.to_thread(self._spill.commit, spill_offset)
+
+    def _build_request(self, batch: List[feishu_im_pb2.Message]) -> Tuple[bytes, Dict[str, str]]:
+        target = self.target
+        body = b"".join((
+            b'{"target_id":', json.dumps(target["target_id"]).encode("utf-8"),
+            b',"chat_id":', json.dumps(target["chat_id"], ensure_ascii=False).encode("utf-8"),
+            b',"messages":', encode_message_array(batch), b"}",
+        ))
+        headers = {"Content-Type": JSON_MEDIA_TYPE, "X-Webhook-Id": target["target_id"]}
+        if target.get("secret"):
+            signature = hmac.new(target["secret"].encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers["X-Webhook-Signature"] = f"sha256={signature}"
+        return body, headers
+
+    async def _post_with_retry(self, batch: List[feishu_im_pb2.Message]):
+        """2xx 视为成功；429/5xx 与网络错误按退避无限重试 (积压由队列与溢出文件承接)；其余 4xx 丢弃该批。"""
+        target_id = self.target["target_id"]
+        body, headers = self._build_request(batch)
+        backoff = self._manager.new_backoff()
+        while True:
+            delay = None
+            try:
+                # 地址不再允许投递时 WebhookURLError 向上传播，目标随之停用
+                await self._manager.check_url(self.target["url"])
+                with WEBHOOK_DELIVERY_LATENCY.time():
+                    response = await self._manager.http_client().post(self.target["url"], content=body, headers=headers)
+                if response.is_success:
+                    self.stats["delivered"] += len(batch)
+                    WEBHOOK_MESSAGES.labels("delivered").inc(len(batch))
+                    return
+                error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRYABLE_HTTP_STATUS:
+                    self.stats["dropped"] += len(batch)
+                    self.stats["last_error"] = error
+                    WEBHOOK_MESSAGES.labels("dropped").inc(len(batch))
+                    logging.error(f"Webhook {target_id} 返回 {error}，丢弃 {len(batch)} 条消息。")
+                    return
+                delay = retry_after_seconds(response.headers)
+            except (httpx.HTTPError, OSError) as e:
+                error = f"{type(e).__name__}: {e}"
+            delay = delay or backoff.next_delay()
+            self.stats["failed_attempts"] += 1
+            self.stats["last_error"] = error
+            logging.warning(f"Webhook {target_id} 投递失败 ({error})，{delay:.1f} 秒后重试...")
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "queued": self._queue.qsize(), "spill_bytes": self._spill.size - self._spill.offset}
+
+
+class WebhookManager:
+    """
+    Webhook 目标持久化在 root_dir/<target_id>/ 下: target.json 保存会话、地址与认证信息，
+    spill.bin / spill.offset 为溢出队列。所有目标共用一个带连接池的 HTTP 客户端。
+    多个 worker 进程共享 root_dir 时，每个目标由持有其文件锁的进程投递，其余进程定期重试接管。
+    投递前地址被判定为内网地址的目标会被停用 (disabled 记录原因)，并从 target.json 中清除认证信息与签名密钥。
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        subscribe: SubscribeChat,
+        client_factory: Callable[[], httpx.AsyncClient],
+        batch_size: int,
+        flush_ms: int,
+        queue_size: int,
+        spill_max_bytes: int,
+        backoff_base: float,
+        backoff_max: float,
+        rescan_interval: float,
+        allowed_hosts: Sequence[str] = (),
+    ):
+        self._root_dir = root_dir
+        self.subscribe = subscribe
+        self._client_factory = client_factory
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.queue_size = queue_size
+        self.spill_max_bytes = spill_max_bytes
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._rescan_interval = rescan_interval
+        self._allowed_hosts = tuple(host.rstrip(".").lower() for host in allowed_hosts)
+        self.client: Optional[httpx.AsyncClient] = None
+        self._runners: Dict[str, _TargetRunner] = {}
+        self._supervisor: Optional[asyncio.Task] = None
+
+    def new_backoff(self) -> Backoff:
+        return Backoff(self._backoff_base, self._backoff_max)
+
+    async def check_url(self, url: str):
+        await check_webhook_url(url, self._allowed_hosts)
+
+    def http_client(self) -> httpx.AsyncClient:
+        """投递用的 HTTP 客户端在首次投递时才创建，没有 Webhook 目标的部署不承担其启动开销。"""
+        if self.client is None:
+            self.client = self._client_factory()
+        return self.client
+
+    # --- 持久化 ---
+
+    def target_dir(self, target_id: str) -> str:
+        return os.path.join(self._root_dir, target_id)
+
+    def _meta_path(self, target_id: str) -> str:
+        return os.path.join(self.target_dir(target_id), "target.json")
+
+    def _save(self, target: Dict[str, Any]):
+        path = self._meta_path(target["target_id"])
+        tmp_path = path + ".tmp"
+        # target.json 中包含认证信息与签名密钥，仅允许属主读写
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(target, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _load(self, target_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(target_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            return None
+
+    def get(self, target_id: str) -> Optional[Dict[str, Any]]:
+        if not target_id or os.path.basename(target_id) != target_id:
+            return None
+        return self._load(target_id)
+
+    def list_targets(self) -> List[Dict[str, Any]]:
+        targets = (self._load(target_id) for target_id in sorted(os.listdir(self._root_dir)))
+        return [target for target in targets if target is not None]
+
+    def public_view(self, target: Dict[str, Any]) -> Dict[str, Any]:
+        view = {key: value for key, value in target.items() if key not in _PRIVATE_FIELDS}
+        view["signed"] = bool(target.get("secret"))
+        runner = self._runners.get(target["target_id"])
+        # 由其他 worker 进程投递的目标在本进程中没有运行统计
+        view["delivery"] = runner.snapshot() if runner is not None else None
+        return view
+
+    # --- 生命周期 ---
+
+    def start(self):
+        os.makedirs(self._root_dir, exist_ok=True)
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+        for target_id in list(self._runners):
+            await self._stop_runner(target_id)
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def create(
+        self,
+        credentials: Dict[str, Any],
+        chat_id: str,
+        url: str,
+        secret: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        flush_ms: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """地址不允许投递或无法解析时抛出 WebhookURLError。"""
+        try:
+            await self.check_url(url)
+        except OSError as e:
+            raise WebhookURLError(f"无法解析 Webhook 地址 {url}: {e}")
+        target = {
+            "target_id": uuid.uuid4().hex,
+            "chat_id": chat_id,
+            "url": url,
+            "batch_size": batch_size,
+            "flush_ms": flush_ms,
+            "created_at": time.time(),
+            "secret": secret,
+            "credentials": credentials,
+        }
+        os.makedirs(self.target_dir(target["target_id"]), exist_ok=True)
+        await asyncio.to_thread(self._save, target)
+        self._try_start(target)
+        logging.info(f"已注册 Webhook {target['target_id']}, Chat ID: {chat_id}")
+        return target
+
+    async def delete(self, target_id: str) -> bool:
+        if self.get(target_id) is None:
+            return False
+        await self._stop_runner(target_id)
+        await asyncio.to_thread(self._remove, target_id)
+        logging.info(f"已删除 Webhook {target_id}")
+        return True
+
+    def _remove(self, target_id: str):
+        # 先删除保存认证信息的 target.json: 即使目录中其他文件删除失败，也不会留下 Cookie
+        try:
+            os.remove(self._meta_path(target_id))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(self.target_dir(target_id), ignore_errors=True)
+
+    def disable(self, target_id: str, reason: str):
+        """停用目标: 保留地址与统计以便排查，清除认证信息与签名密钥。"""
+        target = self._load(target_id)
+        if target is None:
+            return
+        for field in _PRIVATE_FIELDS:
+            target.pop(field, None)
+        target["disabled"] = reason
+        self._save(target)
+
+    def _claim(self, target_id: str) -> Optional[int]:
+        fd = os.open(os.path.join(self.target_dir(target_id), "lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        if fcntl is None:
+            return fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _try_start(self, target: Dict[str, Any]):
+        target_id = target["target_id"]
+        if target_id in self._runners or target.get("disabled"):
+            return
+        lock_fd = self._claim(target_id)
+        if lock_fd is None:
+            return
+        runner = _TargetRunner(self, target, lock_fd)
+        self._runners[target_id] = runner
+        runner.start()
+
+    async def _stop_runner(self, target_id: str):
+        runner = self._runners.pop(target_id, None)
+        if runner is None:
+            return
+        if runner.task is not None:
+            runner.task.cancel()
+            await asyncio.gather(runner.task, return_exceptions=True)
+        os.close(runner.lock_fd)
+
+    async def _supervise(self):
+        """定期扫描目标目录: 启动新注册或无人投递的目标，停止已被删除的目标，重启意外退出的投递协程。"""
+        while True:
+            try:
+                targets = {target["target_id"]: target for target in await asyncio.to_thread(self.list_targets)}
+                for target_id, runner in list(self._runners.items()):
+                    if target_id not in targets or targets[target_id].get("disabled"):
+                        await self._stop_runner(target_id)
+                    elif runner.task is not None and runner.task.done():
+                        if not runner.task.cancelled() and runner.task.exception() is not None:
+                            logging.error(f"Webhook {target_id} 投递协程异常退出: {runner.task.exception()}，正在重启。")
+                        await self._stop_runner(target_id)
+                for target in targets.values():
+                    self._try_start(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Webhook 目标扫描失败: {e}")
+            await asyncio.sleep(self._rescan_interval)
+
+    def stats(self) -> Dict[str, int]:
+        snapshots = [runner.snapshot() for runner in self._runners.values()]
+        return {
+            "running_targets": len(snapshots),
+            "queued": sum(snapshot["queued"] for snapshot in snapshots),
+            "spill_bytes": sum(snapshot["spill_bytes"] for snapshot in snapshots),
+        }
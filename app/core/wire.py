@@ -0,0 +1,129 @@
+# core/wire.py - 按需解码上游帧: 零拷贝拆包与投影解码
+"""
+Frame → BizResponse → 业务负载是三层嵌套的 bytes 字段，完整解析时每一层都会复制一次负载，并为每条消息分配对象。
+  - decode_envelope: 直接在响应体的 memoryview 上读取 Frame / BizResponse 的少量字段，负载以切片返回，不复制
+  - HistoryPage: 分页信息用 PageInfo 投影解析，items 在首次访问时才完整解析
+  - scan_message_keys: 用 MessageKeyList 投影只解码 message_id / chat_id / create_time
+投影消息定义在 feishu_im.proto 中，与原消息共享字段号；未声明的字段不会被解码为对象。
+"""
+from typing import Iterator, NamedTuple, Optional, Sequence, Tuple, Union
+
+import feishu_im_pb2
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+# feishu_im.proto 中 Frame / BizResponse 的字段号
+FRAME_PAYLOAD = 5
+BIZ_CODE = 1
+BIZ_MESSAGE = 2
+BIZ_PAYLOAD = 15
+
+
+def _read_varint(buf: memoryview, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise ValueError("protobuf varint 过长")
+
+
+def _signed(value: int) -> int:
+    """int32/int64 的负数以 64 位补码编码。"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def iter_fields(buf: Buffer) -> Iterator[Tuple[int, int, Union[int, memoryview]]]:
+    """
+    逐个产出 (字段号, wire 类型, 值)。varint 的值为 int，其余类型的值为原缓冲区上的 memoryview 切片。
+    只适合字段很少的外层帧；重复字段很多的负载交给 upb 解析更快。
+    """
+    view = buf if isinstance(buf, memoryview) else memoryview(buf)
+    pos, end = 0, len(view)
+    while pos < end:
+        tag, pos = _read_varint(view, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == WIRE_VARINT:
+            value, pos = _read_varint(view, pos)
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            length, pos = _read_varint(view, pos)
+            if pos + length > end:
+                raise ValueError("protobuf 字段长度越界")
+            value, pos = view[pos:pos + length], pos + length
+        elif wire_type == WIRE_FIXED64:
+            value, pos = view[pos:pos + 8], pos + 8
+        elif wire_type == WIRE_FIXED32:
+            value, pos = view[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"不支持的 protobuf wire 类型: {wire_type}")
+        yield field_number, wire_type, value
+
+
+class Envelope(NamedTuple):
+    code: int
+    message: str
+    payload: memoryview
+
+
+def decode_envelope(content: Buffer) -> Envelope:
+    """解开 Frame 与 BizResponse 两层，payload 指向原始响应体中的同一段内存。"""
+    frame_payload = memoryview(b"")
+    for field_number, wire_type, value in iter_fields(content):
+        if field_number == FRAME_PAYLOAD and wire_type == WIRE_LENGTH_DELIMITED:
+            frame_payload = value
+
+    code, message, payload = 0, "", memoryview(b"")
+    for field_number, wire_type, value in iter_fields(frame_payload):
+        if field_number == BIZ_CODE and wire_type == WIRE_VARINT:
+            code = _signed(value)
+        elif field_number == BIZ_MESSAGE and wire_type == WIRE_LENGTH_DELIMITED:
+            message = str(value, "utf-8", "replace")
+        elif field_number == BIZ_PAYLOAD and wire_type == WIRE_LENGTH_DELIMITED:
+            payload = value
+    return Envelope(code, message, payload)
+
+
+def scan_message_keys(payload: Buffer) -> Sequence[feishu_im_pb2.MessageKey]:
+    """只解码 GetMessagesResponse.items 或 StreamResponse.new_messages 中每条消息的键。"""
+    return feishu_im_pb2.MessageKeyList.FromString(payload).items
+
+
+class HistoryPage:
+    """
+    GetMessagesResponse 的惰性视图，属性与生成的消息类一致 (items / has_more / next_cursor)。
+    只翻页或只需要消息键的调用方不会解码发送者与内容。
+    """
+
+    def __init__(self, payload: Buffer):
+        self._payload = payload
+        self._parsed: Optional[feishu_im_pb2.GetMessagesResponse] = None
+        info = feishu_im_pb2.PageInfo.FromString(payload)
+        self.has_more = info.has_more
+        self.next_cursor = info.next_cursor
+
+    @property
+    def items(self) -> Sequence[feishu_im_pb2.Message]:
+        return self.parse().items
+
+    @property
+    def payload(self) -> Buffer:
+        """上游原始的 GetMessagesResponse 字节 (BizResponse.payload 切片)，原样转发时无需重新编码。"""
+        return self._payload
+
+    def message_keys(self) -> Sequence[feishu_im_pb2.MessageKey]:
+        return scan_message_keys(self._payload)
+
+    def parse(self) -> feishu_im_pb2.GetMessagesResponse:
+        if self._parsed is None:
+            self._parsed = feishu_im_pb2.GetMessagesResponse.FromString(self._payload)
+        return self._parsed
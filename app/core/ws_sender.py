@@ -0,0 +1,112 @@
+# core/ws_sender.py - WebSocket 发送阶段: 微批合并、发送超时与客户端断开检测
+import asyncio
+from typing import Any, Awaitable, Callable, List, Sequence
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from core.metrics import WEBSOCKET_BATCH_SIZE, WEBSOCKET_SEND_LATENCY
+from core.subscription_hub import SlowConsumerError, Subscription
+
+
+async def next_batch(subscription: Subscription, max_batch: int, window: float) -> List[Any]:
+    """
+    等待第一条消息，再合并已经积压的消息；window > 0 时额外最多等待 window 秒凑满 max_batch 条。
+    订阅结束时返回空列表 (结束前已取出的消息仍会先返回)。
+    """
+    try:
+        batch = [await subscription.__anext__()]
+    except StopAsyncIteration:
+        return []
+    batch += subscription.drain(max_batch - 1)
+    if window > 0 and len(batch) < max_batch:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        while len(batch) < max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                # Subscription.__anext__ 只是 Queue.get，超时取消不会丢失消息
+                batch.append(await asyncio.wait_for(subscription.__anext__(), remaining))
+            except (asyncio.TimeoutError, StopAsyncIteration):
+                break
+            batch += subscription.drain(max_batch - len(batch))
+    return batch
+
+
+class WebSocketSender:
+    """
+    把消息编码为帧并发送。batch 模式下每帧是一批消息 (encode_batch)，否则每条消息一帧 (encode_one)。
+    单帧发送超过 send_timeout 秒 (客户端不读、TCP 缓冲区已满) 时按慢消费者断开，
+    而消息的积压与溢出由订阅队列按慢消费者策略处理，不会阻塞上游。
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        encode_one: Callable[[Any], Any],
+        encode_batch: Callable[[Sequence[Any]], Any],
+        binary: bool,
+        batch: bool,
+        max_batch: int,
+        window: float,
+        send_timeout: float,
+    ):
+        self._send_frame: Callable[[Any], Awaitable[None]] = websocket.send_bytes if binary else websocket.send_text
+        self._encode_one = encode_one
+        self._encode_batch = encode_batch
+        self._batch = batch
+        self._max_batch = max(1, max_batch) if batch else 1
+        self._window = window if batch else 0.0
+        self._send_timeout = send_timeout
+
+    async def _send(self, payload):
+        with WEBSOCKET_SEND_LATENCY.time():
+            try:
+                await asyncio.wait_for(self._send_frame(payload), self._send_timeout)
+            except asyncio.TimeoutError:
+                raise SlowConsumerError(f"发送超时 ({self._send_timeout} 秒)，断开慢消费者。")
+
+    async def send(self, messages: Sequence[Any]):
+        """发送一组消息，batch 模式下按 max_batch 分帧。"""
+        if not self._batch:
+            for msg in messages:
+                await self._send(self._encode_one(msg))
+            return
+        for start in range(0, len(messages), self._max_batch):
+            chunk = messages[start:start + self._max_batch]
+            WEBSOCKET_BATCH_SIZE.observe(len(chunk))
+            await self._send(self._encode_batch(chunk))
+
+    async def pump(self, subscription: Subscription, skip: Callable[[Any], bool]):
+        """持续从订阅取批并发送，直到订阅结束。skip 返回 True 的消息 (例如 已重放过的) 不发送。"""
+        while True:
+            batch = await next_batch(subscription, self._max_batch, self._window)
+            if not batch:
+                return
+            batch = [msg for msg in batch if not skip(msg)]
+            if batch:
+                await self.send(batch)
+
+
+async def _wait_disconnect(websocket: WebSocket):
+    # 客户端发来的消息不需要处理，这里只用来及时发现断开，而不是等到下一次发送失败
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+
+
+async def serve_until_disconnect(websocket: WebSocket, sender: Awaitable[None]):
+    """同时运行发送协程与断开检测，任一方结束或出错时取消另一方，并原样抛出其异常。"""
+    tasks = [asyncio.ensure_future(sender), asyncio.create_task(_wait_disconnect(websocket))]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # 用 wait 而不是 gather: 外层在清理期间被取消时，抛出的是外层自己的 CancelledError，
+        # 而不是子任务的 (后者不带取消来源，ASGI 服务器的取消作用域无法识别)
+        await asyncio.wait(tasks)
+    for task in done:
+        task.result()
@@ -1,55 +1,142 @@
 # feishu_provider.py (v9.1 - 健壮版)
-import requests
 import uuid
 import asyncio
-from fastapi import Header
-from typing import Optional, AsyncGenerator
+import hashlib
+import httpx
+from fastapi import Header, Request
+from functools import partial
+from contextlib import asynccontextmanager, aclosing
+from typing import Optional, AsyncGenerator, AsyncIterator, NamedTuple, List, Callable, Dict, Any, Union
 from urllib.parse import urlparse
 import logging
+import time
 
 from config import settings
+from core.http_client import create_async_client, build_timeout
+from core.provider_registry import ProviderRegistry
+from core.subscription_hub import SubscriptionHub
+from core.message_store import MessageStore
+from core.page_cache import PageCache
+from core.metrics import GATEWAY_LATENCY, PROTOBUF_DECODE_LATENCY, MESSAGES_STREAMED, STREAM_RECONNECTS, STREAM_DUPLICATES, STREAM_BACKFILLED, STREAM_REPLAYED, BIZ_ERRORS
+from core.dedup import StreamDeduplicator
+from core.replay import ReplayBuffer, messages_after
+from core.bus import create_bus
+from core.cluster import ClusterRelay
+from core.credentials import CredentialManager
+from core.export_engine import collect_chat_messages, iter_history_pages
+from core.wire import Buffer, Envelope, HistoryPage, decode_envelope, scan_message_keys
+from core.completions import CompletionRequest, build_completion, stream_completion
+from providers.base import BaseProvider
+from core.rate_limit import upstream_guard, new_backoff, retry_after_seconds, CircuitOpenError, AUTH_FAILURE_CODES, RETRYABLE_HTTP_STATUS
 try:
     import feishu_im_pb2
 except ImportError:
     logging.critical("致命错误: 无法导入 feishu_im_pb2.py。请确保 Dockerfile 正确生成了此文件。")
     exit(1)
 
-class FeishuProvider:
-    def __init__(self, cookie: str, history_cmd: str, stream_cmd: str, user_agent: str, referer: str, web_version: str, csrf_token: Optional[str] = None, lgw_csrf_token: Optional[str] = None):
+class FeishuCredentials(NamedTuple):
+    cookie: str
+    history_cmd: str
+    stream_cmd: str
+    user_agent: str
+    referer: str
+    web_version: str
+    csrf_token: Optional[str] = None
+    lgw_csrf_token: Optional[str] = None
+    # 服务端托管的认证信息 (FEISHU_AUTH_JSON / FEISHU_AUTH_FILE / 管理接口)，热更新时沿用同一个键
+    managed: bool = False
+
+    @property
+    def key(self) -> str:
+        """
+        认证信息的哈希，用作 Provider 复用池、订阅与缓存的键，避免在内存中以明文作为键。
+        托管认证信息使用固定的键，切换 Cookie 后仍对应同一个 Provider 与上游长轮询。
+        """
+        if self.managed:
+            return MANAGED_CREDENTIALS_KEY
+        raw = "\x1f".join(value or "" for value in self[:-1])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def validate(self):
+        if not all([self.cookie, self.user_agent, self.referer, self.history_cmd, self.web_version]):
+            raise ValueError("认证信息不完整，缺少 cookie, user_agent, referer, history_cmd 或 web_version 之一。")
+
+MANAGED_CREDENTIALS_KEY = "managed"
+
+# 实时流的预过滤条件: 只根据消息键 (message_id / chat_id / create_time) 决定是否需要完整解码
+MessageFilter = Callable[[feishu_im_pb2.MessageKey], bool]
+
+class FeishuProvider(BaseProvider):
+    def __init__(self, cookie: str, history_cmd: str, stream_cmd: str, user_agent: str, referer: str, web_version: str, csrf_token: Optional[str] = None, lgw_csrf_token: Optional[str] = None, managed: bool = False):
         logging.info("FeishuProvider 正在初始化...")
         
         # 核心验证：history_cmd 是必须的
-        if not all([cookie, user_agent, referer, history_cmd, web_version]):
-            raise ValueError("认证信息不完整，缺少 cookie, user_agent, referer, history_cmd 或 web_version 之一。")
+        credentials = FeishuCredentials(cookie, history_cmd, stream_cmd, user_agent, referer, web_version, csrf_token, lgw_csrf_token, managed)
+        credentials.validate()
         
-        self.base_url = "https://internal-api-lark-api.feishu.cn"
-        self.history_command_id = history_cmd
+        self.base_url = settings.FEISHU_BASE_URL
+        self.client = create_async_client({})
+        # 跟随托管认证信息时的来源与当前已应用的版本
+        self._credential_source: Optional[CredentialManager] = None
+        self._credential_version = 0
+        self.apply_credentials(credentials)
+        
+        logging.info(f"FeishuProvider 初始化成功。History Cmd: {self.history_command_id}, Stream Cmd: {self.stream_command_id}")
+
+    def apply_credentials(self, credentials: FeishuCredentials):
+        """
+        切换到一组已校验的认证信息: 只替换请求头与 Command ID，连接池、缓存键和订阅都保持不变。
+        已发出的请求仍使用旧请求头，之后的请求使用新请求头。
+        """
+        self.credentials = credentials
+        self.credential_key = credentials.key
+        # 限流与熔断按 cookie 维度共享，同一个 cookie 换 UA 等也不会绕过配额
+        self.cookie_key = hashlib.sha256(credentials.cookie.encode("utf-8")).hexdigest()[:16]
+        self.history_command_id = credentials.history_cmd
         
         # 核心修正：如果 stream_cmd 不存在或与 history_cmd 相同，发出警告，但程序继续
-        if not stream_cmd or stream_cmd == history_cmd:
-            logging.warning(f"警告: 未提供有效的实时消息 Command ID (stream_cmd)，或其与历史消息ID相同 ({history_cmd})。实时消息功能可能无法正常工作。")
-            self.stream_command_id = history_cmd # 使用历史ID作为备用
+        if not credentials.stream_cmd or credentials.stream_cmd == credentials.history_cmd:
+            logging.warning(f"警告: 未提供有效的实时消息 Command ID (stream_cmd)，或其与历史消息ID相同 ({credentials.history_cmd})。实时消息功能可能无法正常工作。")
+            self.stream_command_id = credentials.history_cmd # 使用历史ID作为备用
         else:
-            self.stream_command_id = stream_cmd
+            self.stream_command_id = credentials.stream_cmd
 
-        parsed_uri = urlparse(referer)
+        parsed_uri = urlparse(credentials.referer)
         origin = f"{parsed_uri.scheme}://{parsed_uri.netloc}"
 
-        self.session = requests.Session()
-        self.session.headers.update({
-            "User-Agent": user_agent,
+        headers = {
+            "User-Agent": credentials.user_agent,
             "Content-Type": "application/x-protobuf",
             "Accept": "*/*",
-            "Cookie": cookie,
-            "Referer": referer,
+            "Cookie": credentials.cookie,
+            "Referer": credentials.referer,
             "Origin": origin,
-            "x-web-version": web_version,
+            "x-web-version": credentials.web_version,
             "x-source": "web",
-        })
-        if csrf_token: self.session.headers["x-csrf-token"] = csrf_token
-        if lgw_csrf_token: self.session.headers["x-lgw-csrf-token"] = lgw_csrf_token
-        
-        logging.info(f"FeishuProvider 初始化成功。History Cmd: {self.history_command_id}, Stream Cmd: {self.stream_command_id}")
+        }
+        if credentials.csrf_token: headers["x-csrf-token"] = credentials.csrf_token
+        if credentials.lgw_csrf_token: headers["x-lgw-csrf-token"] = credentials.lgw_csrf_token
+        self.client.headers = headers
+
+    def follow(self, source: CredentialManager):
+        """跟随托管认证信息: 每次向上游发请求前检查版本，有新版本时就地切换请求头。"""
+        self._credential_source = source
+        self._credential_version = source.version
+
+    def _refresh_credentials(self):
+        source = self._credential_source
+        if source is not None and source.version != self._credential_version and source.current is not None:
+            self._credential_version = source.version
+            self.apply_credentials(source.current)
+            logging.info(f"Provider 已切换到托管认证信息版本 {source.version}。")
+
+    async def _wait_for_new_credentials(self) -> bool:
+        """托管认证信息失效时不结束长轮询，等待更新后用新请求头继续，订阅者无需重连。其他认证信息返回 False。"""
+        if self._credential_source is None:
+            return False
+        logging.error("托管认证信息已失效，实时消息流暂停，等待通过认证文件或管理接口更新...")
+        await self._credential_source.wait_for_update(self._credential_version)
+        return True
 
     def _build_request_frame(self, biz_payload: bytes, request_id: str, command_id: str) -> bytes:
         biz_request = feishu_im_pb2.BizRequest(payload=biz_payload)
@@ -62,11 +149,66 @@ class FeishuProvider:
         )
         return frame.SerializeToString()
 
+    async def _post_gateway(self, command_id: str, kind: str, request_id: str, request_data: bytes, read_timeout: Optional[float] = None) -> bytes:
+        """向网关发送一个请求帧并返回原始响应体。所有上游请求都经过这里，并受进程级限流与熔断约束。"""
+        await upstream_guard.acquire(self.cookie_key, command_id, kind)
+        headers = {"x-command": command_id, "x-request-id": request_id}
+        with GATEWAY_LATENCY.labels(command_id).time():
+            response = await self.client.post(
+                f"{self.base_url}/im/gateway/",
+                headers=headers,
+                content=request_data,
+                timeout=build_timeout(read_timeout),
+            )
+        if response.is_error:
+            upstream_guard.record_status(self.cookie_key, response.status_code)
+        response.raise_for_status()
+        return response.content
+
+    def _decode_biz_response(self, command_id: str, content: bytes) -> Envelope:
+        """只解开 Frame / BizResponse 两层，业务负载是响应体上的 memoryview，不复制。"""
+        with PROTOBUF_DECODE_LATENCY.labels("envelope").time():
+            envelope = decode_envelope(content)
+        upstream_guard.record_status(self.cookie_key, envelope.code)
+        if envelope.code != 0:
+            BIZ_ERRORS.labels(command_id, str(envelope.code)).inc()
+        return envelope
+
+    async def aclose(self):
+        """关闭底层连接池。"""
+        await self.client.aclose()
+
     async def get_history_messages(self, chat_id: str, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+        """经过分页缓存获取一页历史消息。返回的对象可能被其他请求共享，调用方不得修改。"""
+        page = await self.get_history_page(chat_id, count, cursor)
+        with PROTOBUF_DECODE_LATENCY.labels("history").time():
+            return page.parse()
+
+    async def get_history_page(self, chat_id: str, count: int, cursor: str) -> HistoryPage:
+        """
+        经过分页缓存获取一页历史消息的惰性视图。缓存的是视图本身: 解析结果在首次 parse 后复用，
+        上游原始字节 (payload) 也一直保留，可以原样转发。
+        """
         if not chat_id:
             raise ValueError("Chat ID 不能为空。")
 
-        url = f"{self.base_url}/im/gateway/"
+        return await history_page_cache.get_or_load(
+            (self.credential_key, chat_id, count, cursor),
+            lambda: self._load_history_page(chat_id, count, cursor),
+            is_head=cursor == "0",
+        )
+
+    async def _load_history_page(self, chat_id: str, count: int, cursor: str) -> HistoryPage:
+        page = await self.fetch_history_page(chat_id, count, cursor)
+        logging.info(f"成功获取历史消息分页 ({len(page.payload)} 字节)。")
+        return page
+
+    async def fetch_history_page(self, chat_id: str, count: int, cursor: str) -> HistoryPage:
+        """
+        不经过缓存直接请求一页历史消息，返回惰性视图: 分页信息与消息键可以单独读取，
+        只有访问 items 时才完整解码。
+        """
+        self._refresh_credentials()
         request_id = str(uuid.uuid4())
         
         get_messages_payload = feishu_im_pb2.GetMessagesRequest(
@@ -76,108 +218,445 @@ class FeishuProvider:
         
         request_data = self._build_request_frame(get_messages_payload, request_id, self.history_command_id)
         
-        headers = self.session.headers.copy()
-        headers["x-command"] = self.history_command_id
-        headers["x-request-id"] = request_id
-        
-        logging.info(f"准备请求历史消息, Chat ID: {chat_id}, Command: {headers['x-command']}")
+        logging.info(f"准备请求历史消息, Chat ID: {chat_id}, Command: {self.history_command_id}")
 
         try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: self.session.post(url, headers=headers, data=request_data, timeout=15)
-            )
-            response.raise_for_status()
+            content = await self._post_history_with_retry(request_id, request_data)
+            envelope = self._decode_biz_response(self.history_command_id, content)
 
-            frame_response = feishu_im_pb2.Frame()
-            frame_response.ParseFromString(response.content)
+            if envelope.code != 0:
+                raise Exception(f"飞书 API 错误: Code={envelope.code}, Message='{envelope.message}'")
 
-            biz_response = feishu_im_pb2.BizResponse()
-            biz_response.ParseFromString(frame_response.payload)
-
-            if biz_response.code != 0:
-                raise Exception(f"飞书 API 错误: Code={biz_response.code}, Message='{biz_response.message}'")
-
-            response_pb = feishu_im_pb2.GetMessagesResponse()
-            response_pb.ParseFromString(biz_response.payload)
-            logging.info(f"成功获取 {len(response_pb.items)} 条历史消息。")
-            return response_pb
+            return HistoryPage(envelope.payload)
         except Exception as e:
             logging.error(f"获取历史消息时发生错误: {e}")
             raise
 
-    async def stream_latest_messages(self, chat_id: str) -> AsyncGenerator[feishu_im_pb2.Message, None]:
+    async def _post_history_with_retry(self, request_id: str, request_data: bytes) -> bytes:
+        """历史请求遇到 429/5xx 或网络错误时按指数退避重试，优先遵循 Retry-After。"""
+        backoff = new_backoff()
+        retries = settings.UPSTREAM_HISTORY_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                return await self._post_gateway(self.history_command_id, "history", request_id, request_data)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRYABLE_HTTP_STATUS or attempt == retries:
+                    raise
+                delay = retry_after_seconds(e.response.headers)
+                if delay is None:
+                    delay = backoff.next_delay()
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+                delay = backoff.next_delay()
+            logging.warning(f"历史消息请求失败，{delay:.1f} 秒后进行第 {attempt + 1} 次重试...")
+            await asyncio.sleep(delay)
+
+    def _decode_stream_payload(self, payload: memoryview, accept: Optional[MessageFilter]) -> List[feishu_im_pb2.Message]:
+        """
+        解码一批实时消息并按时间排序。提供 accept(MessageKey) 时先只解码消息键，
+        整批都不需要时跳过完整解码。
+        """
+        with PROTOBUF_DECODE_LATENCY.labels("stream").time():
+            if accept is None:
+                messages = list(feishu_im_pb2.StreamResponse.FromString(payload).new_messages)
+            else:
+                wanted = [index for index, key in enumerate(scan_message_keys(payload)) if accept(key)]
+                if not wanted:
+                    return []
+                new_messages = feishu_im_pb2.StreamResponse.FromString(payload).new_messages
+                messages = [new_messages[index] for index in wanted]
+        return sorted(messages, key=lambda msg: msg.create_time)
+
+    async def stream_all_messages(
+        self,
+        accept: Optional[MessageFilter] = None,
+        on_resync: Optional[Callable[[], AsyncIterator[feishu_im_pb2.Message]]] = None,
+    ) -> AsyncGenerator[feishu_im_pb2.Message, None]:
+        """
+        单个长轮询循环，产出当前账号收到的所有新消息 (不区分会话)。
+        每条 Message 自带 chat_id，由调用方按会话路由；accept 可以提前丢弃不需要的消息。
+        长轮询出错重连后，先产出 on_resync() 补齐的消息，再继续接收实时消息。
+        """
         if self.stream_command_id == self.history_command_id:
             logging.error("实时消息 Command ID 与历史消息 ID 相同，无法建立有效的实时监听。请使用新版脚本重新获取认证信息。")
             # 直接返回，不再尝试连接，避免无效循环
             return
 
-        if not chat_id:
-            raise ValueError("Chat ID 不能为空。")
-
-        url = f"{self.base_url}/im/gateway/"
-        
-        logging.info(f"正在为 Chat ID: {chat_id} 追赶最新消息...")
-        latest_timestamp = 0
-        try:
-            initial_response = await self.get_history_messages(chat_id, 1, "0")
-            if initial_response.items:
-                latest_timestamp = initial_response.items[0].create_time
-                logging.info(f"追赶同步完成，最新消息时间戳: {latest_timestamp}")
-        except Exception as e:
-            logging.warning(f"追赶机制执行失败: {e}。将从当前时间开始接收。")
-
-        logging.info(f"开始监听 Chat ID: {chat_id} 的实时消息 (Command: {self.stream_command_id})")
-        
-        empty_biz_payload = feishu_im_pb2.BizRequest().SerializeToString()
+        logging.info(f"开始监听实时消息 (Command: {self.stream_command_id})")
         
+        backoff = new_backoff()
+        needs_resync = False
         while True:
             try:
-                request_id = str(uuid.uuid4())
-                headers = self.session.headers.copy()
-                headers["x-command"] = self.stream_command_id
-                headers["x-request-id"] = request_id
+                if needs_resync and on_resync is not None:
+                    async for msg in on_resync():
+                        yield msg
+                needs_resync = False
 
+                self._refresh_credentials()
+                request_id = str(uuid.uuid4())
                 request_data = self._build_request_frame(b'', request_id, self.stream_command_id)
 
-                with self.session.post(url, headers=headers, data=request_data, timeout=60, stream=True) as response:
-                    response.raise_for_status()
-                    if response.content:
-                        frame_response = feishu_im_pb2.Frame()
-                        frame_response.ParseFromString(response.content)
-                        
-                        biz_response = feishu_im_pb2.BizResponse()
-                        biz_response.ParseFromString(frame_response.payload)
-                        
-                        if biz_response.code != 0:
-                            logging.warning(f"实时消息流收到非零状态码: Code={biz_response.code}, Message='{biz_response.message}'")
-                            if biz_response.code in [401, 403]: 
-                                logging.error("认证失败，中断连接。请更新认证信息。")
-                                break
-                            continue
-
-                        if biz_response.payload:
-                            stream_response_pb = feishu_im_pb2.StreamResponse()
-                            stream_response_pb.ParseFromString(biz_response.payload)
-                            
-                            if stream_response_pb.new_messages:
-                                new_messages = sorted(stream_response_pb.new_messages, key=lambda msg: msg.create_time)
-                                for msg in new_messages:
-                                    if msg.create_time > latest_timestamp:
-                                        logging.info(f"收到新消息: {msg.message_id}")
-                                        yield msg
-                                        latest_timestamp = msg.create_time
-            except requests.exceptions.Timeout:
+                content = await self._post_gateway(self.stream_command_id, "stream", request_id, request_data, settings.HTTP_STREAM_READ_TIMEOUT)
+                if content:
+                    envelope = self._decode_biz_response(self.stream_command_id, content)
+                    
+                    if envelope.code != 0:
+                        logging.warning(f"实时消息流收到非零状态码: Code={envelope.code}, Message='{envelope.message}'")
+                        if envelope.code in AUTH_FAILURE_CODES: 
+                            if await self._wait_for_new_credentials():
+                                needs_resync = True
+                                continue
+                            logging.error("认证失败，中断连接。请更新认证信息。")
+                            break
+                        delay = backoff.next_delay()
+                        STREAM_RECONNECTS.labels("biz_error").inc()
+                        logging.warning(f"实时消息流 {delay:.1f} 秒后重试...")
+                        needs_resync = True
+                        await asyncio.sleep(delay)
+                        continue
+
+                    backoff.reset()
+                    if envelope.payload:
+                        for msg in self._decode_stream_payload(envelope.payload, accept):
+                            yield msg
+                else:
+                    backoff.reset()
+            except httpx.ReadTimeout:
+                # 长轮询在超时时间内没有新消息，属于正常情况
+                backoff.reset()
                 continue
-            except requests.exceptions.RequestException as e:
-                logging.error(f"实时消息流网络连接中断: {e}。5秒后重试...")
-                await asyncio.sleep(5)
+            except CircuitOpenError as e:
+                if await self._wait_for_new_credentials():
+                    needs_resync = True
+                    continue
+                logging.error(f"实时消息流已停止: {e}")
+                break
+            except httpx.HTTPStatusError as e:
+                delay = retry_after_seconds(e.response.headers) or backoff.next_delay()
+                STREAM_RECONNECTS.labels("http_status").inc()
+                needs_resync = True
+                logging.error(f"实时消息流收到 HTTP {e.response.status_code}。{delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
+            except httpx.HTTPError as e:
+                delay = backoff.next_delay()
+                STREAM_RECONNECTS.labels("network").inc()
+                needs_resync = True
+                logging.error(f"实时消息流网络连接中断: {e}。{delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
             except Exception as e:
-                logging.error(f"实时消息流处理异常: {e}。5秒后重试...")
-                await asyncio.sleep(5)
+                delay = backoff.next_delay()
+                STREAM_RECONNECTS.labels("error").inc()
+                needs_resync = True
+                logging.error(f"实时消息流处理异常: {e}。{delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
+
+    async def chat_completion(self, request_data: Dict[str, Any], original_request: Request) -> Union[Dict[str, Any], AsyncGenerator[bytes, None]]:
+        """
+        OpenAI 兼容接口: 非流式返回最近历史消息组成的回复，流式把会话的实时消息逐条作为 SSE chunk 推送。
+        请求体不合法时抛出 ValueError。
+        """
+        request = CompletionRequest(
+            request_data,
+            default_chat_id=settings.DEFAULT_CHAT_ID,
+            history_count=settings.COMPLETION_HISTORY_COUNT,
+            stream_timeout=settings.COMPLETION_STREAM_TIMEOUT,
+        )
+        if not request.stream:
+            count = min(request.max_messages, settings.EXPORT_MAX_MESSAGES)
+            messages = await collect_chat_messages(partial(fetch_history, self), request.chat_id, count)
+            return build_completion(request, messages)
+
+        async def chunks():
+            # 与 WebSocket 订阅共享同一上游长轮询
+            async with subscribe_chat_streams(self.credentials, [request.chat_id]) as subscription:
+                async for chunk in stream_completion(request, subscription, settings.COMPLETION_KEEPALIVE):
+                    yield chunk
+        return chunks()
+
+    async def stream_latest_messages(self, chat_id: str) -> AsyncGenerator[feishu_im_pb2.Message, None]:
+        if not chat_id:
+            raise ValueError("Chat ID 不能为空。")
+
+        dedup = StreamDeduplicator(settings.STREAM_DEDUP_CAPACITY)
+        await catch_up_chats(self, dedup, [chat_id])
+
+        def accept(key: feishu_im_pb2.MessageKey) -> bool:
+            return key.chat_id == chat_id and dedup.is_new(key.chat_id, key.message_id, key.create_time)
+
+        async for msg in self.stream_all_messages(accept, lambda: backfill_chats(self, dedup, [chat_id])):
+            if not dedup.is_new(msg.chat_id, msg.message_id, msg.create_time):
+                continue
+            dedup.record(msg)
+            logging.info(f"收到新消息: {msg.message_id}")
+            yield msg
+
+async def catch_up_chats(provider: FeishuProvider, dedup: StreamDeduplicator, chat_ids: List[str]):
+    """用每个会话最新一页历史消息初始化去重状态。失败的会话从空状态开始接收。"""
+    async def seed(chat_id: str):
+        try:
+            await dedup.seed(provider.fetch_history_page, chat_id, settings.STREAM_CATCH_UP_COUNT)
+        except Exception as e:
+            logging.warning(f"追赶机制执行失败 (Chat ID: {chat_id}): {e}。将从当前时间开始接收。")
+    await asyncio.gather(*(seed(chat_id) for chat_id in chat_ids))
+
+async def backfill_chats(provider: FeishuProvider, dedup: StreamDeduplicator, chat_ids: List[str]) -> AsyncGenerator[feishu_im_pb2.Message, None]:
+    """长轮询重连后，通过分页历史补齐各会话在断线期间漏掉的消息。"""
+    for chat_id in chat_ids:
+        missed, _ = await dedup.backfill(provider.fetch_history_page, chat_id, settings.STREAM_BACKFILL_MAX, settings.STREAM_BACKFILL_LOOKBACK_MS)
+        if missed:
+            logging.info(f"重连后为 Chat ID: {chat_id} 补齐 {len(missed)} 条消息。")
+            STREAM_BACKFILLED.inc(len(missed))
+        for msg in missed:
+            yield msg
+
+history_page_cache = PageCache(
+    max_entries=settings.HISTORY_CACHE_SIZE,
+    head_ttl=settings.HISTORY_CACHE_HEAD_TTL,
+    page_ttl=settings.HISTORY_CACHE_PAGE_TTL,
+)
+
+def credentials_from_auth(data: Dict[str, Any]) -> FeishuCredentials:
+    """把 FEISHU_AUTH_JSON 格式的认证信息解析为托管认证信息并校验。每个版本只在切换时执行一次。"""
+    credentials = FeishuCredentials(
+        cookie=data.get("cookie", ""),
+        history_cmd=data.get("cmd_history", ""),
+        stream_cmd=data.get("cmd_stream", ""),
+        user_agent=data.get("user_agent") or settings.DEFAULT_USER_AGENT,
+        referer=data.get("referer") or settings.DEFAULT_REFERER,
+        web_version=data.get("web_version", ""),
+        csrf_token=data.get("csrf_token") or None,
+        lgw_csrf_token=data.get("lgw_csrf_token") or None,
+        managed=True,
+    )
+    credentials.validate()
+    return credentials
+
+credential_manager = CredentialManager(
+    build=credentials_from_auth,
+    path=settings.FEISHU_AUTH_FILE,
+    poll_interval=settings.FEISHU_AUTH_POLL_INTERVAL,
+)
+credential_manager.load(settings._auth_data)
+
+# 未配置有效托管认证信息时的占位，创建 Provider 时会因认证信息不完整而报错
+_UNCONFIGURED_CREDENTIALS = FeishuCredentials("", "", "", settings.DEFAULT_USER_AGENT, settings.DEFAULT_REFERER, "", managed=True)
+
+def resolve_credentials(**overrides: Optional[str]) -> FeishuCredentials:
+    """
+    请求未覆盖任何认证字段时直接返回托管认证信息 (已校验，随热更新切换)，不做任何解析；
+    覆盖的字段与托管认证信息完全一致时同样视为托管，共享同一个 Provider 与上游长轮询。
+    """
+    base = credential_manager.current or _UNCONFIGURED_CREDENTIALS
+    overrides = {name: value for name, value in overrides.items() if value}
+    if all(getattr(base, name) == value for name, value in overrides.items()):
+        return base
+    return base._replace(managed=False, **overrides)
+
+def _create_provider(credentials: FeishuCredentials) -> FeishuProvider:
+    provider = FeishuProvider(**credentials._asdict())
+    if credentials.managed:
+        provider.follow(credential_manager)
+    return provider
+
+provider_registry = ProviderRegistry(
+    factory=_create_provider,
+    max_size=settings.PROVIDER_POOL_SIZE,
+    idle_ttl=settings.PROVIDER_IDLE_TTL,
+)
+
+def lease_provider(credentials: FeishuCredentials):
+    """
+    从复用池中借出 Provider，退出上下文时归还 (不关闭连接池)。
+    托管认证信息总是使用当前版本 (后台任务中保存的可能是切换前的旧版本)。
+    """
+    if credentials.managed and credential_manager.current is not None:
+        credentials = credential_manager.current
+    return provider_registry.lease(credentials.key, credentials)
+
+message_store = MessageStore(
+    path=settings.MESSAGE_STORE_PATH,
+    head_ttl=settings.MESSAGE_STORE_HEAD_TTL,
+    live_grace=settings.MESSAGE_STORE_LIVE_GRACE,
+    live_max_age=settings.MESSAGE_STORE_LIVE_MAX_AGE,
+) if settings.MESSAGE_STORE_ENABLED else None
+
+async def fetch_history(provider: FeishuProvider, chat_id: str, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+    """历史消息统一入口: 启用本地存储时优先读本地，只向上游补齐缺失部分。"""
+    if message_store is None:
+        return await provider.get_history_messages(chat_id, count, cursor)
+    return await message_store.get_history(provider, chat_id, count, cursor)
+
+async def fetch_history_protobuf(provider: FeishuProvider, chat_id: str, count: int, cursor: str) -> Buffer:
+    """
+    protobuf 形式的一页历史消息。未启用本地存储时，页面直接来自上游 (或分页缓存中的上游页面)，
+    原样返回上游的 BizResponse.payload，不解析也不重新编码；由本地存储拼出的页面才需要序列化。
+    """
+    if message_store is None:
+        return (await provider.get_history_page(chat_id, count, cursor)).payload
+    return (await message_store.get_history(provider, chat_id, count, cursor)).SerializeToString()
+
+@asynccontextmanager
+async def open_history_fetcher(credentials: dict):
+    """供后台任务使用: 按序列化的认证信息借出 Provider，并返回分页读取函数。"""
+    async with lease_provider(FeishuCredentials(**credentials)) as provider:
+        yield partial(fetch_history, provider)
+
+replay_buffer = ReplayBuffer(
+    per_chat_capacity=settings.REPLAY_BUFFER_SIZE,
+    max_chats=settings.REPLAY_BUFFER_CHATS,
+)
+
+subscription_hub = SubscriptionHub(
+    queue_size=settings.WS_QUEUE_SIZE,
+    slow_consumer_policy=settings.WS_SLOW_CONSUMER_POLICY,
+)
+
+def _multiplexed_source(credentials: FeishuCredentials):
+    """
+    一组认证信息对应一个长轮询，按 Message.chat_id 只放行当前有订阅者的会话。
+    topics 是 Hub 维护的实时会话集合，订阅者增减时会同步变化。
+    """
+    async def source(topics):
+        async with lease_provider(credentials) as provider:
+            dedup = StreamDeduplicator(settings.STREAM_DEDUP_CAPACITY)
+            initial_chats = list(topics)
+            # 之前订阅过的会话从重放缓冲区末尾继续，只需补齐上游中断期间的消息
+            resumed = replay_buffer.restore(credentials.key, initial_chats, dedup)
+            fresh = [chat_id for chat_id in initial_chats if chat_id not in resumed]
+            await catch_up_chats(provider, dedup, fresh)
+            for chat_id in fresh:
+                replay_buffer.reset(credentials.key, chat_id, dedup.chat(chat_id).last_time)
+            buffered = set(initial_chats)
+
+            def accept(key: feishu_im_pb2.MessageKey) -> bool:
+                return key.chat_id in topics and dedup.is_new(key.chat_id, key.message_id, key.create_time)
+
+            def resync():
+                dedup.retain(topics)
+                return backfill_chats(provider, dedup, list(topics))
+
+            def deliver(msg: feishu_im_pb2.Message) -> bool:
+                if msg.chat_id not in topics:
+                    return False
+                if not dedup.is_new(msg.chat_id, msg.message_id, msg.create_time):
+                    STREAM_DUPLICATES.inc()
+                    return False
+                dedup.record(msg)
+                if msg.chat_id not in buffered:
+                    # 运行中新加入的会话: 从这条消息开始记录
+                    replay_buffer.reset(credentials.key, msg.chat_id, msg.create_time - 1)
+                    buffered.add(msg.chat_id)
+                replay_buffer.append(credentials.key, msg)
+                logging.info(f"收到新消息: {msg.message_id} (Chat ID: {msg.chat_id})")
+                if message_store is not None:
+                    message_store.submit_live_messages([msg])
+                MESSAGES_STREAMED.inc()
+                return True
+
+            for chat_id in resumed:
+                try:
+                    missed, complete = await dedup.backfill(provider.fetch_history_page, chat_id, settings.STREAM_BACKFILL_MAX, settings.STREAM_BACKFILL_LOOKBACK_MS)
+                except Exception as e:
+                    logging.warning(f"补齐 Chat ID: {chat_id} 的消息失败: {e}。重放缓冲区将从当前时间重新记录。")
+                    replay_buffer.reset(credentials.key, chat_id, int(time.time() * 1000))
+                    continue
+                if not complete and missed:
+                    # 间隙超过补齐上限，缓冲区不再连续
+                    replay_buffer.reset(credentials.key, chat_id, missed[0].create_time)
+                STREAM_BACKFILLED.inc(len(missed))
+                for msg in missed:
+                    if deliver(msg):
+                        yield msg
+
+            async for msg in provider.stream_all_messages(accept, resync):
+                if deliver(msg):
+                    yield msg
+    return source
+
+cluster_relay = ClusterRelay(
+    bus=create_bus(settings.CLUSTER_BUS_URL),
+    lease_ttl=settings.CLUSTER_LEASE_TTL,
+    interest_interval=settings.CLUSTER_INTEREST_INTERVAL,
+) if settings.CLUSTER_BUS_URL else None
+
+def _clustered_source(credentials: FeishuCredentials):
+    """集群部署时的上游: 只有持有租约的节点运行长轮询，消息经总线广播给所有节点。"""
+    key = credentials.key
+    buffered = set()
+
+    def on_remote(msg: feishu_im_pb2.Message):
+        # 其他节点转发来的消息: 维护本节点的重放缓冲与本地存储，接管上游或客户端续传时使用
+        if msg.chat_id not in buffered:
+            replay_buffer.reset(key, msg.chat_id, msg.create_time - 1)
+            buffered.add(msg.chat_id)
+        replay_buffer.append(key, msg)
+        if message_store is not None:
+            message_store.submit_live_messages([msg])
+
+    return cluster_relay.source(
+        key,
+        _multiplexed_source(credentials),
+        encode=feishu_im_pb2.Message.SerializeToString,
+        decode=feishu_im_pb2.Message.FromString,
+        on_remote=on_remote,
+    )
+
+@asynccontextmanager
+async def subscribe_chat_streams(credentials: FeishuCredentials, chat_ids: List[str], overflow: Optional[str] = None):
+    """
+    订阅一个或多个会话的实时消息。同一组认证信息下的所有会话共享一个上游长轮询。
+    overflow 为该订阅者的慢消费者策略，默认使用 WS_SLOW_CONSUMER_POLICY。
+    """
+    if message_store is not None:
+        for chat_id in chat_ids:
+            message_store.mark_live(chat_id)
+    try:
+        async with subscription_hub.subscribe(
+            credentials.key,
+            chat_ids,
+            _clustered_source(credentials) if cluster_relay is not None else _multiplexed_source(credentials),
+            route=lambda msg: msg.chat_id,
+            policy=overflow,
+        ) as subscription:
+            yield subscription
+    finally:
+        if message_store is not None:
+            for chat_id in chat_ids:
+                message_store.mark_idle(chat_id)
+
+@asynccontextmanager
+async def open_chat_subscription(credentials: dict, chat_id: str):
+    """供后台任务使用: 按序列化的认证信息订阅单个会话的实时消息 (与 WebSocket 共享上游)。"""
+    async with subscribe_chat_streams(FeishuCredentials(**credentials), [chat_id]) as subscription:
+        yield subscription
+
+async def replay_missed(provider: FeishuProvider, chat_id: str, since_time: int, since_id: str) -> List[feishu_im_pb2.Message]:
+    """
+    返回续传令牌之后错过的消息 (按时间正序)。优先从重放缓冲区读取，
+    令牌超出缓冲范围时回退到历史消息 (本地存储优先)。
+    """
+    messages = replay_buffer.replay(provider.credentials.key, chat_id, since_time, since_id)
+    if messages is not None:
+        STREAM_REPLAYED.labels("buffer").inc(len(messages))
+        return messages
+
+    history: List[feishu_im_pb2.Message] = []
+    pages = iter_history_pages(partial(fetch_history, provider), chat_id, settings.REPLAY_HISTORY_MAX, start_time=since_time)
+    async with aclosing(pages):
+        async for page in pages:
+            history.extend(page)
+    history.reverse()
+    # 历史页可能来自缓存或尚未包含最新消息，用缓冲区中的实时消息补上
+    seen = {msg.message_id for msg in history}
+    history.extend(msg for msg in replay_buffer.recent(provider.credentials.key, chat_id) if msg.message_id not in seen)
+    # 包含令牌所在毫秒的全部消息，按位置跳过 since_id 及其之前已收到的消息
+    missed = messages_after(history, since_time, since_id)
+    STREAM_REPLAYED.labels("history").inc(len(missed))
+    return missed
 
-def get_feishu_provider(
+async def get_feishu_provider(
     cookie: Optional[str] = Header(None, alias="X-Feishu-Cookie"),
     history_cmd: Optional[str] = Header(None, alias="X-Cmd-History"),
     stream_cmd: Optional[str] = Header(None, alias="X-Cmd-Stream"),
@@ -186,15 +665,10 @@ def get_feishu_provider(
     web_version: Optional[str] = Header(None, alias="X-Web-Version"),
     csrf_token: Optional[str] = Header(None, alias="X-CSRF-Token"),
     lgw_csrf_token: Optional[str] = Header(None, alias="X-LGW-CSRF-Token")
-) -> FeishuProvider:
-    lgw_token_from_settings = settings._auth_data.get("lgw_csrf_token", "")
-    return FeishuProvider(
-        cookie=cookie or settings.FEISHU_COOKIE,
-        history_cmd=history_cmd or settings.COMMAND_ID_HISTORY,
-        stream_cmd=stream_cmd or settings.COMMAND_ID_STREAM,
-        user_agent=user_agent or settings.USER_AGENT or settings.DEFAULT_USER_AGENT,
-        referer=referer or settings.REFERER or settings.DEFAULT_REFERER,
-        web_version=web_version or settings.FEISHU_WEB_VERSION,
-        csrf_token=csrf_token or settings.CSRF_TOKEN,
-        lgw_csrf_token=lgw_csrf_token or lgw_token_from_settings
+) -> AsyncGenerator[FeishuProvider, None]:
+    credentials = resolve_credentials(
+        cookie=cookie, history_cmd=history_cmd, stream_cmd=stream_cmd, user_agent=user_agent,
+        referer=referer, web_version=web_version, csrf_token=csrf_token, lgw_csrf_token=lgw_csrf_token,
     )
+    async with lease_provider(credentials) as provider:
+        yield provider
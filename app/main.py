@@ -1,17 +1,34 @@
 import os
+import asyncio
+import json
+import math
+import hashlib
 import logging
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, Query, WebSocketDisconnect
+from functools import partial
+from fastapi import FastAPI, HTTPException, Depends, WebSocket, Query, Header, Request, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional
+from typing import Optional, AsyncGenerator, List, Dict, Any
+from pydantic import BaseModel, Field
 
 from logging_config import setup_logging
 setup_logging()
 
-from feishu_provider import FeishuProvider, get_feishu_provider
+from feishu_provider import FeishuProvider, FeishuCredentials, get_feishu_provider, lease_provider, provider_registry, subscribe_chat_streams, fetch_history, message_store, history_page_cache, subscription_hub, open_history_fetcher, replay_buffer, replay_missed, cluster_relay, open_chat_subscription, credential_manager, resolve_credentials, fetch_history_protobuf
+from core.subscription_hub import SlowConsumerError, SLOW_CONSUMER_POLICIES
+from core.ws_sender import WebSocketSender, serve_until_disconnect
+from core.formatting import build_analysis_result
+from core.serialization import JSON_MEDIA_TYPE, PROTOBUF_MEDIA_TYPE, dumps, encode_history_page, encode_message, encode_message_array, encode_stream_batch, wants_protobuf
+from core.export_engine import collect_chat_messages, export_chats, stream_export, EXPORT_FORMAT_NDJSON, EXPORT_FORMAT_TEXT, EXPORT_ORDER_ASC, EXPORT_ORDER_DESC
+from core.export_jobs import ExportJobManager, JOB_COMPLETED
+from core.rate_limit import upstream_guard
+from core.replay import parse_resume_token
+from core.webhooks import WebhookManager, WebhookURLError
+from core.completions import CompletionLimiter, CompletionLimitError, SSE_MEDIA_TYPE, encode_stream_error
+from core.http_client import create_webhook_client, prepare_transport
+from core.metrics import ACTIVE_WEBSOCKETS, METRICS_CONTENT_TYPE, register_stats, render_metrics
 from config import settings
-import feishu_im_pb2
 
 app = FastAPI(
     title="飞书消息方舟",
@@ -19,6 +36,49 @@ app = FastAPI(
     version="7.0.0"
 )
 
+export_jobs = ExportJobManager(
+    jobs_dir=settings.EXPORT_JOBS_DIR,
+    workers=settings.EXPORT_JOB_WORKERS,
+    per_credential_limit=settings.EXPORT_JOB_PER_CREDENTIAL,
+    open_fetcher=open_history_fetcher,
+    credential_key=lambda credentials: FeishuCredentials(**credentials).key,
+    job_ttl=settings.EXPORT_JOB_TTL,
+)
+
+webhooks = WebhookManager(
+    root_dir=settings.WEBHOOKS_DIR,
+    subscribe=open_chat_subscription,
+    client_factory=create_webhook_client,
+    batch_size=settings.WEBHOOK_BATCH_SIZE,
+    flush_ms=settings.WEBHOOK_FLUSH_MS,
+    queue_size=settings.WEBHOOK_QUEUE_SIZE,
+    spill_max_bytes=settings.WEBHOOK_SPILL_MAX_BYTES,
+    backoff_base=settings.WEBHOOK_BACKOFF_BASE,
+    backoff_max=settings.WEBHOOK_BACKOFF_MAX,
+    rescan_interval=settings.WEBHOOK_RESCAN_INTERVAL,
+    allowed_hosts=settings.WEBHOOK_ALLOWED_HOSTS,
+)
+
+completion_limiter = CompletionLimiter(
+    max_concurrency=settings.COMPLETION_MAX_CONCURRENCY,
+    queue_timeout=settings.COMPLETION_QUEUE_TIMEOUT,
+    rpm=settings.COMPLETION_QUOTA_RPM,
+    burst=settings.COMPLETION_QUOTA_BURST,
+)
+
+register_stats({
+    "history_cache": history_page_cache.stats,
+    "provider_registry": provider_registry.stats,
+    "subscriptions": subscription_hub.stats,
+    "upstream_limits": upstream_guard.stats,
+    "replay_buffer": replay_buffer.stats,
+    "webhooks": webhooks.stats,
+    "completions": completion_limiter.stats,
+    "credentials": credential_manager.stats,
+})
+if cluster_relay is not None:
+    register_stats({"cluster": cluster_relay.stats})
+
 STATIC_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public")
 
 @app.on_event("startup")
@@ -30,11 +90,26 @@ async def startup_event():
         logging.critical(f"致命错误: 静态文件目录 '{STATIC_FILES_DIR}' 中缺少 'index.html' 文件。")
     else:
         logging.info(f"静态文件目录已确认: {STATIC_FILES_DIR}")
+    # 在线程中预热上游传输层 (CA 证书、httpcore / h2)，首个上游请求不必再等待
+    asyncio.get_running_loop().run_in_executor(None, prepare_transport)
+    credential_manager.start()
+    provider_registry.start()
+    export_jobs.start()
+    webhooks.start()
 
-security = HTTPBearer()
+@app.on_event("shutdown")
+async def shutdown_event():
+    logging.info("应用关闭，正在释放上游连接池...")
+    await export_jobs.stop()
+    await webhooks.stop()
+    await provider_registry.close()
+    await credential_manager.close()
+    if message_store is not None:
+        await message_store.close()
+    if cluster_relay is not None:
+        await cluster_relay.bus.close()
 
-def format_timestamp(ts: int) -> str:
-    return datetime.fromtimestamp(ts / 1000).strftime('%Y-%m-%d %H:%M:%S')
+security = HTTPBearer()
 
 async def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if settings.API_MASTER_KEY and (credentials.scheme != "Bearer" or credentials.credentials != settings.API_MASTER_KEY):
@@ -49,98 +124,391 @@ async def get_websocket_provider(
     web_version: Optional[str] = Query(None),
     csrf_token: Optional[str] = Query(None),
     referer: Optional[str] = Query(None),
-) -> FeishuProvider:
-    return FeishuProvider(
-        cookie=cookie or settings.FEISHU_COOKIE,
-        history_cmd=cmd_history or settings.COMMAND_ID_HISTORY,
-        stream_cmd=cmd_stream or settings.COMMAND_ID_STREAM,
-        user_agent=user_agent or settings.USER_AGENT or settings.DEFAULT_USER_AGENT,
-        referer=referer or settings.REFERER or settings.DEFAULT_REFERER,
-        web_version=web_version or settings.FEISHU_WEB_VERSION,
-        csrf_token=csrf_token or settings.CSRF_TOKEN
+) -> AsyncGenerator[FeishuProvider, None]:
+    credentials = resolve_credentials(
+        cookie=cookie, history_cmd=cmd_history, stream_cmd=cmd_stream, user_agent=user_agent,
+        referer=referer, web_version=web_version, csrf_token=csrf_token,
     )
+    async with lease_provider(credentials) as provider:
+        yield provider
 
 @app.get("/api/v1/config", summary="获取前端所需的默认配置")
 async def get_config():
     return {
         "defaultChatId": settings.DEFAULT_CHAT_ID,
-        "defaultAuthJson": settings.FEISHU_AUTH_JSON,
+        "defaultAuthJson": json.dumps(credential_manager.data, ensure_ascii=False) if credential_manager.data else settings.FEISHU_AUTH_JSON,
         "apiMasterKey": settings.API_MASTER_KEY,
     }
 
-@app.post("/api/v1/chat/messages", summary="获取历史消息", dependencies=[Depends(verify_api_key)])
+@app.get("/api/v1/stats", summary="查看缓存、连接池与订阅的运行统计", dependencies=[Depends(verify_api_key)])
+async def get_stats():
+    return {
+        "history_cache": history_page_cache.stats(),
+        "provider_registry": provider_registry.stats(),
+        "subscriptions": subscription_hub.stats(),
+        "upstream_limits": upstream_guard.stats(),
+        "replay_buffer": replay_buffer.stats(),
+        "webhooks": webhooks.stats(),
+        "completions": completion_limiter.stats(),
+        "credentials": credential_manager.stats(),
+        "cluster": cluster_relay.stats() if cluster_relay is not None else None,
+    }
+
+@app.get("/api/v1/admin/credentials", summary="查看托管认证信息的版本与来源 (不返回认证内容)", dependencies=[Depends(verify_api_key)])
+async def get_credentials_status():
+    return credential_manager.stats()
+
+@app.put("/api/v1/admin/credentials", summary="热更新托管认证信息 (格式同 FEISHU_AUTH_JSON)，进行中的订阅与连接无需重建", dependencies=[Depends(verify_api_key)])
+async def update_credentials(auth: Dict[str, Any]):
+    try:
+        credential_manager.update(auth)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return credential_manager.stats()
+
+@app.get("/metrics", summary="Prometheus 指标", dependencies=[Depends(verify_api_key)])
+async def get_metrics():
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.post("/api/v1/chat/messages", summary="获取历史消息 (Accept: application/x-protobuf 时返回 GetMessagesResponse 二进制)", dependencies=[Depends(verify_api_key)])
 async def get_chat_messages(
     chat_id: str, count: int = 50, cursor: str = "0",
+    accept: Optional[str] = Header(None),
     provider: FeishuProvider = Depends(get_feishu_provider)
 ):
     try:
-        response_pb = await provider.get_history_messages(chat_id, count, cursor)
-        messages_list = [format_message_to_dict(msg) for msg in response_pb.items]
-        return { "has_more": response_pb.has_more, "next_cursor": str(response_pb.next_cursor), "messages": messages_list }
+        if wants_protobuf(accept):
+            content = await fetch_history_protobuf(provider, chat_id, count, cursor)
+            return Response(content=content, media_type=PROTOBUF_MEDIA_TYPE)
+        response_pb = await fetch_history(provider, chat_id, count, cursor)
+        return Response(content=encode_history_page(response_pb), media_type=JSON_MEDIA_TYPE)
     except Exception as e:
         logging.error(f"获取历史消息时发生错误: {e}")
         raise HTTPException(status_code=502, detail=f"请求飞书服务器失败: {e}。请检查您的所有认证信息是否都正确且有效。")
 
+@app.get("/api/v1/search", summary="在本地已存储的消息中全文搜索 (按相关度排序，cursor 为上一页返回的 next_cursor)", dependencies=[Depends(verify_api_key)])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=256, description="关键词，空白分隔的多个词需全部命中"),
+    chat_id: Optional[str] = Query(default=None),
+    sender_id: Optional[str] = Query(default=None),
+    start_time: Optional[int] = Query(default=None, description="起始时间 (毫秒时间戳)"),
+    end_time: Optional[int] = Query(default=None, description="结束时间 (毫秒时间戳)"),
+    count: int = Query(default=20, gt=0, le=100),
+    cursor: str = "0",
+    accept: Optional[str] = Header(None),
+):
+    if message_store is None:
+        raise HTTPException(status_code=503, detail="本地消息存储未启用 (MESSAGE_STORE_ENABLED=false)，无法搜索。")
+    try:
+        response_pb = await message_store.search(q, chat_id, sender_id, start_time, end_time, count, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if wants_protobuf(accept):
+        return Response(content=response_pb.SerializeToString(), media_type=PROTOBUF_MEDIA_TYPE)
+    return Response(content=encode_history_page(response_pb), media_type=JSON_MEDIA_TYPE)
+
 @app.post("/api/v1/chat/export_for_analysis", summary="导出对话用于AI分析", dependencies=[Depends(verify_api_key)])
 async def export_chat_for_analysis(
     chat_id: str,
-    count: int = Query(default=100, gt=0, le=500),
+    count: int = Query(default=100, gt=0, le=settings.EXPORT_MAX_MESSAGES),
+    start_time: Optional[int] = Query(default=None, description="起始时间 (毫秒时间戳)"),
+    end_time: Optional[int] = Query(default=None, description="结束时间 (毫秒时间戳)"),
     provider: FeishuProvider = Depends(get_feishu_provider)
 ):
     try:
-        response_pb = await provider.get_history_messages(chat_id, count, "0")
-        if not response_pb.items:
-            return {"analysis_text": "没有找到任何消息。", "start_info": "无", "end_info": "无", "message_count": 0}
-        messages = list(reversed(response_pb.items))
-        formatted_lines = []
-        for msg in messages:
-            sender_name = msg.sender.name or "未知用户"
-            content_text = msg.text_content.text.strip() if msg.HasField("text_content") else ""
-            if not content_text: continue
-            timestamp_str = format_timestamp(msg.create_time)
-            formatted_lines.append(f"{timestamp_str} - {sender_name}: {content_text}")
-        analysis_text = "\n".join(formatted_lines)
-        start_msg, end_msg = messages[0], messages[-1]
-        start_info = f"从 {format_timestamp(start_msg.create_time)} ({start_msg.sender.name}) 的消息开始"
-        end_info = f"到 {format_timestamp(end_msg.create_time)} ({end_msg.sender.name}) 的消息结束"
-        return {"analysis_text": analysis_text, "start_info": start_info, "end_info": end_info, "message_count": len(formatted_lines)}
+        messages = await collect_chat_messages(partial(fetch_history, provider), chat_id, count, start_time, end_time)
+        return build_analysis_result(messages)
     except Exception as e:
         logging.error(f"导出对话时发生错误: {e}")
         raise HTTPException(status_code=502, detail=f"请求飞书服务器失败: {e}。请检查您的所有认证信息是否都正确且有效。")
 
-@app.websocket("/ws/v1/chat/stream/{chat_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
+EXPORT_MEDIA_TYPES = {
+    EXPORT_FORMAT_NDJSON: "application/x-ndjson",
+    EXPORT_FORMAT_TEXT: "text/plain; charset=utf-8",
+}
+
+@app.post("/api/v1/chat/export_stream", summary="流式导出对话 (NDJSON 或纯文本)", dependencies=[Depends(verify_api_key)])
+async def export_chat_stream(
     chat_id: str,
-    token: str,
-    provider: FeishuProvider = Depends(get_websocket_provider)
+    format: str = Query(default=EXPORT_FORMAT_NDJSON, pattern=f"^({EXPORT_FORMAT_NDJSON}|{EXPORT_FORMAT_TEXT})$"),
+    count: int = Query(default=1000, gt=0, le=settings.EXPORT_MAX_MESSAGES),
+    start_time: Optional[int] = Query(default=None, description="起始时间 (毫秒时间戳)"),
+    end_time: Optional[int] = Query(default=None, description="结束时间 (毫秒时间戳)"),
+    order: Optional[str] = Query(
+        default=None, pattern=f"^({EXPORT_ORDER_ASC}|{EXPORT_ORDER_DESC})$",
+        description="asc 从旧到新 (text 默认，翻完所有页后才开始输出)，desc 从新到旧 (ndjson 默认，边翻页边输出)",
+    ),
+    provider: FeishuProvider = Depends(get_feishu_provider)
 ):
+    chunks = stream_export(partial(fetch_history, provider), chat_id, format, count, start_time, end_time, order)
+    # 先取第一块: 上游在开始阶段失败时仍可返回 502，而不是一个中途截断的 200 响应
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except Exception as e:
+        await chunks.aclose()
+        logging.error(f"流式导出对话时发生错误: {e}")
+        raise HTTPException(status_code=502, detail=f"请求飞书服务器失败: {e}。请检查您的所有认证信息是否都正确且有效。")
+
+    async def body():
+        try:
+            if first_chunk:
+                yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            logging.error(f"流式导出中途失败, Chat ID: {chat_id}: {e}")
+            if format == EXPORT_FORMAT_NDJSON:
+                yield (json.dumps({"error": f"导出中断: {e}"}, ensure_ascii=False) + "\n").encode("utf-8")
+            else:
+                yield f"# 导出中断: {e}\n".encode("utf-8")
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(body(), media_type=EXPORT_MEDIA_TYPES[format])
+
+class ExportJobRequest(BaseModel):
+    chat_id: str = Field(..., min_length=1)
+    format: str = Field(default=EXPORT_FORMAT_NDJSON, pattern=f"^({EXPORT_FORMAT_NDJSON}|{EXPORT_FORMAT_TEXT})$")
+    max_messages: int = Field(default=10000, gt=0, le=settings.EXPORT_MAX_MESSAGES)
+    start_time: Optional[int] = Field(default=None, description="起始时间 (毫秒时间戳)")
+    end_time: Optional[int] = Field(default=None, description="结束时间 (毫秒时间戳)")
+
+@app.post("/api/v1/export_jobs", summary="创建后台导出任务", dependencies=[Depends(verify_api_key)])
+async def create_export_job(
+    request: ExportJobRequest,
+    provider: FeishuProvider = Depends(get_feishu_provider)
+):
+    job = await export_jobs.create(
+        provider.credentials._asdict(), request.chat_id, request.format,
+        request.max_messages, request.start_time, request.end_time,
+    )
+    return ExportJobManager.public_view(job)
+
+@app.get("/api/v1/export_jobs/{job_id}", summary="查询导出任务状态与进度", dependencies=[Depends(verify_api_key)])
+async def get_export_job(job_id: str):
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="导出任务不存在")
+    return ExportJobManager.public_view(job)
+
+@app.get("/api/v1/export_jobs/{job_id}/result", summary="下载导出任务结果", dependencies=[Depends(verify_api_key)])
+async def get_export_job_result(job_id: str):
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="导出任务不存在")
+    if job["status"] != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"导出任务尚未完成 (当前状态: {job['status']})")
+    return FileResponse(export_jobs.result_path(job), media_type=EXPORT_MEDIA_TYPES[job["format"]])
+
+class BulkExportRequest(BaseModel):
+    chat_ids: List[str] = Field(..., min_length=1, description="需要导出的 Chat ID 列表")
+    max_messages: int = Field(default=1000, gt=0, le=settings.EXPORT_MAX_MESSAGES, description="每个会话最多导出的消息数")
+    start_time: Optional[int] = Field(default=None, description="起始时间 (毫秒时间戳)")
+    end_time: Optional[int] = Field(default=None, description="结束时间 (毫秒时间戳)")
+
+@app.post("/api/v1/chat/export_bulk", summary="批量并发导出多个对话", dependencies=[Depends(verify_api_key)])
+async def export_chats_bulk(
+    request: BulkExportRequest,
+    provider: FeishuProvider = Depends(get_feishu_provider)
+):
+    results = await export_chats(partial(fetch_history, provider), request.chat_ids, request.max_messages, request.start_time, request.end_time)
+    response = {}
+    for chat_id, result in results.items():
+        if isinstance(result, BaseException):
+            logging.error(f"批量导出会话 {chat_id} 时发生错误: {result}")
+            response[chat_id] = {"error": f"请求飞书服务器失败: {result}"}
+        else:
+            response[chat_id] = build_analysis_result(result)
+    return {"results": response}
+
+class WebhookRequest(BaseModel):
+    chat_id: str = Field(..., min_length=1)
+    url: str = Field(..., pattern=r"^https?://", description="接收 POST 的地址，请求体为 {target_id, chat_id, messages}")
+    secret: Optional[str] = Field(default=None, description="设置后每个请求带 X-Webhook-Signature: sha256=<HMAC(secret, body)>")
+    batch_size: Optional[int] = Field(default=None, gt=0, le=1000, description="每批最多消息数，默认 WEBHOOK_BATCH_SIZE")
+    flush_ms: Optional[int] = Field(default=None, gt=0, le=60000, description="凑批最长等待毫秒数，默认 WEBHOOK_FLUSH_MS")
+
+@app.post("/api/v1/webhooks", summary="注册 Webhook: 会话的新消息按批 POST 到目标地址", dependencies=[Depends(verify_api_key)])
+async def create_webhook(
+    request: WebhookRequest,
+    provider: FeishuProvider = Depends(get_feishu_provider)
+):
+    try:
+        target = await webhooks.create(
+            provider.credentials._asdict(), request.chat_id, request.url,
+            request.secret, request.batch_size, request.flush_ms,
+        )
+    except WebhookURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return webhooks.public_view(target)
+
+@app.get("/api/v1/webhooks", summary="列出已注册的 Webhook 与投递统计", dependencies=[Depends(verify_api_key)])
+async def list_webhooks():
+    return {"webhooks": [webhooks.public_view(target) for target in webhooks.list_targets()]}
+
+@app.get("/api/v1/webhooks/{target_id}", summary="查询 Webhook 与投递统计", dependencies=[Depends(verify_api_key)])
+async def get_webhook(target_id: str):
+    target = webhooks.get(target_id)
+    if target is None:
+        raise HTTPException(status_code=404, detail="Webhook 不存在")
+    return webhooks.public_view(target)
+
+@app.delete("/api/v1/webhooks/{target_id}", summary="删除 Webhook", dependencies=[Depends(verify_api_key)])
+async def delete_webhook(target_id: str):
+    if not await webhooks.delete(target_id):
+        raise HTTPException(status_code=404, detail="Webhook 不存在")
+    return {"deleted": target_id}
+
+@app.post("/v1/chat/completions", summary="OpenAI 兼容的 Chat Completions (model=feishu/<chat_id>，stream=true 时推送实时消息)")
+async def chat_completions(
+    request: Request,
+    authorization: HTTPAuthorizationCredentials = Depends(security),
+    provider: FeishuProvider = Depends(get_feishu_provider)
+):
+    """
+    只读的 OpenAI 兼容接口: model 不是模型名而是会话，写 feishu/<chat_id> 或 feishu (DEFAULT_CHAT_ID)。
+    网关不会把内容发送到飞书，messages 必须省略或为空数组；model 格式不符或带有 messages 时返回 400。
+    """
+    await verify_api_key(authorization)
+    try:
+        request_data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是有效的 JSON。")
+    if not isinstance(request_data, dict):
+        raise HTTPException(status_code=400, detail="请求体必须是 JSON 对象。")
+
+    # 配额按调用方的 API 密钥计 (上游按 cookie 的限流由 upstream_guard 负责)
+    quota_key = hashlib.sha256(authorization.credentials.encode("utf-8")).hexdigest()
+    try:
+        completion_limiter.check_quota(quota_key)
+        await completion_limiter.acquire()
+    except CompletionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+    try:
+        result = await provider.chat_completion(request_data, request)
+    except ValueError as e:
+        completion_limiter.release()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        completion_limiter.release()
+        logging.error(f"Chat completion 请求失败: {e}")
+        raise HTTPException(status_code=502, detail=f"请求飞书服务器失败: {e}")
+    if isinstance(result, dict):
+        completion_limiter.release()
+        return Response(dumps(result), media_type=JSON_MEDIA_TYPE)
+
+    async def sse():
+        # 实时订阅在后台连接上游，上游错误只会在响应开始之后出现，统一以 SSE 错误事件结束响应。
+        # 流式响应结束 (包括客户端断开) 时才归还并发名额
+        try:
+            async for chunk in result:
+                yield chunk
+        except Exception as e:
+            logging.error(f"Chat completion 流式响应中断: {e}")
+            yield encode_stream_error(str(e))
+        finally:
+            await result.aclose()
+            completion_limiter.release()
+
+    # X-Accel-Buffering 关闭 nginx 的响应缓冲，每个 chunk 到达即转发
+    return StreamingResponse(sse(), media_type=SSE_MEDIA_TYPE, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+WS_FORMAT_JSON = "json"
+WS_FORMAT_PROTOBUF = "protobuf"
+WS_FORMAT_PATTERN = f"^({WS_FORMAT_JSON}|{WS_FORMAT_PROTOBUF})$"
+SINCE_DESCRIPTION = "续传令牌 <create_time>[:<message_id>]: 重连时只重放这条消息之后错过的消息"
+BATCH_DESCRIPTION = "为 true 时每帧是一批消息: json 为消息数组，protobuf 为 StreamResponse"
+OVERFLOW_PATTERN = f"^({'|'.join(SLOW_CONSUMER_POLICIES)})$"
+OVERFLOW_DESCRIPTION = "客户端跟不上时的处理: drop 丢弃最旧的积压，drop_newest 丢弃新消息，disconnect 断开 (默认见 WS_SLOW_CONSUMER_POLICY)"
+
+async def stream_chats_to_websocket(websocket: WebSocket, token: str, provider: FeishuProvider, chat_ids: List[str], ws_format: str = WS_FORMAT_JSON, since: Optional[str] = None, batch: bool = False, overflow: Optional[str] = None):
     if settings.API_MASTER_KEY and token != settings.API_MASTER_KEY:
         await websocket.close(code=1008, reason="无效的 API 密钥")
         return
     
+    chat_label = ",".join(chat_ids)
     await websocket.accept()
-    logging.info(f"WebSocket 连接已建立, Chat ID: {chat_id}")
-    
+    logging.info(f"WebSocket 连接已建立, Chat ID: {chat_label}")
+
+    if ws_format == WS_FORMAT_PROTOBUF:
+        # 每个二进制帧是一条 feishu_im.proto 中的 Message (批量模式下为 StreamResponse)
+        encoders = dict(encode_one=lambda msg: msg.SerializeToString(), encode_batch=encode_stream_batch, binary=True)
+    else:
+        encoders = dict(
+            encode_one=lambda msg: encode_message(msg).decode("utf-8"),
+            encode_batch=lambda messages: encode_message_array(messages).decode("utf-8"),
+            binary=False,
+        )
+    sender = WebSocketSender(
+        websocket, **encoders, batch=batch,
+        max_batch=settings.WS_BATCH_MAX,
+        window=settings.WS_BATCH_WINDOW_MS / 1000,
+        send_timeout=settings.WS_SEND_TIMEOUT,
+    )
+
+    async def stream():
+        if not chat_ids:
+            raise ValueError("Chat ID 不能为空。")
+        resume_from = parse_resume_token(since) if since else None
+        async with subscribe_chat_streams(provider.credentials, chat_ids, overflow) as subscription:
+            ACTIVE_WEBSOCKETS.inc()
+            try:
+                # 先订阅再重放: 重放期间到达的实时消息在队列中等待，已重放过的按 ID 跳过
+                replayed = set()
+                if resume_from is not None:
+                    for chat_id in chat_ids:
+                        missed = await replay_missed(provider, chat_id, *resume_from)
+                        replayed.update(msg.message_id for msg in missed)
+                        await sender.send(missed)
+                    logging.info(f"已为 Chat ID: {chat_label} 重放 {len(replayed)} 条错过的消息。")
+                await sender.pump(subscription, skip=lambda msg: msg.message_id in replayed)
+            finally:
+                ACTIVE_WEBSOCKETS.dec()
+
     try:
-        async for new_msg in provider.stream_latest_messages(chat_id):
-            await websocket.send_json(format_message_to_dict(new_msg))
+        await serve_until_disconnect(websocket, stream())
     except ValueError as e:
         logging.error(f"WebSocket 因认证信息无效而关闭: {e}")
         await websocket.close(code=1008, reason=str(e))
+    except SlowConsumerError as e:
+        logging.warning(f"WebSocket 客户端消费过慢，已断开, Chat ID: {chat_label}")
+        await websocket.close(code=1013, reason=str(e))
     except WebSocketDisconnect:
-        logging.info(f"客户端主动断开 WebSocket 连接, Chat ID: {chat_id}")
+        logging.info(f"客户端主动断开 WebSocket 连接, Chat ID: {chat_label}")
     except Exception as e:
         logging.error(f"WebSocket 发生未知错误: {e}")
         await websocket.close(code=1011, reason=f"发生内部错误: {e}")
     finally:
-        logging.info(f"WebSocket 连接已关闭, Chat ID: {chat_id}")
-
-def format_message_to_dict(msg: feishu_im_pb2.Message) -> dict:
-    content_text = ""
-    if msg.HasField("text_content"): content_text = msg.text_content.text
-    sender_info = {}
-    if msg.HasField("sender"): sender_info = { "id": msg.sender.sender_id, "name": msg.sender.name, "avatar_url": msg.sender.avatar_url }
-    return { "message_id": msg.message_id, "chat_id": msg.chat_id, "sender": sender_info, "create_time": msg.create_time, "content": content_text }
+        logging.info(f"WebSocket 连接已关闭, Chat ID: {chat_label}")
+
+@app.websocket("/ws/v1/chat/stream")
+async def multi_chat_websocket_endpoint(
+    websocket: WebSocket,
+    token: str,
+    chat_ids: str = Query(..., description="逗号分隔的多个 Chat ID"),
+    format: str = Query(default=WS_FORMAT_JSON, pattern=WS_FORMAT_PATTERN, description="json 为文本帧，protobuf 为 Message 二进制帧"),
+    since: Optional[str] = Query(default=None, description=SINCE_DESCRIPTION),
+    batch: bool = Query(default=False, description=BATCH_DESCRIPTION),
+    overflow: Optional[str] = Query(default=None, pattern=OVERFLOW_PATTERN, description=OVERFLOW_DESCRIPTION),
+    provider: FeishuProvider = Depends(get_websocket_provider)
+):
+    chat_id_list = [chat_id.strip() for chat_id in chat_ids.split(",") if chat_id.strip()]
+    await stream_chats_to_websocket(websocket, token, provider, chat_id_list, format, since, batch, overflow)
+
+@app.websocket("/ws/v1/chat/stream/{chat_id}")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    chat_id: str,
+    token: str,
+    format: str = Query(default=WS_FORMAT_JSON, pattern=WS_FORMAT_PATTERN, description="json 为文本帧，protobuf 为 Message 二进制帧"),
+    since: Optional[str] = Query(default=None, description=SINCE_DESCRIPTION),
+    batch: bool = Query(default=False, description=BATCH_DESCRIPTION),
+    overflow: Optional[str] = Query(default=None, pattern=OVERFLOW_PATTERN, description=OVERFLOW_DESCRIPTION),
+    provider: FeishuProvider = Depends(get_websocket_provider)
+):
+    await stream_chats_to_websocket(websocket, token, provider, [chat_id], format, since, batch, overflow)
 
 app.mount("/", StaticFiles(directory=STATIC_FILES_DIR, html=True), name="public")
\ No newline at end of file
@@ -10,6 +10,6 @@ class BaseProvider(ABC):
         self,
         request_data: Dict[str, Any],
         original_request: Request
-    ) -> Union[Dict[str, Any], AsyncGenerator[str, None]]:
-        """处理聊天补全请求的核心方法"""
+    ) -> Union[Dict[str, Any], AsyncGenerator[bytes, None]]:
+        """处理聊天补全请求的核心方法: 非流式返回响应字典，流式返回逐块产出的 SSE 字节流"""
         pass
@@ -39,8 +39,34 @@ document.addEventListener("DOMContentLoaded", () => {
         currentChatId: null,
         profiles: JSON.parse(localStorage.getItem("feishuProfiles")) || {},
         activeProfileId: localStorage.getItem("activeProfileId") || null,
+        seenMessageIds: new Set(),
+        resumeToken: null, // 已显示的最新一条消息 "<create_time>:<message_id>"，断线重连时只重放之后的消息
+        resumeTime: 0,
+        reconnectTimer: null,
+        reconnectDelay: 1000,
     };
 
+    function resetStreamState() {
+        state.seenMessageIds = new Set();
+        state.resumeToken = null;
+        state.resumeTime = 0;
+        state.reconnectDelay = 1000;
+        clearTimeout(state.reconnectTimer);
+    }
+
+    // 历史消息与实时消息可能重叠，按 message_id 只显示一次，并记录续传令牌
+    function showMessage(data) {
+        if (data.message_id) {
+            if (state.seenMessageIds.has(data.message_id)) return;
+            state.seenMessageIds.add(data.message_id);
+            if (data.create_time >= state.resumeTime) {
+                state.resumeTime = data.create_time;
+                state.resumeToken = `${data.create_time}:${data.message_id}`;
+            }
+        }
+        appendMessage(data);
+    }
+
     function appendMessage(data) {
         const messageElement = document.createElement("div");
         messageElement.classList.add("message");
@@ -156,13 +182,14 @@ document.addEventListener("DOMContentLoaded", () => {
                  throw new Error(`HTTP ${response.status}: ${errorData.detail}`);
             }
             const data = JSON.parse(responseText);
-            data.messages.reverse().forEach(appendMessage);
+            data.messages.reverse().forEach(showMessage);
         } catch (error) {
             appendMessage({ content: `获取历史消息失败: ${error.message}`, sender: { name: "系统错误" } });
         }
     }
 
-    function connectWebSocket(chatId) {
+    function connectWebSocket(chatId, since = null) {
+        clearTimeout(state.reconnectTimer);
         if (state.ws) state.ws.close();
         const activeProfile = state.profiles[state.activeProfileId];
         if (!activeProfile) return;
@@ -186,23 +213,42 @@ document.addEventListener("DOMContentLoaded", () => {
         });
         if (auth.csrf_token) queryParams.append('csrf_token', auth.csrf_token);
         if (auth.lgw_csrf_token) queryParams.append('lgw_csrf_token', auth.lgw_csrf_token);
+        if (since) queryParams.append('since', since);
+        // 批量模式: 短时间内到达的多条消息合并为一帧 JSON 数组
+        queryParams.append('batch', 'true');
         
         const wsProtocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
         const finalWsUrl = `${wsProtocol}${window.location.host}/ws/v1/chat/stream/${chatId}?${queryParams.toString()}`;
-        state.ws = new WebSocket(finalWsUrl);
+        const ws = new WebSocket(finalWsUrl);
+        state.ws = ws;
 
-        state.ws.onopen = () => {
+        ws.onopen = () => {
             elements.statusIndicator.classList.add("connected");
-            appendMessage({ content: "连接成功！正在等待实时消息...", sender: { name: "系统提示" } });
+            state.reconnectDelay = 1000;
+            if (!since) appendMessage({ content: "连接成功！正在等待实时消息...", sender: { name: "系统提示" } });
         };
-        state.ws.onmessage = (event) => appendMessage(JSON.parse(event.data));
-        state.ws.onclose = (event) => {
+        ws.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (Array.isArray(data)) data.forEach(showMessage);
+            else showMessage(data);
+        };
+        ws.onclose = (event) => {
+            if (state.ws !== ws) return; // 已被新连接取代
             elements.statusIndicator.classList.remove("connected");
-            if (state.currentChatId === chatId) {
+            if (state.currentChatId !== chatId) return;
+            // 1008 为认证或参数错误，重连也不会成功
+            if (event.code === 1008) {
                 appendMessage({ content: `连接已断开: ${event.reason || '未知原因'}`, sender: { name: "系统提示" } });
+                return;
             }
+            const delay = state.reconnectDelay;
+            state.reconnectDelay = Math.min(delay * 2, 30000);
+            appendMessage({ content: `连接已断开: ${event.reason || '未知原因'}，${Math.round(delay / 1000)} 秒后自动重连...`, sender: { name: "系统提示" } });
+            state.reconnectTimer = setTimeout(() => {
+                if (state.currentChatId === chatId) connectWebSocket(chatId, state.resumeToken);
+            }, delay);
         };
-        state.ws.onerror = (error) => console.error("WebSocket 错误:", error);
+        ws.onerror = (error) => console.error("WebSocket 错误:", error);
     }
 
     function switchChat(chatId) {
@@ -212,7 +258,13 @@ document.addEventListener("DOMContentLoaded", () => {
             return;
         }
         if (state.currentChatId === chatId && state.ws && state.ws.readyState === WebSocket.OPEN) return;
+        if (state.currentChatId === chatId && state.resumeToken) {
+            // 同一会话断线后重新点击: 保留已显示的消息，只续传错过的部分
+            connectWebSocket(chatId, state.resumeToken);
+            return;
+        }
         
+        resetStreamState();
         state.currentChatId = chatId;
         localStorage.setItem(`lastActiveChatId_${state.activeProfileId}`, chatId);
         
@@ -294,6 +346,11 @@ document.addEventListener("DOMContentLoaded", () => {
         elements.authInfoInput.value = profile.authInfo || "";
         elements.chatIdsInput.value = (profile.chatIds || []).join('\n');
         
+        if (state.activeProfileId !== profileId) {
+            // 换了预设就不能续传上一个预设的连接
+            state.currentChatId = null;
+            resetStreamState();
+        }
         state.activeProfileId = profileId;
         localStorage.setItem("activeProfileId", profileId);
         if (elements.profileSelect.value !== profileId) {
@@ -311,6 +368,7 @@ document.addEventListener("DOMContentLoaded", () => {
             switchChat(chatIdToLoad);
         } else {
             state.currentChatId = null;
+            resetStreamState();
             if (state.ws) state.ws.close();
             elements.currentChatTitle.textContent = "未选择会话";
             elements.messagesContainer.innerHTML = '<div class="message system-message">当前预设没有会话，请在左侧输入框添加一个新的 Chat ID。</div>';
@@ -0,0 +1,160 @@
+# bench/gateway_sim.py - 本地飞书网关模拟器 (压测用)
+"""
+在本地模拟飞书 /im/gateway/ 接口，收发与 feishu_im.proto 一致的 Frame / BizResponse 二进制帧:
+  - 请求负载能解析出 chat_id 时视为历史消息请求，返回 GetMessagesResponse (cursor 为消息序号)；
+  - 负载为空时视为实时长轮询，按 --stream-rate 生成新消息，以 StreamResponse 返回。
+支持固定延迟与抖动、每页条数上限、业务错误码与 HTTP 错误注入。
+
+用法 (在仓库根目录):
+    python bench/gateway_sim.py --port 9001 --chats 4 --messages-per-chat 100000 --latency-ms 20
+    FEISHU_BASE_URL=http://127.0.0.1:9001 uvicorn main:app   # 在 app/ 目录下启动服务
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+import feishu_im_pb2
+
+
+class GatewaySimulator:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        # 历史消息按序号确定性生成: 第 i 条的时间为 history_base + i 秒，最新一条在启动时刻之前
+        self.history_base = int(time.time() * 1000) - args.messages_per_chat * 1000
+        self.chat_ids = [f"oc_bench_{i}" for i in range(args.chats)]
+        self.live: List[feishu_im_pb2.Message] = []
+        self.live_offset = 0
+        self.live_event = asyncio.Event()
+        # 每个 cookie 视为一个客户端会话，记录它已经取走的实时消息位置
+        self.positions: Dict[str, int] = {}
+        self.stats = {"history": 0, "stream": 0, "injected_errors": 0}
+
+    def _message(self, chat_id: str, index: int, create_time: int, prefix: str = "m") -> feishu_im_pb2.Message:
+        return feishu_im_pb2.Message(
+            message_id=f"{prefix}_{chat_id}_{index}",
+            chat_id=chat_id,
+            sender=feishu_im_pb2.Sender(sender_id=f"ou_{index % 50}", name=f"用户{index % 50}"),
+            create_time=create_time,
+            text_content=feishu_im_pb2.TextContent(text=f"模拟消息 #{index} " + "x" * self.args.text_size),
+        )
+
+    def _frame(self, code: int = 0, payload: bytes = b"", message: str = "") -> Response:
+        biz = feishu_im_pb2.BizResponse(code=code, message=message, payload=payload)
+        body = feishu_im_pb2.Frame(payload=biz.SerializeToString()).SerializeToString()
+        return Response(content=body, media_type="application/x-protobuf")
+
+    def history_page(self, request: feishu_im_pb2.GetMessagesRequest) -> bytes:
+        end = self.args.messages_per_chat if request.cursor in ("", "0") else int(request.cursor)
+        count = min(request.count or 20, self.args.max_page_size)
+        start = max(0, end - count)
+        items = [self._message(request.chat_id, i, self.history_base + i * 1000) for i in range(end - 1, start - 1, -1)]
+        return feishu_im_pb2.GetMessagesResponse(items=items, has_more=start > 0, next_cursor=str(start)).SerializeToString()
+
+    async def stream_poll(self, client: str) -> bytes:
+        position = self.positions.setdefault(client, self.live_offset + len(self.live))
+        deadline = time.monotonic() + self.args.poll_timeout
+        while self.live_offset + len(self.live) <= position:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return b""
+            try:
+                await asyncio.wait_for(self.live_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return b""
+        start = max(position, self.live_offset) - self.live_offset
+        new_messages = self.live[start:]
+        self.positions[client] = self.live_offset + len(self.live)
+        return feishu_im_pb2.StreamResponse(new_messages=new_messages).SerializeToString()
+
+    async def produce_live(self):
+        """按 stream_rate 条/秒轮流向各会话产生新消息，只保留最近的一段供长轮询读取。"""
+        if self.args.stream_rate <= 0:
+            return
+        interval = 1 / self.args.stream_rate
+        index = 0
+        while True:
+            await asyncio.sleep(interval)
+            chat_id = self.chat_ids[index % len(self.chat_ids)]
+            self.live.append(self._message(chat_id, index, int(time.time() * 1000), prefix="live"))
+            index += 1
+            if len(self.live) > 10000:
+                del self.live[:5000]
+                self.live_offset += 5000
+            self.live_event.set()
+            self.live_event.clear()
+
+    async def handle(self, request: Request) -> Response:
+        body = await request.body()
+        if self.args.latency_ms or self.args.jitter_ms:
+            await asyncio.sleep((self.args.latency_ms + random.uniform(0, self.args.jitter_ms)) / 1000)
+        if random.random() < self.args.http_error_rate:
+            self.stats["injected_errors"] += 1
+            return Response(status_code=self.args.http_error_status)
+        if random.random() < self.args.biz_error_rate:
+            self.stats["injected_errors"] += 1
+            return self._frame(code=self.args.biz_error_code, message="模拟错误")
+
+        frame = feishu_im_pb2.Frame()
+        frame.ParseFromString(body)
+        biz_request = feishu_im_pb2.BizRequest()
+        biz_request.ParseFromString(frame.payload)
+        history_request = feishu_im_pb2.GetMessagesRequest()
+        history_request.ParseFromString(biz_request.payload)
+
+        if history_request.chat_id:
+            self.stats["history"] += 1
+            return self._frame(payload=self.history_page(history_request))
+        self.stats["stream"] += 1
+        return self._frame(payload=await self.stream_poll(request.headers.get("cookie", "")))
+
+
+def build_app(args: argparse.Namespace) -> FastAPI:
+    simulator = GatewaySimulator(args)
+    app = FastAPI(title="飞书网关模拟器")
+
+    @app.on_event("startup")
+    async def start_producer():
+        app.state.producer = asyncio.create_task(simulator.produce_live())
+
+    @app.post("/im/gateway/")
+    async def gateway(request: Request):
+        return await simulator.handle(request)
+
+    @app.get("/sim/stats")
+    async def sim_stats():
+        return {**simulator.stats, "chat_ids": simulator.chat_ids, "live_buffer": len(simulator.live)}
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地飞书网关模拟器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--chats", type=int, default=4, help="模拟的会话数量")
+    parser.add_argument("--messages-per-chat", type=int, default=100000, help="每个会话的历史消息条数")
+    parser.add_argument("--max-page-size", type=int, default=200, help="单页最多返回的消息条数")
+    parser.add_argument("--text-size", type=int, default=64, help="每条消息额外的文本长度 (字节)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="每个请求的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="在固定延迟之上叠加的随机延迟上限")
+    parser.add_argument("--stream-rate", type=float, default=20, help="实时消息产生速率 (条/秒，所有会话合计)")
+    parser.add_argument("--poll-timeout", type=float, default=25, help="长轮询无新消息时的挂起时间 (秒)")
+    parser.add_argument("--biz-error-rate", type=float, default=0, help="返回非零 BizResponse.code 的概率")
+    parser.add_argument("--biz-error-code", type=int, default=500)
+    parser.add_argument("--http-error-rate", type=float, default=0, help="直接返回 HTTP 错误的概率")
+    parser.add_argument("--http-error-status", type=int, default=503)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning")
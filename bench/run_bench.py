@@ -0,0 +1,266 @@
+# bench/run_bench.py - 基于本地网关模拟器的端到端压测
+"""
+依次启动 gateway_sim.py 与 app/main.py (均为子进程)，然后运行三个场景:
+  history  — 并发请求 /api/v1/chat/messages，统计单次请求延迟与吞吐
+  export   — 通过 /api/v1/chat/export_stream 导出 N 条消息，统计每轮耗时与消息吞吐
+  ws       — M 个 WebSocket 客户端订阅实时消息，统计消息从模拟网关产生到客户端收到的延迟
+每个场景结束后记录服务进程的 RSS 与峰值 RSS。结果打印为表格，可用 --json 另存以便对比回归。
+
+用法 (在仓库根目录):
+    python bench/run_bench.py
+    python bench/run_bench.py --scenarios history,ws --ws-clients 200 --sim-args="--latency-ms 30"
+    python bench/run_bench.py --app-env HISTORY_CACHE_SIZE=0 --json before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = REPO_ROOT / "app"
+API_KEY = "bench"
+HISTORY_CMD = "1001"
+STREAM_CMD = "2002"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    return {
+        "samples": len(samples_ms),
+        "p50_ms": round(percentile(samples_ms, 50), 2),
+        "p99_ms": round(percentile(samples_ms, 99), 2),
+        "max_ms": round(max(samples_ms), 2) if samples_ms else 0.0,
+    }
+
+
+def process_memory(pid: int) -> Dict[str, Optional[float]]:
+    """读取 /proc/<pid>/status 中的 VmRSS / VmHWM (MiB)。非 Linux 平台返回 None。"""
+    memory: Dict[str, Optional[float]] = {"rss_mib": None, "peak_rss_mib": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_mib"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss_mib"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"等待 {url} 就绪超时")
+
+
+class BenchEnvironment:
+    """管理模拟网关与被测服务两个子进程的生命周期。"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.sim_port = free_port()
+        self.app_port = free_port()
+        self.workdir = tempfile.TemporaryDirectory(prefix="feishu-bench-")
+        self.processes: List[subprocess.Popen] = []
+
+    @property
+    def app_url(self) -> str:
+        return f"http://127.0.0.1:{self.app_port}"
+
+    @property
+    def sim_url(self) -> str:
+        return f"http://127.0.0.1:{self.sim_port}"
+
+    def app_env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "FEISHU_BASE_URL": self.sim_url,
+            "API_MASTER_KEY": API_KEY,
+            "FEISHU_AUTH_JSON": json.dumps({
+                "cookie": "session=bench", "cmd_history": HISTORY_CMD, "cmd_stream": STREAM_CMD, "web_version": "bench",
+            }),
+            "MESSAGE_STORE_PATH": os.path.join(self.workdir.name, "messages.db"),
+            "EXPORT_JOBS_DIR": os.path.join(self.workdir.name, "export_jobs"),
+        })
+        if not self.args.keep_limits:
+            # 压测测的是本服务自身的开销，默认关闭上游令牌桶
+            env.update({"UPSTREAM_HISTORY_RATE": "0", "UPSTREAM_STREAM_RATE": "0"})
+        for item in self.args.app_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        return env
+
+    async def __aenter__(self) -> "BenchEnvironment":
+        sim_cmd = [sys.executable, str(REPO_ROOT / "bench" / "gateway_sim.py"), "--port", str(self.sim_port)]
+        sim_cmd += shlex.split(self.args.sim_args)
+        self.processes.append(subprocess.Popen(sim_cmd))
+        await wait_ready(f"{self.sim_url}/sim/stats")
+
+        app_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.app_port), "--log-level", "warning"]
+        self.app_process = subprocess.Popen(
+            app_cmd, cwd=APP_DIR, env=self.app_env(),
+            stdout=None if self.args.verbose else subprocess.DEVNULL,
+        )
+        self.processes.append(self.app_process)
+        await wait_ready(f"{self.app_url}/api/v1/config")
+        async with httpx.AsyncClient() as client:
+            self.chat_ids = (await client.get(f"{self.sim_url}/sim/stats")).json()["chat_ids"]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.workdir.cleanup()
+
+
+async def bench_history(env: BenchEnvironment, args: argparse.Namespace) -> Dict:
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(args.history_requests):
+        # 一半请求最新一页，一半随机请求更早的分页，覆盖缓存命中与未命中两条路径
+        cursor = "0" if random.random() < 0.5 else str(random.randrange(args.page_size, args.history_depth))
+        queue.put_nowait({"chat_id": random.choice(env.chat_ids), "count": args.page_size, "cursor": cursor})
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while not queue.empty():
+            params = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.post(f"{env.app_url}/api/v1/chat/messages", params=params, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return {**summarize(latencies), "errors": errors, "requests_per_sec": round(len(latencies) / elapsed, 1)}
+
+
+async def bench_export(env: BenchEnvironment, args: argparse.Namespace) -> Dict:
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    durations: List[float] = []
+    exported = 0
+    async with httpx.AsyncClient(timeout=None) as client:
+        for run in range(args.export_runs):
+            params = {"chat_id": env.chat_ids[run % len(env.chat_ids)], "count": args.export_messages, "format": "ndjson"}
+            started = time.perf_counter()
+            lines = 0
+            async with client.stream("POST", f"{env.app_url}/api/v1/chat/export_stream", params=params, headers=headers) as response:
+                async for _ in response.aiter_lines():
+                    lines += 1
+            durations.append((time.perf_counter() - started) * 1000)
+            exported += lines
+    total_seconds = sum(durations) / 1000
+    return {**summarize(durations), "messages": exported, "messages_per_sec": round(exported / total_seconds, 1) if total_seconds else 0.0}
+
+
+async def bench_websocket(env: BenchEnvironment, args: argparse.Namespace) -> Dict:
+    latencies: List[float] = []
+    received = 0
+    ws_base = env.app_url.replace("http://", "ws://")
+
+    async def client(index: int, connected: asyncio.Event):
+        nonlocal received
+        chat_id = env.chat_ids[index % len(env.chat_ids)]
+        async with websockets.connect(f"{ws_base}/ws/v1/chat/stream/{chat_id}?token={API_KEY}", max_size=None) as ws:
+            connected.set()
+            async for frame in ws:
+                latencies.append(time.time() * 1000 - json.loads(frame)["create_time"])
+                received += 1
+
+    events = [asyncio.Event() for _ in range(args.ws_clients)]
+    tasks = [asyncio.create_task(client(i, event)) for i, event in enumerate(events)]
+    await asyncio.gather(*(event.wait() for event in events))
+    await asyncio.sleep(args.ws_seconds)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {**summarize(latencies), "clients": args.ws_clients, "messages_per_sec": round(received / args.ws_seconds, 1)}
+
+
+SCENARIOS = {"history": bench_history, "export": bench_export, "ws": bench_websocket}
+
+
+def print_report(results: Dict[str, Dict]):
+    for name, result in results.items():
+        print(f"\n[{name}]")
+        for key, value in result.items():
+            print(f"  {key:<18} {value}")
+
+
+async def main(args: argparse.Namespace):
+    results: Dict[str, Dict] = {}
+    async with BenchEnvironment(args) as env:
+        for name in args.scenarios.split(","):
+            print(f"运行场景 {name} ...", file=sys.stderr)
+            result = await SCENARIOS[name](env, args)
+            result.update(process_memory(env.app_process.pid))
+            results[name] = result
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="飞书消息方舟端到端压测")
+    parser.add_argument("--scenarios", default="history,export,ws", help="逗号分隔: history, export, ws")
+    parser.add_argument("--history-requests", type=int, default=2000)
+    parser.add_argument("--history-depth", type=int, default=20000, help="随机分页请求的游标范围")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--export-messages", type=int, default=20000)
+    parser.add_argument("--export-runs", type=int, default=3)
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--ws-seconds", type=float, default=10)
+    parser.add_argument("--sim-args", default="", help="透传给 gateway_sim.py 的参数")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="覆盖被测服务的环境变量，可重复")
+    parser.add_argument("--keep-limits", action="store_true", help="保留上游令牌桶限流 (默认关闭)")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示被测服务的日志输出")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,123 @@
+# bench/startup_profile.py - 冷启动剖析: 导入耗时、进程就绪时间与首个请求延迟
+"""
+两部分:
+  imports  — 以 python -X importtime 导入 app/main.py，按顶层包汇总导入耗时并列出最慢的几个
+  startup  — 启动 gateway_sim.py 后多次冷启动被测服务，统计从创建进程到 /api/v1/config 可用的时间，
+             以及第一、第二个历史消息请求的延迟 (首个请求包含创建上游客户端、TLS 上下文等懒加载开销)
+
+用法 (在仓库根目录):
+    python bench/startup_profile.py
+    python bench/startup_profile.py --runs 5 --top 30 --json startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+from run_bench import API_KEY, APP_DIR, BenchEnvironment, print_report, summarize, wait_ready
+
+
+def profile_imports(top: int) -> Tuple[float, List[Tuple[str, float]]]:
+    """返回 import main 的总耗时 (ms) 与导入耗时最高的 top 个顶层包 (包内所有模块自身耗时之和)。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=APP_DIR, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"), capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import main 失败:\n{result.stderr}")
+    packages: Dict[str, float] = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        # 格式: "import time: self [us] | cumulative | imported package"，缩进表示嵌套层级
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        top_level = name.split(".")[0]
+        packages[top_level] = packages.get(top_level, 0.0) + int(self_us) / 1000
+        if name == "main":
+            total = int(cumulative) / 1000
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return total, ranked[:top]
+
+
+class StartupEnvironment(BenchEnvironment):
+    """只启动模拟网关；被测服务由 cold_start 反复启动。"""
+
+    async def __aenter__(self) -> "StartupEnvironment":
+        await self.start_simulator()
+        return self
+
+    async def start_simulator(self):
+        sim_cmd = [sys.executable, str(APP_DIR.parent / "bench" / "gateway_sim.py"), "--port", str(self.sim_port)]
+        self.processes.append(subprocess.Popen(sim_cmd))
+        await wait_ready(f"{self.sim_url}/sim/stats")
+        async with httpx.AsyncClient() as client:
+            self.chat_ids = (await client.get(f"{self.sim_url}/sim/stats")).json()["chat_ids"]
+
+    async def cold_start(self) -> Dict[str, float]:
+        app_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.app_port), "--log-level", "warning"]
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            app_cmd, cwd=APP_DIR, env=self.app_env(),
+            stdout=None if self.args.verbose else subprocess.DEVNULL,
+        )
+        try:
+            await wait_ready(f"{self.app_url}/api/v1/config")
+            ready_ms = (time.perf_counter() - started) * 1000
+            headers = {"Authorization": f"Bearer {API_KEY}"}
+            params = {"chat_id": self.chat_ids[0], "count": 50}
+            requests_ms = []
+            async with httpx.AsyncClient(timeout=30) as client:
+                for _ in range(2):
+                    request_started = time.perf_counter()
+                    response = await client.post(f"{self.app_url}/api/v1/chat/messages", params=params, headers=headers)
+                    response.raise_for_status()
+                    requests_ms.append((time.perf_counter() - request_started) * 1000)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        return {"ready_ms": ready_ms, "first_request_ms": requests_ms[0], "second_request_ms": requests_ms[1]}
+
+
+async def main(args: argparse.Namespace):
+    results: Dict[str, Dict] = {}
+    total, ranked = profile_imports(args.top)
+    results["imports"] = {"import_main_ms": round(total, 1), **{name: round(ms, 1) for name, ms in ranked}}
+
+    samples: Dict[str, List[float]] = {"ready_ms": [], "first_request_ms": [], "second_request_ms": []}
+    async with StartupEnvironment(args) as env:
+        for run in range(args.runs):
+            print(f"冷启动 {run + 1}/{args.runs} ...", file=sys.stderr)
+            for key, value in (await env.cold_start()).items():
+                samples[key].append(value)
+    for key, values in samples.items():
+        results[key] = summarize(values)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="飞书消息方舟冷启动剖析")
+    parser.add_argument("--runs", type=int, default=3, help="冷启动次数")
+    parser.add_argument("--top", type=int, default=20, help="列出导入耗时最高的顶层模块数")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="覆盖被测服务的环境变量，可重复")
+    parser.add_argument("--keep-limits", action="store_true", help="保留上游令牌桶限流 (默认关闭)")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示被测服务的日志输出")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,91 +1,294 @@
-# get_cookie.py (v8.0 - 智能区分Command ID版)
+# get_cookie.py (v9.0 - 流式分析 + HAR 离线模式)
+"""
+两种模式:
+  交互捕获 (默认) — 打开浏览器，扫码登录并进入群聊后按 Ctrl+C，结果复制到剪贴板。
+                    加 --record-har PATH 可同时把网络记录保存为 HAR，之后可离线重新分析。
+  离线分析 (--har) — 不启动浏览器，直接分析已录制的 HAR 文件 (需包含响应内容与 Cookie)。
+                    可一次传入多个 HAR 并行分析，适合无人值守地为多个账号刷新认证信息。
+
+每个请求/响应到达时立即提取 Header、Command ID 与 Chat ID，不在内存中保留响应体；
+网关响应按 Frame → BizResponse → 消息列表解码，从中确认 Chat ID 以及历史/实时两个 Command ID。
+
+用法:
+    python get_cookie.py
+    python get_cookie.py --record-har session.har
+    python get_cookie.py --har session.har --output data/auth.json
+    python get_cookie.py --har accounts/*.har --output auth/ --jobs 4
+"""
+import argparse
 import asyncio
-from playwright.async_api import async_playwright, Page, BrowserContext, Error as PlaywrightError
-import os
-import sys
+import base64
 import json
+import os
 import re
 import shutil
-
-try:
-    import pyperclip
-except ImportError:
-    print("\n[错误] pyperclip 模块未安装。请运行: pip install pyperclip")
-    sys.exit(1)
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
 # --- 配置 ---
 USER_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "playwright_user_data")
-
-# --- 全局状态 ---
-captured_data = {
-    "cookie": "尚未捕获",
-    "user_agent": "尚未捕获",
-    "referer": "尚未捕获",
-    "csrf_token": "尚未捕获",
-    "lgw_csrf_token": "尚未捕获",
-    "web_version": "尚未捕获",
-    "cmd_history": "尚未捕获",
-    "cmd_stream": "尚未捕获", # 明确区分
-    "example_chat_id": "尚未捕获",
+PENDING = "尚未捕获"
+REQUIRED_KEYS = ("cookie", "example_chat_id", "cmd_history", "cmd_stream")
+# 每类 Chat ID 候选最多保留的个数 (按最近出现排序)
+MAX_CHAT_ID_CANDIDATES = 32
+CHAT_ID_PATTERN = re.compile(rb'(oc_[a-zA-Z0-9]{32})|(om_[a-zA-Z0-9]{32})|(?<=[\\"\'`])(7[0-9]{18})(?=[\\"\'`])')
+# 解码出的消息中的 chat_id 是完整字段值，不需要引号定界
+MESSAGE_CHAT_ID_PATTERN = re.compile(rb'oc_[a-zA-Z0-9]{32}|7[0-9]{18}')
+# 静态资源不含业务数据，不扫描 (体积最大的 JS 包也在其中)
+STATIC_RESOURCE_TYPES = {"script", "stylesheet", "image", "font", "media", "manifest", "texttrack"}
+HEADERS_TO_CAPTURE = {
+    'user-agent': 'user_agent', 'referer': 'referer', 'x-csrf-token': 'csrf_token',
+    'x-lgw-csrf-token': 'lgw_csrf_token', 'x-web-version': 'web_version'
 }
+CAPTURE_KEYS = (
+    "cookie", "user_agent", "referer", "csrf_token", "lgw_csrf_token",
+    "web_version", "cmd_history", "cmd_stream", "example_chat_id",
+)
 
-# 用于存储所有可能包含Chat ID的响应体
-response_bodies = []
-# 用于记录所有捕获到的 gateway command
-gateway_commands = set()
 
 def print_separator(char='-'):
     print(char * 100)
 
-async def handle_response(response):
-    """记录所有来自飞书API的响应体"""
-    if "feishu.cn" in response.url:
-        try:
-            body = await response.body()
-            if body:
-                response_bodies.append(body)
-        except (PlaywrightError, Exception):
-            pass
 
-async def handle_route(route):
-    """捕获Header信息和Command ID"""
-    request = route.request
+# --- 网关帧解码 ---
+# 与 app/core/wire.py 的字段遍历相同。本脚本在宿主机上独立运行，不依赖 app/ 与生成的 pb2 文件。
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise ValueError("protobuf varint 过长")
+
+
+def iter_fields(buf: bytes) -> Iterator[Tuple[int, int, object]]:
+    """逐个产出 (字段号, wire 类型, 值)。不是合法的 protobuf 时抛出 ValueError / IndexError。"""
+    pos, end = 0, len(buf)
+    while pos < end:
+        tag, pos = _read_varint(buf, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+        if field_number == 0:
+            raise ValueError("protobuf 字段号为 0")
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            if pos + length > end:
+                raise ValueError("protobuf 字段长度越界")
+            value, pos = buf[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"不支持的 protobuf wire 类型: {wire_type}")
+        yield field_number, wire_type, value
+
+
+def _length_delimited(buf: bytes, field_number: int) -> Optional[bytes]:
+    value = None
+    for number, wire_type, field_value in iter_fields(buf):
+        if number == field_number and wire_type == 2:
+            value = field_value
+    return value
+
+
+def decode_gateway_frame(body: bytes) -> Optional[Tuple[int, bytes]]:
+    """解开 Frame (payload = 5) 与 BizResponse (code = 1, payload = 15)，返回 (code, 业务负载)；不是网关帧时返回 None。"""
     try:
-        headers = await request.all_headers()
-        
-        if headers.get('cookie') and len(headers['cookie']) > len(captured_data.get("cookie", "")):
-            captured_data["cookie"] = headers['cookie']
-
-        headers_to_capture = {
-            'user-agent': 'user_agent', 'referer': 'referer', 'x-csrf-token': 'csrf_token',
-            'x-lgw-csrf-token': 'lgw_csrf_token', 'x-web-version': 'web_version'
-        }
-        for header_key, data_key in headers_to_capture.items():
-            if headers.get(header_key) and "尚未" in str(captured_data.get(data_key)):
-                captured_data[data_key] = headers[header_key]
-
-        # --- 核心修正：智能区分 Command ID ---
-        if "/im/gateway/" in request.url:
+        frame_payload = _length_delimited(body, 5)
+        if frame_payload is None:
+            return None
+        code, payload = 0, b""
+        for number, wire_type, value in iter_fields(frame_payload):
+            if number == 1 and wire_type == 0:
+                code = value - (1 << 64) if value >= 1 << 63 else value
+            elif number == 15 and wire_type == 2:
+                payload = value
+        return code, payload
+    except (ValueError, IndexError):
+        return None
+
+
+def decode_message_list(payload: bytes) -> Tuple[List[str], bool]:
+    """
+    按 GetMessagesResponse / StreamResponse (字段 1 为消息列表) 解析业务负载，返回消息的 chat_id 列表，
+    以及是否带分页信息 (has_more = 2 / next_cursor = 3，即历史消息页)。
+    字段 1 中有任何一项不像 Message (chat_id = 2) 时视为其他命令的负载，返回空列表。
+    """
+    chat_ids: List[str] = []
+    paged = False
+    try:
+        for number, wire_type, value in iter_fields(payload):
+            if number == 1:
+                if wire_type != 2:
+                    return [], False
+                chat_id = _length_delimited(value, 2)
+                if chat_id is None or not MESSAGE_CHAT_ID_PATTERN.fullmatch(chat_id):
+                    return [], False
+                chat_ids.append(chat_id.decode("ascii"))
+            elif number in (2, 3):
+                paged = True
+    except (ValueError, IndexError):
+        return [], False
+    return chat_ids, paged
+
+
+# --- 流式分析 ---
+
+def _remember(candidates: "OrderedDict[str, None]", value: str):
+    candidates.pop(value, None)
+    candidates[value] = None
+    while len(candidates) > MAX_CHAT_ID_CANDIDATES:
+        candidates.popitem(last=False)
+
+
+class CaptureAnalyzer:
+    """
+    边捕获边分析，只保留有界的候选集合。Chat ID 取最后出现的一个: 从网关帧解码出的消息 chat_id 优先，
+    其次是响应体中的正则匹配。Command ID 优先采用解码结果 (带分页信息的消息列表为历史消息，否则为实时消息)，
+    其次按请求是否带 post_data 推断。
+    """
+
+    def __init__(self):
+        self.data: Dict[str, str] = {key: PENDING for key in CAPTURE_KEYS}
+        self.gateway_commands = set()
+        self.decoded_commands: Dict[str, str] = {}
+        self.message_chat_ids: "OrderedDict[str, None]" = OrderedDict()
+        self.body_chat_ids: "OrderedDict[str, None]" = OrderedDict()
+        self.responses_scanned = 0
+        self.bytes_scanned = 0
+
+    def on_request(self, url: str, headers: Dict[str, str], has_body: bool):
+        """捕获Header信息和Command ID"""
+        cookie = headers.get('cookie')
+        if cookie and (self.data["cookie"] == PENDING or len(cookie) > len(self.data["cookie"])):
+            self.data["cookie"] = cookie
+
+        for header_key, data_key in HEADERS_TO_CAPTURE.items():
+            if headers.get(header_key) and self.data[data_key] == PENDING:
+                self.data[data_key] = headers[header_key]
+
+        # 智能区分 Command ID
+        if "/im/gateway/" in url:
             command_id = headers.get('x-command')
             if command_id:
-                gateway_commands.add(command_id)
+                self.gateway_commands.add(command_id)
                 # 通常，有 post_data 的是拉取历史记录的请求
-                if request.post_data_buffer and "尚未" in captured_data["cmd_history"]:
-                    captured_data["cmd_history"] = command_id
+                if has_body and self.data["cmd_history"] == PENDING:
+                    self.data["cmd_history"] = command_id
                 # 通常，没有 post_data 的是建立长连接、监听实时消息的请求
-                elif not request.post_data_buffer and "尚未" in captured_data["cmd_stream"]:
-                    captured_data["cmd_stream"] = command_id
-        
-        await route.continue_()
-    except (PlaywrightError, Exception):
-        if not route.is_handled():
-            try:
-                await route.abort()
-            except PlaywrightError:
-                pass
-
-async def run_browser_tasks():
-    """运行浏览器并记录所有网络活动"""
+                elif not has_body and self.data["cmd_stream"] == PENDING:
+                    self.data["cmd_stream"] = command_id
+
+    def on_response(self, url: str, request_headers: Dict[str, str], body: bytes):
+        """扫描一个响应体后即丢弃。"""
+        if not body:
+            return
+        self.responses_scanned += 1
+        self.bytes_scanned += len(body)
+
+        if "/im/gateway/" in url:
+            frame = decode_gateway_frame(body)
+            if frame is not None and frame[0] == 0:
+                chat_ids, paged = decode_message_list(frame[1])
+                if chat_ids:
+                    for chat_id in chat_ids:
+                        _remember(self.message_chat_ids, chat_id)
+                    command_id = request_headers.get('x-command')
+                    if command_id:
+                        self.decoded_commands["cmd_history" if paged else "cmd_stream"] = command_id
+                    return
+
+        # 每个响应体只取第一个匹配，最后一个有匹配的响应体即为最后操作的会话
+        match = CHAT_ID_PATTERN.search(body)
+        if match:
+            chat_id_bytes = match.group(1) or match.group(2) or match.group(3)
+            _remember(self.body_chat_ids, chat_id_bytes.decode('utf-8'))
+
+    def finalize(self) -> Dict[str, str]:
+        """汇总候选，返回已捕获的字段。"""
+        self.data.update(self.decoded_commands)
+
+        # 如果智能区分失败，进行补救
+        if self.data["cmd_history"] == PENDING and self.gateway_commands:
+            self.data["cmd_history"] = sorted(self.gateway_commands)[0]
+        if self.data["cmd_stream"] == PENDING and self.gateway_commands:
+            # 如果只有一个，就都用它；如果有多个，通常 stream 的 ID 更大
+            self.data["cmd_stream"] = sorted(self.gateway_commands)[-1]
+
+        for candidates in (self.message_chat_ids, self.body_chat_ids):
+            if candidates:
+                self.data["example_chat_id"] = next(reversed(candidates))
+                break
+        return {k: v for k, v in self.data.items() if v != PENDING}
+
+
+def print_report(analyzer: CaptureAnalyzer, final_data: Dict[str, str], title: str = "最终捕获信息总览"):
+    print_separator('📊')
+    print(f"📊 [{title}] 已扫描 {analyzer.responses_scanned} 个响应 ({analyzer.bytes_scanned / 1024 / 1024:.1f} MiB)")
+    for key, value in analyzer.data.items():
+        status = "✅" if key in final_data else "❌"
+        display_value = str(value)
+        if len(display_value) > 70:
+            display_value = display_value[:67] + "..."
+        print(f"  {status} {key:<20}: {display_value}")
+    print_separator('📊')
+
+
+def is_complete(final_data: Dict[str, str]) -> bool:
+    return all(key in final_data for key in REQUIRED_KEYS)
+
+
+def write_auth_file(path: str, data: Dict[str, str]):
+    """原子写入，权限 0600。写到服务的 FEISHU_AUTH_FILE 时，服务会自动热更新认证信息。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# --- 交互捕获 ---
+
+async def run_browser_tasks(analyzer: CaptureAnalyzer, record_har: Optional[str] = None):
+    """运行浏览器，网络活动到达时即交给 analyzer 分析"""
+    from playwright.async_api import async_playwright, BrowserContext, Error as PlaywrightError
+
+    async def handle_response(response):
+        if "feishu.cn" not in response.url or response.request.resource_type in STATIC_RESOURCE_TYPES:
+            return
+        try:
+            body = await response.body()
+            request_headers = await response.request.all_headers()
+        except (PlaywrightError, Exception):
+            return
+        analyzer.on_response(response.url, request_headers, body)
+
+    async def handle_route(route):
+        request = route.request
+        try:
+            headers = await request.all_headers()
+            analyzer.on_request(request.url, headers, bool(request.post_data_buffer))
+            await route.continue_()
+        except (PlaywrightError, Exception):
+            if not route.is_handled():
+                try:
+                    await route.abort()
+                except PlaywrightError:
+                    pass
+
     async with async_playwright() as p:
         context: BrowserContext = None
         try:
@@ -94,15 +297,20 @@ async def run_browser_tasks():
                 shutil.rmtree(USER_DATA_DIR, ignore_errors=True)
                 print(">>> 已清理旧的浏览器会话数据。")
 
+            options = {}
+            if record_har:
+                # HAR 在关闭浏览器时写入，包含 Cookie，请妥善保管
+                options = {"record_har_path": record_har, "record_har_content": "embed"}
             context = await p.chromium.launch_persistent_context(
                 user_data_dir=USER_DATA_DIR,
                 headless=False,
                 args=['--start-maximized'],
                 no_viewport=True,
+                **options,
             )
-            
+
             page = context.pages[0] if context.pages else await context.new_page()
-            
+
             print(">>> 正在设置网络记录器...")
             page.on("response", handle_response)
             await page.route("**/*", handle_route)
@@ -122,60 +330,41 @@ async def run_browser_tasks():
             await asyncio.Event().wait()
 
         except (asyncio.CancelledError, KeyboardInterrupt):
-             print("\n[信息] 检测到手动中断 (Ctrl+C)，即将开始分析数据...")
+            print("\n[信息] 检测到手动中断 (Ctrl+C)，正在汇总分析结果...")
         except PlaywrightError as e:
             if "Target page, context or browser has been closed" not in str(e):
-                 print(f"\n❌ 浏览器操作期间发生错误: {e}")
+                print(f"\n❌ 浏览器操作期间发生错误: {e}")
         finally:
-            if context and not context.is_closed():
-                await context.close()
-
-def analyze_and_finalize():
-    """在所有记录的数据中分析并提取最终信息"""
-    print("\n>>> 正在分析已记录的网络数据...")
-    
-    # 如果智能区分失败，进行补救
-    if "尚未" in captured_data["cmd_history"] and len(gateway_commands) > 0:
-        captured_data["cmd_history"] = sorted(list(gateway_commands))[0]
-    if "尚未" in captured_data["cmd_stream"] and len(gateway_commands) > 0:
-        # 如果只有一个，就都用它
-        if len(gateway_commands) == 1:
-            captured_data["cmd_stream"] = list(gateway_commands)[0]
-        # 如果有多个，通常 stream 的 ID 更大
-        else:
-            captured_data["cmd_stream"] = sorted(list(gateway_commands))[-1]
+            if context:
+                try:
+                    await context.close()
+                except PlaywrightError:
+                    pass
+                if record_har and os.path.isfile(record_har):
+                    print(f">>> 网络记录已保存到 {record_har} (包含 Cookie，请勿分享)。")
 
-    # 从后往前分析，找到最后一个出现的Chat ID
-    for body in reversed(response_bodies):
-        match = re.search(b'(oc_[a-zA-Z0-9]{32})|(om_[a-zA-Z0-9]{32})|(?<=[\\\\"\'`])(7[0-9]{18})(?=[\\\\"\'`])', body)
-        if match:
-            chat_id_bytes = match.group(1) or match.group(2) or match.group(3)
-            if chat_id_bytes:
-                chat_id = chat_id_bytes.decode('utf-8')
-                captured_data["example_chat_id"] = chat_id
-                print(f"✅ [分析成功] 已找到您最后操作的 Chat ID: {chat_id}")
-                break
-    
-    final_data = {k: v for k, v in captured_data.items() if "尚未" not in str(v)}
-    
-    print_separator('📊')
-    print("📊 [最终捕获信息总览]")
-    for key, value in captured_data.items():
-        status = "✅" if key in final_data else "❌"
-        display_value = str(value)
-        if len(display_value) > 70:
-            display_value = display_value[:67] + "..."
-        print(f"  {status} {key:<20}: {display_value}")
-    print_separator('📊')
 
-    if "cookie" in final_data and "example_chat_id" in final_data and "cmd_history" in final_data and "cmd_stream" in final_data:
+def finalize_interactive(analyzer: CaptureAnalyzer, output: Optional[str]):
+    """汇总交互捕获的结果，复制到剪贴板并清理临时文件"""
+    final_data = analyzer.finalize()
+    if "example_chat_id" in final_data:
+        print(f"✅ [分析成功] 已找到您最后操作的 Chat ID: {final_data['example_chat_id']}")
+    print_report(analyzer, final_data)
+
+    if is_complete(final_data):
         output_json = json.dumps(final_data, indent=2, ensure_ascii=False)
         try:
+            import pyperclip
             pyperclip.copy(output_json)
             print("\n✅ 认证信息 JSON 已自动复制到您的剪贴板！")
+        except ImportError:
+            print("\n⚠️ pyperclip 模块未安装，无法自动复制。请运行: pip install pyperclip")
         except Exception as e:
             print(f"\n⚠️ 自动复制到剪贴板失败: {e}")
-        
+        if output:
+            write_auth_file(output, final_data)
+            print(f"✅ 认证信息已写入 {output}")
+
         print("\n--- 请将下方完整内容粘贴到 Web UI 的【飞书认证信息】输入框中 ---")
         print(output_json)
         print("---")
@@ -186,13 +375,110 @@ def analyze_and_finalize():
     if os.path.exists(USER_DATA_DIR):
         shutil.rmtree(USER_DATA_DIR, ignore_errors=True)
         print(f"\n✅ 已自动清理临时文件夹: {USER_DATA_DIR}")
-    
-    input("\n按 Enter 键退出...")
 
-if __name__ == "__main__":
+    if sys.stdin.isatty():
+        input("\n按 Enter 键退出...")
+
+
+# --- 离线分析 ---
+
+def _har_body(content: Dict) -> bytes:
+    text = content.get("text")
+    if not text:
+        return b""
+    if content.get("encoding") == "base64":
+        return base64.b64decode(text)
+    return text.encode("utf-8")
+
+
+def analyze_har(path: str) -> Tuple[CaptureAnalyzer, Dict[str, str]]:
+    """按记录顺序把 HAR 中的每个请求/响应交给 analyzer，返回 analyzer 与已捕获的字段。"""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f).get("log", {}).get("entries", [])
+    analyzer = CaptureAnalyzer()
+    # 逆序后从尾部弹出，已分析的条目 (含响应内容) 随即释放
+    entries.reverse()
+    while entries:
+        entry = entries.pop()
+        request = entry.get("request", {})
+        url = request.get("url", "")
+        if "feishu.cn" not in url:
+            continue
+        headers = {h["name"].lower(): h["value"] for h in request.get("headers", [])}
+        # 部分浏览器导出的 HAR 只在 cookies 字段中保留 Cookie
+        if "cookie" not in headers and request.get("cookies"):
+            headers["cookie"] = "; ".join(f"{c['name']}={c['value']}" for c in request["cookies"])
+        analyzer.on_request(url, headers, bool(request.get("postData")))
+        if entry.get("_resourceType") in STATIC_RESOURCE_TYPES:
+            continue
+        analyzer.on_response(url, headers, _har_body(entry.get("response", {}).get("content", {})))
+    return analyzer, analyzer.finalize()
+
+
+def _analyze_har_job(path: str) -> Tuple[str, Optional[CaptureAnalyzer], Dict[str, str], str]:
     try:
-        asyncio.run(run_browser_tasks())
+        analyzer, final_data = analyze_har(path)
+    except (OSError, ValueError) as e:
+        return path, None, {}, str(e)
+    return path, analyzer, final_data, ""
+
+
+def _save_har_result(result: Tuple[str, Optional[CaptureAnalyzer], Dict[str, str], str], output: Optional[str], to_directory: bool) -> bool:
+    """输出一个 HAR 文件的分析结果，返回是否捕获完整。"""
+    path, analyzer, final_data, error = result
+    if analyzer is None:
+        print(f"❌ [{path}] 无法读取 HAR 文件: {error}")
+        return False
+    print_report(analyzer, final_data, title=path)
+    if not is_complete(final_data):
+        missing = ", ".join(key for key in REQUIRED_KEYS if key not in final_data)
+        print(f"❌ [{path}] 未能捕获到足够的核心信息，缺少: {missing}")
+        return False
+    if output is None:
+        print(json.dumps(final_data, indent=2, ensure_ascii=False))
+        return True
+    target = output
+    if to_directory:
+        target = os.path.join(output, os.path.splitext(os.path.basename(path))[0] + ".json")
+    write_auth_file(target, final_data)
+    print(f"✅ [{path}] 认证信息已写入 {target}")
+    return True
+
+
+def run_har_analysis(paths: List[str], output: Optional[str], jobs: int) -> int:
+    """分析一个或多个 HAR 文件，返回失败的文件数。多个文件时 output 为目录，每个文件写入 <文件名>.json。"""
+    to_directory = output is not None and (len(paths) > 1 or os.path.isdir(output))
+    workers = max(1, min(jobs, len(paths)))
+    if workers == 1:
+        return sum(not _save_har_result(result, output, to_directory) for result in map(_analyze_har_job, paths))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_analyze_har_job, paths)
+        return sum(not _save_har_result(result, output, to_directory) for result in results)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="捕获飞书网页版的认证信息 (Cookie、Command ID 与 Chat ID)")
+    parser.add_argument("--har", nargs="+", metavar="HAR", help="离线分析已录制的 HAR 文件 (不启动浏览器)，可传入多个")
+    parser.add_argument("--record-har", metavar="PATH", help="交互捕获时同时把网络记录保存为 HAR 文件")
+    parser.add_argument("--output", metavar="PATH", help="把结果写入 JSON 文件 (可指向服务的 FEISHU_AUTH_FILE)；传入多个 HAR 时为目录")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="并行分析的 HAR 文件数")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.har:
+        return 1 if run_har_analysis(args.har, args.output, args.jobs) else 0
+
+    analyzer = CaptureAnalyzer()
+    try:
+        asyncio.run(run_browser_tasks(analyzer, args.record_har))
     except (KeyboardInterrupt, asyncio.CancelledError):
         pass
     finally:
-        analyze_and_finalize()
+        finalize_interactive(analyzer, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
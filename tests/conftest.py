@@ -0,0 +1,30 @@
+# tests/conftest.py - 测试公共设置
+"""
+与 uvicorn 在 app/ 目录下启动时一样，把 app/ 加入导入路径 (core.*、feishu_im_pb2 等均为扁平导入)。
+异步测试使用 anyio 自带的 pytest 插件 (pytest.mark.anyio)；本服务只运行在 asyncio 上。
+
+运行 (在仓库根目录): python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import feishu_im_pb2  # noqa: E402
+
+BASE_TIME = 1_700_000_000_000
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def make_message(message_id: str, create_time: int, text: str = "", chat_id: str = "chat1", sender_id: str = "u1") -> feishu_im_pb2.Message:
+    return feishu_im_pb2.Message(
+        message_id=message_id, chat_id=chat_id, create_time=create_time,
+        sender=feishu_im_pb2.Sender(sender_id=sender_id, name="张三"),
+        text_content=feishu_im_pb2.TextContent(text=text),
+    )
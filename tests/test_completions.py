@@ -0,0 +1,29 @@
+# tests/test_completions.py - OpenAI 兼容接口的请求约定
+import pytest
+
+from core.completions import CompletionRequest
+
+
+def parse(body: dict) -> CompletionRequest:
+    return CompletionRequest(body, default_chat_id="default_chat", history_count=50, stream_timeout=300)
+
+
+@pytest.mark.parametrize("body, chat_id", [
+    ({"model": "feishu/oc_123"}, "oc_123"),
+    ({"model": "feishu", "messages": []}, "default_chat"),
+    ({}, "default_chat"),
+])
+def test_model_selects_chat(body, chat_id):
+    assert parse(body).chat_id == chat_id
+
+
+@pytest.mark.parametrize("body", [
+    {"model": "gpt-4o"},
+    {"model": 42},
+    {"model": "feishu/"},
+    {"model": "feishu/oc_123", "messages": [{"role": "user", "content": "你好"}]},
+    {"model": "feishu/oc_123", "messages": "你好"},
+])
+def test_rejects_requests_outside_the_read_only_contract(body):
+    with pytest.raises(ValueError):
+        parse(body)
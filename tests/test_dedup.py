@@ -0,0 +1,73 @@
+# tests/test_dedup.py - 实时流去重与重连后的补齐
+import pytest
+
+import feishu_im_pb2
+from conftest import BASE_TIME, make_message
+from core.dedup import SeenIndex, StreamDeduplicator
+from core.wire import HistoryPage
+
+pytestmark = pytest.mark.anyio
+
+T = BASE_TIME
+
+
+class FakeHistory:
+    """按时间倒序分页的历史消息，返回与 Provider.fetch_history_page 相同的惰性视图。"""
+
+    def __init__(self, messages):
+        self.messages = sorted(messages, key=lambda msg: msg.create_time, reverse=True)
+        self.requests = 0
+
+    async def fetch_page(self, chat_id: str, count: int, cursor: str) -> HistoryPage:
+        self.requests += 1
+        offset = int(cursor)
+        items = self.messages[offset:offset + count]
+        has_more = offset + count < len(self.messages)
+        response = feishu_im_pb2.GetMessagesResponse(items=items, has_more=has_more, next_cursor=str(offset + count))
+        return HistoryPage(response.SerializeToString())
+
+
+def ids(messages) -> list:
+    return [msg.message_id for msg in messages]
+
+
+def test_seen_index_evicts_oldest_ids():
+    seen = SeenIndex(capacity=2)
+    for message_id in ("a", "b", "a", "c"):
+        seen.add(message_id)
+    assert "a" not in seen and "b" in seen and "c" in seen and len(seen) == 2
+
+
+async def test_backfill_includes_out_of_order_messages_older_than_last_delivery():
+    dedup = StreamDeduplicator(capacity=100)
+    for msg in (make_message("m1", T), make_message("m3", T + 10_000)):
+        dedup.record(msg)
+    # m2 比最后投递的 m3 早，但断线前还没有到达；m4 是断线期间的新消息
+    history = FakeHistory([
+        make_message("old", T - 600_000),
+        make_message("m1", T), make_message("m2", T + 5_000),
+        make_message("m3", T + 10_000), make_message("m4", T + 20_000),
+    ])
+    missed, complete = await dedup.backfill(history.fetch_page, "chat1", max_messages=100, lookback_ms=60_000)
+    assert ids(missed) == ["m2", "m4"]
+    assert complete
+
+
+async def test_backfill_does_not_look_before_floor():
+    dedup = StreamDeduplicator(capacity=100)
+    history = FakeHistory([make_message(f"m{i}", T + i * 1000) for i in range(10)])
+    await dedup.seed(history.fetch_page, "chat1", count=3)
+    state = dedup.chat("chat1")
+    assert state.floor == T + 7000 and state.last_time == T + 9000
+    history.messages.insert(0, make_message("m10", T + 10_000))
+    missed, _ = await dedup.backfill(history.fetch_page, "chat1", max_messages=100, lookback_ms=60_000)
+    assert ids(missed) == ["m10"]
+
+
+async def test_backfill_reports_truncated_gap():
+    dedup = StreamDeduplicator(capacity=100)
+    dedup.record(make_message("m0", T))
+    history = FakeHistory([make_message(f"m{i}", T + i) for i in range(1, 30)])
+    missed, complete = await dedup.backfill(history.fetch_page, "chat1", max_messages=10, lookback_ms=60_000)
+    assert len(missed) == 10 and not complete
+    assert ids(missed)[-1] == "m29"
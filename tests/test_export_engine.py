@@ -0,0 +1,42 @@
+# tests/test_export_engine.py - 分页导出: 时间范围与输出顺序
+import json
+
+import pytest
+
+import feishu_im_pb2
+from conftest import BASE_TIME, make_message
+from core.export_engine import EXPORT_FORMAT_NDJSON, EXPORT_FORMAT_TEXT, EXPORT_ORDER_ASC, iter_history_pages, stream_export
+
+pytestmark = pytest.mark.anyio
+
+
+async def fetch_page(chat_id: str, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+    """10 条历史消息 m0..m9 (m9 最新)，每页最多 3 条。"""
+    messages = [make_message(f"m{i}", BASE_TIME + i * 1000, text=f"第{i}条") for i in reversed(range(10))]
+    offset = int(cursor)
+    end = offset + min(count, 3)
+    return feishu_im_pb2.GetMessagesResponse(items=messages[offset:end], has_more=end < len(messages), next_cursor=str(end))
+
+
+async def collect(**kwargs) -> bytes:
+    return b"".join([chunk async for chunk in stream_export(fetch_page, "chat1", max_messages=100, **kwargs)])
+
+
+async def test_text_export_is_chronological_by_default():
+    lines = (await collect(export_format=EXPORT_FORMAT_TEXT)).decode("utf-8").splitlines()
+    assert [line.rsplit(": ", 1)[1] for line in lines] == [f"第{i}条" for i in range(10)]
+
+
+async def test_ndjson_export_streams_newest_first_unless_asked():
+    newest_first = [json.loads(line)["message_id"] for line in (await collect(export_format=EXPORT_FORMAT_NDJSON)).splitlines()]
+    assert newest_first == [f"m{i}" for i in reversed(range(10))]
+    oldest_first = [json.loads(line)["message_id"] for line in (await collect(export_format=EXPORT_FORMAT_NDJSON, order=EXPORT_ORDER_ASC)).splitlines()]
+    assert oldest_first == [f"m{i}" for i in range(10)]
+
+
+async def test_start_time_bounds_pages_including_epoch_zero():
+    pages = [page async for page in iter_history_pages(fetch_page, "chat1", 100, start_time=BASE_TIME + 5000)]
+    assert [msg.message_id for page in pages for msg in page] == ["m9", "m8", "m7", "m6", "m5"]
+    # start_time=0 是合法的下限 (不是"未设置")，应覆盖全部消息
+    pages = [page async for page in iter_history_pages(fetch_page, "chat1", 100, start_time=0)]
+    assert sum(len(page) for page in pages) == 10
@@ -0,0 +1,151 @@
+# tests/test_export_jobs.py - 后台导出任务: 断点续传、凭证名额与过期清理
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+import anyio
+import pytest
+
+import feishu_im_pb2
+from conftest import BASE_TIME, make_message
+from core.export_engine import EXPORT_FORMAT_NDJSON
+from core.export_jobs import JOB_COMPLETED, JOB_FAILED, JOB_RUNNING, ExportJobManager
+
+pytestmark = pytest.mark.anyio
+
+# 三页历史 (新到旧)，cursor -> (消息 ID, 下一页 cursor)
+PAGES = {
+    "0": (["m6", "m5"], "c1"),
+    "c1": (["m4", "m3"], "c2"),
+    "c2": (["m2", "m1"], ""),
+}
+
+
+class FakeUpstream:
+    def __init__(self):
+        self.cursors = []
+        self.gates = {}  # chat_id 或 cursor -> 放行前需等待的事件
+        self.failing = set()  # 请求即失败的 chat_id
+
+    def gate(self, key: str) -> asyncio.Event:
+        self.gates[key] = asyncio.Event()
+        return self.gates[key]
+
+    async def fetch_page(self, chat_id: str, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+        self.cursors.append((chat_id, cursor))
+        if chat_id in self.failing:
+            raise RuntimeError("上游返回错误")
+        for key in (chat_id, cursor):
+            if key in self.gates:
+                await self.gates[key].wait()
+        ids, next_cursor = PAGES[cursor]
+        items = [make_message(message_id, BASE_TIME + int(message_id[1:]), chat_id=chat_id) for message_id in ids]
+        return feishu_im_pb2.GetMessagesResponse(items=items, has_more=bool(next_cursor), next_cursor=next_cursor)
+
+    @asynccontextmanager
+    async def open_fetcher(self, credentials):
+        yield self.fetch_page
+
+
+def make_manager(tmp_path, upstream: FakeUpstream, workers: int = 2, per_credential_limit: int = 2, job_ttl: float = 3600):
+    return ExportJobManager(
+        jobs_dir=str(tmp_path), workers=workers, per_credential_limit=per_credential_limit,
+        open_fetcher=upstream.open_fetcher, credential_key=lambda credentials: credentials["cookie"],
+        job_ttl=job_ttl,
+    )
+
+
+async def wait_status(manager: ExportJobManager, job_id: str, *statuses: str) -> dict:
+    with anyio.fail_after(5):
+        while True:
+            job = manager.get(job_id)
+            if job is not None and job["status"] in statuses:
+                return job
+            await asyncio.sleep(0.01)
+
+
+def read_ids(manager: ExportJobManager, job: dict) -> list:
+    with open(manager.result_path(job), encoding="utf-8") as f:
+        return [json.loads(line)["message_id"] for line in f]
+
+
+async def test_resume_continues_from_checkpoint(tmp_path):
+    upstream = FakeUpstream()
+    blocked = upstream.gate("c2")
+    manager = make_manager(tmp_path, upstream)
+    manager.start()
+    job = await manager.create({"cookie": "a"}, "chat1", EXPORT_FORMAT_NDJSON, 100)
+    with anyio.fail_after(5):
+        while manager.get(job["job_id"])["cursor"] != "c2":
+            await asyncio.sleep(0.01)
+    # 模拟进程退出: 第三页请求挂起时取消所有 worker，并在结果文件末尾留下未记录进断点的半行
+    await manager.stop()
+    saved = manager.get(job["job_id"])
+    assert saved["status"] == JOB_RUNNING and saved["exported"] == 4
+    with open(manager.result_path(saved), "ab") as f:
+        f.write(b'{"message_id":"partial')
+
+    blocked.set()
+    upstream.cursors.clear()
+    resumed = make_manager(tmp_path, upstream)
+    resumed.start()
+    try:
+        done = await wait_status(resumed, job["job_id"], JOB_COMPLETED)
+    finally:
+        await resumed.stop()
+    assert upstream.cursors == [("chat1", "c2")]
+    assert read_ids(resumed, done) == ["m6", "m5", "m4", "m3", "m2", "m1"]
+    assert done["exported"] == 6
+
+
+async def test_finished_job_drops_credentials(tmp_path):
+    upstream = FakeUpstream()
+    upstream.failing.add("broken")
+    manager = make_manager(tmp_path, upstream)
+    manager.start()
+    try:
+        ok = await manager.create({"cookie": "a"}, "chat1", EXPORT_FORMAT_NDJSON, 100)
+        failed = await manager.create({"cookie": "a"}, "broken", EXPORT_FORMAT_NDJSON, 100)
+        await wait_status(manager, ok["job_id"], JOB_COMPLETED)
+        await wait_status(manager, failed["job_id"], JOB_FAILED)
+    finally:
+        await manager.stop()
+    for job in (ok, failed):
+        with open(os.path.join(tmp_path, job["job_id"], "job.json"), encoding="utf-8") as f:
+            assert "credentials" not in json.load(f)
+
+
+async def test_saturated_credential_does_not_block_workers(tmp_path):
+    upstream = FakeUpstream()
+    release_first = upstream.gate("busy")
+    manager = make_manager(tmp_path, upstream, workers=2, per_credential_limit=1)
+    manager.start()
+    try:
+        first = await manager.create({"cookie": "a"}, "busy", EXPORT_FORMAT_NDJSON, 100)
+        second = await manager.create({"cookie": "a"}, "chat2", EXPORT_FORMAT_NDJSON, 100)
+        third = await manager.create({"cookie": "b"}, "chat3", EXPORT_FORMAT_NDJSON, 100)
+        # 凭证 a 的名额被第一个任务占满，第二个任务暂缓，两个 worker 都不应被占住
+        await wait_status(manager, third["job_id"], JOB_COMPLETED)
+        assert manager.get(second["job_id"])["status"] != JOB_COMPLETED
+        assert ("chat2", "0") not in upstream.cursors
+
+        release_first.set()
+        await wait_status(manager, first["job_id"], JOB_COMPLETED)
+        await wait_status(manager, second["job_id"], JOB_COMPLETED)
+    finally:
+        await manager.stop()
+
+
+async def test_sweep_removes_expired_finished_jobs(tmp_path):
+    upstream = FakeUpstream()
+    manager = make_manager(tmp_path, upstream, job_ttl=60)
+    manager.start()
+    await manager.stop()
+    for job_id, status, age in (("old", JOB_COMPLETED, 120), ("recent", JOB_FAILED, 10), ("pending", JOB_RUNNING, 120)):
+        os.makedirs(os.path.join(tmp_path, job_id))
+        with open(os.path.join(tmp_path, job_id, "job.json"), "w", encoding="utf-8") as f:
+            json.dump({"job_id": job_id, "status": status, "updated_at": time.time() - age}, f)
+    assert manager.sweep() == 1
+    assert sorted(os.listdir(tmp_path)) == ["pending", "recent"]
@@ -0,0 +1,167 @@
+# tests/test_message_store.py - 本地消息存储: 全文搜索索引与历史消息同步
+import asyncio
+import time
+
+import pytest
+
+import feishu_im_pb2
+from conftest import BASE_TIME, make_message
+from core.message_store import MessageStore, _SyncState, cjk_bigrams
+from core.wire import HistoryPage
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def store(tmp_path):
+    store = MessageStore(str(tmp_path / "messages.db"), head_ttl=2, live_grace=1, live_max_age=300)
+    # 大量不含查询词的消息，逐行匹配时需要扫描它们
+    await store.upsert(make_message(f"f{i:05d}", BASE_TIME + i, f"第{i}条: 今天的例会改到下午三点") for i in range(2000))
+    await store.upsert([
+        make_message("deploy_ok", BASE_TIME + 5000, "生产环境部署完成"),
+        make_message("deploy_fail", BASE_TIME + 5001, "部署失败，正在回滚 v2"),
+        make_message("team", BASE_TIME + 5002, "部门聚餐改到周五"),
+    ])
+    yield store
+    await store.close()
+
+
+async def _query_plan(store: MessageStore, terms):
+    """返回搜索 SQL 与 EXPLAIN QUERY PLAN 的各步骤。对 messages (别名 m) 的 "SCAN m" 即逐行扫描整张表。"""
+    def explain():
+        sql, params = store._build_search_sql(terms, None, None, None, None, 21, 0)
+        return sql, [row[3] for row in store._connection().execute("EXPLAIN QUERY PLAN " + sql, params)]
+    return await store._run(explain)
+
+
+def test_cjk_bigrams_split_each_run():
+    assert cjk_bigrams("部署完成 ok 回滚") == "部署 署完 完成 回滚"
+    assert cjk_bigrams("a部b") == ""
+    assert cjk_bigrams(None) == ""
+
+
+async def test_two_character_chinese_query_uses_bigram_index(store):
+    result = await store.search("部署")
+    assert {msg.message_id for msg in result.items} == {"deploy_ok", "deploy_fail"}
+
+    sql, plan = await _query_plan(store, ["部署"])
+    assert "LIKE" not in sql
+    assert any("messages_bigram VIRTUAL TABLE" in detail for detail in plan)
+    assert not any(detail.split()[:2] == ["SCAN", "m"] for detail in plan), plan
+
+
+async def test_mixed_terms_combine_both_indexes(store):
+    result = await store.search("部署 正在回滚")
+    assert [msg.message_id for msg in result.items] == ["deploy_fail"]
+
+    sql, plan = await _query_plan(store, ["部署", "正在回滚"])
+    assert "LIKE" not in sql
+    assert not any(detail.split()[:2] == ["SCAN", "m"] for detail in plan), plan
+
+
+async def test_short_non_cjk_terms_fall_back_to_like(store):
+    result = await store.search("部署 v2")
+    assert [msg.message_id for msg in result.items] == ["deploy_fail"]
+    result = await store.search("部")
+    assert {msg.message_id for msg in result.items} == {"deploy_ok", "deploy_fail", "team"}
+
+
+async def test_bigram_index_follows_content_updates(store):
+    await store.upsert([make_message("team", BASE_TIME + 5002, "周五团建")])
+    assert (await store.search("部门")).items == []
+    assert [msg.message_id for msg in (await store.search("团建")).items] == ["team"]
+
+
+async def test_existing_database_is_backfilled(tmp_path):
+    path = str(tmp_path / "old.db")
+    store = MessageStore(path, head_ttl=2, live_grace=1, live_max_age=300)
+    await store.upsert([make_message("m1", BASE_TIME, "部署完成")])
+
+    def drop_bigram_index():
+        conn = store._connection()
+        for name in ("messages_bigram_insert", "messages_bigram_delete", "messages_bigram_update"):
+            conn.execute(f"DROP TRIGGER {name}")
+        conn.execute("DROP TABLE messages_bigram")
+        conn.commit()
+    await store._run(drop_bigram_index)
+    await store.close()
+
+    reopened = MessageStore(path, head_ttl=2, live_grace=1, live_max_age=300)
+    try:
+        assert [msg.message_id for msg in (await reopened.search("部署")).items] == ["m1"]
+    finally:
+        await reopened.close()
+
+
+class FakeProvider:
+    """
+    上游历史 (新到旧，每页最多 page_limit 条)。get_history_messages 模拟经过分页缓存的读取:
+    第一页返回首次请求时的快照；fetch_history_page 总是读取上游最新数据。
+    """
+
+    def __init__(self, count: int, page_limit: int = 20):
+        self.messages = [make_message(f"m{i:03d}", BASE_TIME + i) for i in reversed(range(count))]
+        self.page_limit = page_limit
+        self.cached_head = None
+        self.calls = []
+
+    def _page(self, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+        offset = int(cursor)
+        end = offset + min(count, self.page_limit)
+        return feishu_im_pb2.GetMessagesResponse(
+            items=self.messages[offset:end], has_more=end < len(self.messages), next_cursor=str(end),
+        )
+
+    async def fetch_history_page(self, chat_id: str, count: int, cursor: str) -> HistoryPage:
+        self.calls.append(("upstream", cursor))
+        await asyncio.sleep(0.01)
+        return HistoryPage(self._page(count, cursor).SerializeToString())
+
+    async def get_history_messages(self, chat_id: str, count: int, cursor: str) -> feishu_im_pb2.GetMessagesResponse:
+        self.calls.append(("cached", cursor))
+        await asyncio.sleep(0.01)
+        if cursor == "0":
+            if self.cached_head is None:
+                self.cached_head = self._page(count, cursor)
+            return self.cached_head
+        return self._page(count, cursor)
+
+
+@pytest.fixture
+async def history_store(tmp_path):
+    store = MessageStore(str(tmp_path / "history.db"), head_ttl=0, live_grace=1, live_max_age=300)
+    yield store
+    await store.close()
+
+
+async def test_head_refresh_bypasses_page_cache(history_store):
+    provider = FakeProvider(30)
+    provider.cached_head = provider._page(10, "0")
+    provider.messages.insert(0, make_message("new", BASE_TIME + 100))
+    page = await history_store.get_history(provider, "chat1", 10, "0")
+    assert page.items[0].message_id == "new"
+    assert ("cached", "0") not in provider.calls
+
+
+async def test_concurrent_requests_sync_once(tmp_path):
+    store = MessageStore(str(tmp_path / "history.db"), head_ttl=60, live_grace=1, live_max_age=300)
+    provider = FakeProvider(100)
+    try:
+        pages = await asyncio.gather(*(store.get_history(provider, "chat1", 30, "0") for _ in range(3)))
+    finally:
+        await store.close()
+    expected = [f"m{i:03d}" for i in range(99, 69, -1)]
+    assert all([msg.message_id for msg in page.items] == expected for page in pages)
+    # 第一个请求刷新头部 (20 条) 并补齐尾部，其余请求直接读本地
+    assert provider.calls == [("upstream", "0"), ("cached", "20")]
+
+
+async def test_live_chat_freshness_is_capped(history_store):
+    now = time.time()
+    history_store._live["chat1"] = (now - 1000, 1)
+    recent = _SyncState(0, 0, "0", False, head_synced_at=now - 10)
+    stale = _SyncState(0, 0, "0", False, head_synced_at=now - 301)
+    assert history_store._head_is_fresh("chat1", recent)
+    assert not history_store._head_is_fresh("chat1", stale)
+    # 没有实时流覆盖的会话只看 head_ttl
+    assert not history_store._head_is_fresh("chat2", recent)
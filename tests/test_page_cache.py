@@ -0,0 +1,74 @@
+# tests/test_page_cache.py - 历史分页缓存: 并发未命中合并、领头者取消与过期
+import asyncio
+
+import pytest
+
+from core.page_cache import PageCache
+
+pytestmark = pytest.mark.anyio
+
+
+class SlowLoader:
+    def __init__(self, delay: float = 0.05, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return f"v{self.calls}"
+
+
+async def test_concurrent_misses_share_one_load():
+    cache, loader = PageCache(10, head_ttl=5, page_ttl=5), SlowLoader()
+    results = await asyncio.gather(*(cache.get_or_load("k", loader, is_head=False) for _ in range(5)))
+    assert results == ["v1"] * 5 and loader.calls == 1
+    assert cache.stats()["coalesced"] == 4 and cache.stats()["inflight"] == 0
+    # 之后命中缓存，不再调用上游
+    assert await cache.get_or_load("k", loader, is_head=False) == "v1"
+    assert loader.calls == 1 and cache.hits == 1
+
+
+async def test_cancelled_leader_hands_over_to_a_waiter():
+    cache, loader = PageCache(10, head_ttl=5, page_ttl=5), SlowLoader()
+    leader = asyncio.create_task(cache.get_or_load("k", loader, is_head=False))
+    await asyncio.sleep(0.01)
+    waiters = [asyncio.create_task(cache.get_or_load("k", loader, is_head=False)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    results = await asyncio.gather(leader, *waiters, return_exceptions=True)
+    assert isinstance(results[0], asyncio.CancelledError)
+    # 一个等待者重新加载，其余合并到它上面
+    assert results[1:] == ["v2"] * 3 and loader.calls == 2
+
+
+async def test_cancelled_waiter_does_not_cancel_the_load():
+    cache, loader = PageCache(10, head_ttl=5, page_ttl=5), SlowLoader()
+    leader = asyncio.create_task(cache.get_or_load("k", loader, is_head=False))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(cache.get_or_load("k", loader, is_head=False))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    assert isinstance((await asyncio.gather(waiter, return_exceptions=True))[0], asyncio.CancelledError)
+    assert await leader == "v1"
+
+
+async def test_errors_reach_every_waiter_and_are_not_cached():
+    cache, loader = PageCache(10, head_ttl=5, page_ttl=5), SlowLoader(error=ValueError("上游错误"))
+    results = await asyncio.gather(*(cache.get_or_load("k", loader, is_head=False) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results) and loader.calls == 1
+    loader.error = None
+    assert await cache.get_or_load("k", loader, is_head=False) == "v2"
+
+
+async def test_head_pages_expire_sooner_than_older_pages():
+    cache, loader = PageCache(10, head_ttl=0.05, page_ttl=5), SlowLoader(delay=0)
+    await cache.get_or_load("head", loader, is_head=True)
+    await cache.get_or_load("page", loader, is_head=False)
+    await asyncio.sleep(0.06)
+    assert await cache.get_or_load("head", loader, is_head=True) == "v3"
+    assert await cache.get_or_load("page", loader, is_head=False) == "v2"
+    assert cache.expirations == 1
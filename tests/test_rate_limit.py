@@ -0,0 +1,68 @@
+# tests/test_rate_limit.py - 令牌桶、熔断器与按 cookie 的上游守卫
+import time
+
+import pytest
+
+from core.rate_limit import CircuitBreaker, CircuitOpenError, TokenBucket, UpstreamGuard
+
+pytestmark = pytest.mark.anyio
+
+
+def test_token_bucket_allows_burst_then_reports_wait():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 0.1
+    assert bucket.throttled == 1
+
+
+async def test_token_bucket_reservations_are_spaced_by_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+    started = time.monotonic()
+    for _ in range(3):
+        await bucket.acquire()
+    # 第一个令牌立即可用，其后每个间隔 1/50 秒
+    assert time.monotonic() - started >= 0.035
+    assert bucket.throttled == 2 and bucket.waiting == 0
+
+
+def test_circuit_breaker_opens_after_threshold_and_resets_on_success():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_auth_failure()
+    breaker.check()
+    breaker.record_auth_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record_success()
+    breaker.check()
+
+
+async def test_guard_evicts_idle_entries_only():
+    guard = UpstreamGuard(idle_ttl=60)
+    for cookie in ("a", "b", "c"):
+        await guard.acquire(cookie, "history", "history")
+        guard.record_status(cookie, 0)
+    for _ in range(3):
+        guard.record_status("c", 401)
+    assert guard.stats()["buckets"] == 3 and guard.stats()["breakers"] == 3
+
+    # 还在 TTL 内: 全部保留
+    assert guard.sweep(time.monotonic() + 30) == 0
+    # 超过 TTL: 补满的桶与未熔断的熔断器被丢弃，正在熔断的 c 保留，以免清理绕过熔断
+    later = time.monotonic() + 120
+    assert guard.sweep(later) == 5
+    stats = guard.stats()
+    assert stats["buckets"] == 0 and stats["breakers"] == 1 and stats["evictions"] == 5
+    with pytest.raises(CircuitOpenError):
+        await guard.acquire("c", "history", "history")
+
+
+def test_guard_keeps_buckets_that_have_not_refilled():
+    guard = UpstreamGuard(idle_ttl=1)
+    bucket = guard._bucket("a", "history", "history")
+    bucket.rate, bucket.burst = 0.001, 5
+    for _ in range(5):
+        bucket.try_acquire()
+    # 空闲已超过 TTL，但令牌远未补满: 丢弃会让该 cookie 立即获得一整个突发额度
+    assert guard.sweep(time.monotonic() + 10) == 0
+    assert guard.stats()["buckets"] == 1
@@ -0,0 +1,54 @@
+# tests/test_replay.py - 续传令牌与重放缓冲区
+import pytest
+
+from conftest import BASE_TIME, make_message
+from core.replay import ReplayBuffer, messages_after, parse_resume_token
+
+T = BASE_TIME
+
+
+def ids(messages) -> list:
+    return [msg.message_id for msg in messages]
+
+
+# 同一毫秒内的 a、b、c 按投递顺序排列
+TIMELINE = [make_message("old", T - 1), make_message("a", T), make_message("b", T), make_message("c", T), make_message("d", T + 1)]
+
+
+def test_parse_resume_token():
+    assert parse_resume_token(f"{T}:b") == (T, "b")
+    assert parse_resume_token(f" {T} ") == (T, "")
+    with pytest.raises(ValueError):
+        parse_resume_token("abc:b")
+
+
+@pytest.mark.parametrize("since_id, expected", [
+    ("a", ["b", "c", "d"]),
+    ("b", ["c", "d"]),
+    ("c", ["d"]),
+    ("", ["d"]),  # 只有时间戳: 该毫秒视为已全部收到
+    ("unknown", ["a", "b", "c", "d"]),  # 无法定位: 该毫秒全部重发，不遗漏
+])
+def test_same_millisecond_resume_skips_through_since_id(since_id, expected):
+    assert ids(messages_after(TIMELINE, T, since_id)) == expected
+
+
+def test_buffer_replay_resumes_within_the_same_millisecond():
+    buffer = ReplayBuffer(per_chat_capacity=10, max_chats=10)
+    buffer.reset("key", "chat1", complete_after=T - 10)
+    for msg in TIMELINE:
+        buffer.append("key", msg)
+    assert ids(buffer.replay("key", "chat1", T, "b")) == ["c", "d"]
+    assert ids(buffer.replay("key", "chat1", T, "")) == ["d"]
+    # 令牌早于缓冲覆盖范围: 由调用方回退到历史消息
+    assert buffer.replay("key", "chat1", T - 20, "") is None
+
+
+def test_buffer_eviction_moves_coverage_forward():
+    buffer = ReplayBuffer(per_chat_capacity=2, max_chats=10)
+    buffer.reset("key", "chat1", complete_after=T - 10)
+    for msg in TIMELINE:
+        buffer.append("key", msg)
+    assert ids(buffer.recent("key", "chat1")) == ["c", "d"]
+    assert buffer.replay("key", "chat1", T - 1, "old") is None
+    assert ids(buffer.replay("key", "chat1", T, "c")) == ["d"]
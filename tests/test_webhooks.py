@@ -0,0 +1,141 @@
+# tests/test_webhooks.py - Webhook 推送: 地址检查、磁盘溢出后的投递顺序与认证信息清理
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
+import anyio
+import httpx
+import pytest
+
+from conftest import BASE_TIME, make_message
+from core.webhooks import WebhookManager, WebhookURLError, check_webhook_url
+
+pytestmark = pytest.mark.anyio
+
+HOOK_URL = "http://hooks.example/feishu"
+CREDENTIALS = {"cookie": "session=secret"}
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://localhost:8008/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://100.64.0.1/hook",
+    "http://0.0.0.0/hook",
+    "ftp://93.184.216.34/hook",
+])
+async def test_rejects_non_public_destinations(url):
+    with pytest.raises(WebhookURLError):
+        await check_webhook_url(url, allowed_hosts=())
+
+
+async def test_allows_public_address_and_allowlisted_hosts():
+    await check_webhook_url("https://93.184.216.34/hook", allowed_hosts=())
+    # 白名单中的主机可以是内网地址，白名单之外的主机一律拒绝
+    await check_webhook_url("http://10.0.0.5:9000/hook", allowed_hosts=("10.0.0.5",))
+    with pytest.raises(WebhookURLError):
+        await check_webhook_url("https://93.184.216.34/hook", allowed_hosts=("10.0.0.5",))
+
+
+class FakeFeed:
+    """按 chat_id 推送的实时消息源，供 WebhookManager.subscribe 使用。"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    @asynccontextmanager
+    async def subscribe(self, credentials, chat_id):
+        async def messages():
+            while True:
+                yield await self.queue.get()
+        yield messages()
+
+
+class Receiver:
+    def __init__(self):
+        self.batches = []
+        self.open = asyncio.Event()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await self.open.wait()
+        self.batches.append([msg["message_id"] for msg in json.loads(request.content)["messages"]])
+        return httpx.Response(200)
+
+    @property
+    def delivered(self) -> list:
+        return [message_id for batch in self.batches for message_id in batch]
+
+
+def make_manager(tmp_path, feed: FakeFeed, receiver: Receiver, allowed_hosts=("hooks.example",)) -> WebhookManager:
+    return WebhookManager(
+        root_dir=str(tmp_path), subscribe=feed.subscribe,
+        client_factory=lambda: httpx.AsyncClient(transport=httpx.MockTransport(receiver.handle)),
+        batch_size=3, flush_ms=20, queue_size=2, spill_max_bytes=1 << 20,
+        backoff_base=0.01, backoff_max=0.05, rescan_interval=0.05, allowed_hosts=allowed_hosts,
+    )
+
+
+async def test_spilled_messages_are_delivered_in_order(tmp_path):
+    feed, receiver = FakeFeed(), Receiver()
+    manager = make_manager(tmp_path, feed, receiver)
+    manager.start()
+    try:
+        target = await manager.create(CREDENTIALS, "chat1", HOOK_URL)
+        expected = [f"m{i}" for i in range(20)]
+        for i, message_id in enumerate(expected):
+            feed.queue.put_nowait(make_message(message_id, BASE_TIME + i))
+        # 接收端暂停期间内存队列 (2 条) 很快占满，后续消息溢出到磁盘
+        with anyio.fail_after(5):
+            while manager.public_view(target)["delivery"]["spilled"] == 0 or not feed.queue.empty():
+                await asyncio.sleep(0.01)
+        receiver.open.set()
+        with anyio.fail_after(5):
+            while len(receiver.delivered) < len(expected):
+                await asyncio.sleep(0.01)
+        assert receiver.delivered == expected
+        assert all(len(batch) <= 3 for batch in receiver.batches)
+        assert manager.public_view(target)["delivery"]["spill_bytes"] == 0
+    finally:
+        await manager.stop()
+
+
+async def test_delete_removes_stored_credentials(tmp_path):
+    feed, receiver = FakeFeed(), Receiver()
+    manager = make_manager(tmp_path, feed, receiver)
+    manager.start()
+    try:
+        target = await manager.create(CREDENTIALS, "chat1", HOOK_URL, secret="s3")
+        assert await manager.delete(target["target_id"])
+        assert not os.path.exists(os.path.join(tmp_path, target["target_id"]))
+        assert manager.get(target["target_id"]) is None
+    finally:
+        await manager.stop()
+
+
+async def test_target_failing_the_address_check_is_disabled(tmp_path):
+    feed, receiver = FakeFeed(), Receiver()
+    receiver.open.set()
+    manager = make_manager(tmp_path, feed, receiver)
+    manager.start()
+    try:
+        target = await manager.create(CREDENTIALS, "chat1", HOOK_URL, secret="s3")
+        # 注册之后白名单被收紧 (与 DNS 记录被改到内网一样): 下一次投递前检查失败，目标停用
+        manager._allowed_hosts = ("other.example",)
+        feed.queue.put_nowait(make_message("m1", BASE_TIME))
+        with anyio.fail_after(5):
+            while not (manager.get(target["target_id"]) or {}).get("disabled"):
+                await asyncio.sleep(0.01)
+        with open(os.path.join(tmp_path, target["target_id"], "target.json"), encoding="utf-8") as f:
+            stored = json.load(f)
+        assert "credentials" not in stored and "secret" not in stored
+        assert receiver.batches == []
+        with anyio.fail_after(5):
+            while target["target_id"] in manager._runners:
+                await asyncio.sleep(0.01)
+    finally:
+        await manager.stop()